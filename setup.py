@@ -15,8 +15,8 @@ except ImportError:
 
 
 # Check python version info
-if sys.version_info < (3, 0, 0):
-    raise Exception("Tornado-Profiler only support Python 3.0.0+")
+if sys.version_info < (3, 7, 0):
+    raise Exception("Tornado-Profiler only support Python 3.7.0+")
 
 version = re.compile(r'__version__\s*=\s*"(.*?)"')
 
@@ -47,10 +47,11 @@ def get_classifiers():
     return [
         "License :: OSI Approved :: BSD License",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Programming Language :: Python :: Implementation :: CPython",
         "Programming Language :: Python :: Implementation :: PyPy",
         "Operating System :: OS Independent",
@@ -93,4 +94,5 @@ if __name__ == "__main__":
         packages=find_packages(exclude=["tests", "tests.*"]),
         package_data=get_package_data(),
         install_requires=get_install_requires(),
+        python_requires=">=3.7",
     )
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.testing
+
+from tornado_profiler.backend import as_async
+from tornado_profiler.backend._memory import Memory
+
+
+class _Memory(Memory):
+    """Record threads measurements are fetched in"""
+
+    def __init__(self, nonblock=True, **kwargs):
+        super(_Memory, self).__init__(**kwargs)
+        self.nonblock = nonblock
+        self.threads = set()
+
+    def is_nonblock(self):
+        return self.nonblock
+
+    def iter_measurements(self, chunk_size=1000, **kwargs):
+        for measurement in super(_Memory, self).iter_measurements(
+                chunk_size=chunk_size, **kwargs):
+            self.threads.add(threading.current_thread().name)
+            yield measurement
+
+
+def make_record(i):
+    return dict(name="/r%d" % (i % 3), method="GET",
+                begin_time=1000.0 + i, finish_time=1000.5 + i,
+                elapse_time=0.5, status=200)
+
+
+class SyncBackendAdapterTest(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(SyncBackendAdapterTest, self).setUp()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="export")
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+        super(SyncBackendAdapterTest, self).tearDown()
+
+    def render(self, measurements):
+        return (threading.current_thread().name,
+                [measurement["id"] for measurement in measurements])
+
+    async def export(self, backend, **kwargs):
+        backend.insert_many([make_record(i) for i in range(25)])
+        chunks = []
+        async for chunk in as_async(backend, self.executor).iter_chunks(
+                render=self.render, chunk_size=10, **kwargs):
+            chunks.append(chunk)
+        return chunks
+
+    @tornado.testing.gen_test
+    async def test_nonblock_fetched_on_loop(self):
+        backend = _Memory()
+        chunks = await self.export(backend)
+        self.assertEqual([ids for _, ids in chunks],
+                         [list(range(1, 11)), list(range(11, 21)),
+                          list(range(21, 26))])
+        # NOTE: rendered in the executor, fetched on the IOLoop
+        self.assertTrue(all(name.startswith("export") for name, _ in chunks))
+        self.assertEqual(backend.threads,
+                         set([threading.current_thread().name]))
+
+    @tornado.testing.gen_test
+    async def test_blocking_fetched_in_executor(self):
+        backend = _Memory(nonblock=False)
+        chunks = await self.export(backend, name="/r1")
+        self.assertEqual(sum(len(ids) for _, ids in chunks), 8)
+        self.assertTrue(all(name.startswith("export")
+                            for name in backend.threads))
+
+    @tornado.testing.gen_test
+    async def test_consumer_gone(self):
+        backend = _Memory()
+        backend.insert_many([make_record(i) for i in range(100)])
+        chunks = as_async(backend, self.executor).iter_chunks(
+            render=self.render, chunk_size=10, max_chunks=1)
+        async for _ in chunks:
+            break
+        await chunks.aclose()
+        # NOTE: the producer gives the only worker back
+        await asyncio.wrap_future(self.executor.submit(lambda: None))
+
+
+if __name__ == '__main__':
+    unittest.main()
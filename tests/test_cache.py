@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+from tornado_profiler.cache import CachedBackend
+
+
+class _Backend(object):
+
+    def __init__(self):
+        self.calls = []
+        self.release = None
+
+    async def filter(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.release is not None:
+            await self.release.wait()
+        return [dict(kwargs, call=len(self.calls))]
+
+    async def purge(self):
+        return 0
+
+
+class CachedBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _Backend()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_cached_until_invalidated(self):
+        cache = CachedBackend(self.backend, ttl=60)
+        first = self.run_async(cache.filter(name="/a", limit=None))
+        self.assertIs(self.run_async(cache.filter(name="/a")), first)
+        self.assertEqual(len(self.backend.calls), 1)
+        cache.invalidate()
+        self.assertIsNot(self.run_async(cache.filter(name="/a")), first)
+        self.assertEqual(cache.stats(), dict(hits=1, misses=2, coalesced=0,
+                                             entries=1))
+
+    def test_closed_ranges_survive_invalidation(self):
+        cache = CachedBackend(self.backend, ttl=60)
+        past = self.run_async(cache.filter(begin_time=100.0,
+                                           finish_time=200.0))
+        recent = self.run_async(cache.filter(begin_time=250.0))
+        latest = self.run_async(cache.filter(limit=10))
+        # NOTE: datas stored from 210 to 260
+        cache.invalidate(210.0, 260.0)
+        self.assertIs(self.run_async(cache.filter(
+            begin_time=100.0, finish_time=200.0)), past)
+        self.assertIsNot(self.run_async(cache.filter(begin_time=250.0)),
+                         recent)
+        self.assertIsNot(self.run_async(cache.filter(limit=10)), latest)
+        # NOTE: too many invalidations since the result was cached
+        for _ in range(CachedBackend.MAX_INVALIDATIONS):
+            cache.invalidate(300.0, 310.0)
+        self.assertIsNot(self.run_async(cache.filter(
+            begin_time=100.0, finish_time=200.0)), past)
+
+    def test_expired(self):
+        cache = CachedBackend(self.backend, ttl=0)
+        self.run_async(cache.filter(name="/a"))
+        self.run_async(cache.filter(name="/a"))
+        self.assertEqual(len(self.backend.calls), 2)
+
+    def test_least_recently_used_evicted(self):
+        cache = CachedBackend(self.backend, max_entries=2, ttl=60)
+        for name in ("/a", "/b", "/a", "/c", "/a", "/b"):
+            self.run_async(cache.filter(name=name))
+        self.assertEqual([kwargs["name"] for kwargs in self.backend.calls],
+                         ["/a", "/b", "/c", "/b"])
+
+    def test_concurrent_queries_coalesced(self):
+        cache = CachedBackend(self.backend, ttl=60)
+
+        async def query():
+            self.backend.release = asyncio.Event()
+            tasks = [asyncio.ensure_future(cache.filter(name="/a"))
+                     for _ in range(3)]
+            await asyncio.sleep(0)
+            self.backend.release.set()
+            return await asyncio.gather(*tasks)
+
+        results = self.run_async(query())
+        self.assertEqual(len(self.backend.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(cache.stats()["coalesced"], 2)
+
+    def test_invalidated_while_running(self):
+        cache = CachedBackend(self.backend, ttl=60)
+
+        async def query():
+            self.backend.release = asyncio.Event()
+            task = asyncio.ensure_future(cache.filter(name="/a"))
+            await asyncio.sleep(0)
+            cache.invalidate()
+            self.backend.release.set()
+            return await task
+
+        self.run_async(query())
+        self.backend.release = None
+        self.run_async(cache.filter(name="/a"))
+        self.assertEqual(len(self.backend.calls), 2)
+
+    def test_other_attributes_delegated(self):
+        cache = CachedBackend(self.backend)
+        self.assertEqual(self.run_async(cache.purge()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import unittest
+
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+
+from tornado_profiler.capture import ContextCapture
+
+
+def make_request(body=b""):
+    headers = HTTPHeaders({"Host": "example.com", "User-Agent": "test",
+                           "Authorization": "secret",
+                           "Cookie": "session=abc; theme=dark"})
+    return HTTPServerRequest(method="POST", uri="/users/1?q=x",
+                             headers=headers, body=body, host="example.com")
+
+
+class ContextCaptureTest(unittest.TestCase):
+
+    def capture(self, path_args=None, extensions=None, body=b"", **kwargs):
+        capture = ContextCapture(**kwargs)
+        request = make_request(body)
+        request.arguments = {"q": [b"x"]}
+        return capture.render(capture.snapshot(request, path_args,
+                                               extensions))
+
+    def test_unknown_level(self):
+        with self.assertRaises(ValueError):
+            ContextCapture(level="all")
+
+    def test_none(self):
+        self.assertIsNone(self.capture(level="none"))
+        self.assertEqual(self.capture(level="none",
+                                      extensions={"http_calls": []}),
+                         {"http_calls": []})
+
+    def test_minimal(self):
+        context = self.capture(level="minimal", path_args={"id": b"1"})
+        self.assertEqual(context["full_url"], "http://example.com/users/1?q=x")
+        self.assertEqual(context["id"], "1")
+        self.assertNotIn("headers", context)
+        self.assertNotIn("body", context)
+
+    def test_headers(self):
+        context = self.capture(level="headers",
+                               header_deny=["authorization"])
+        self.assertNotIn("Authorization", context["headers"])
+        self.assertEqual(context["headers"]["User-Agent"], "test")
+        self.assertEqual(context["cookies"],
+                         {"session": "abc", "theme": "dark"})
+        self.assertNotIn("arguments", context)
+
+    def test_header_allow(self):
+        context = self.capture(level="headers", header_allow=["Host"])
+        self.assertEqual(context["headers"], {"Host": "example.com"})
+        self.assertEqual(context["cookies"], {})
+
+    def test_full(self):
+        context = self.capture(level="full", body=b"hello")
+        self.assertEqual(context["arguments"], {"q": ["x"]})
+        self.assertEqual(base64.b64decode(context["body"]), b"hello")
+        self.assertNotIn("body_truncated", context)
+
+    def test_body_truncated_at_cap(self):
+        context = self.capture(level="full", body=b"x" * 100,
+                               max_body_size=10)
+        self.assertEqual(base64.b64decode(context["body"]), b"x" * 10)
+        self.assertTrue(context["body_truncated"])
+        self.assertEqual(context["body_size"], 100)
+
+        context = self.capture(level="full", body=b"x" * 10,
+                               max_body_size=10)
+        self.assertNotIn("body_truncated", context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import json
+import time
+import signal
+import unittest
+
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+from tornado_profiler.cpu import CPUSampler, IDLE_ROUTE
+
+
+def spin(seconds):
+    deadline = time.process_time() + seconds
+    while time.process_time() < deadline:
+        pass
+
+
+class _Tracker(object):
+
+    def current(self, loop):
+        return None
+
+
+class CPUSamplerTest(unittest.TestCase):
+
+    def sample(self, sampler):
+        sampler._sample(signal.SIGPROF, sys._getframe())
+
+    def test_collapsed_outermost_first(self):
+        sampler = CPUSampler(_Tracker(), max_depth=2)
+        for _ in range(3):
+            self.sample(sampler)
+        stacks = sampler.collapsed()
+        self.assertEqual(list(stacks.values()), [3])
+        outer, inner = list(stacks)[0].split(";")
+        self.assertTrue(inner.startswith("sample ("))
+        self.assertTrue(outer.startswith("test_collapsed_outermost_first ("))
+        self.assertEqual(sampler.routes(), [dict(name=IDLE_ROUTE, method="",
+                                                 samples=3)])
+        self.assertEqual(sampler.collapsed(name="/other"), {})
+
+    def test_new_stacks_dropped_beyond_max(self):
+        sampler = CPUSampler(_Tracker(), max_stacks=1)
+        self.sample(sampler)
+        self.sample(sampler)
+        # NOTE: sampled from another line, so another stack
+        sampler._sample(signal.SIGPROF, sys._getframe())
+        stats = sampler.stats()
+        self.assertEqual((stats["samples"], stats["dropped"],
+                          stats["stacks"]), (3, 1, 1))
+        sampler.reset()
+        self.assertEqual(sampler.stats()["samples"], 0)
+
+
+class FlameGraphHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        class CPUHandler(tornado.web.RequestHandler):
+
+            def get(self):
+                spin(0.3)
+                self.write("ok")
+
+        app = tornado.web.Application([(r"/cpu", CPUHandler)])
+        self.profiler = Profiler(Memory(), cache_ttl=None,
+                                 cpu_sample_interval=0.005)
+        self.profiler.init_app(app)
+        return app
+
+    def tearDown(self):
+        self.profiler.cpu_sampler.stop()
+        super(FlameGraphHandlerTest, self).tearDown()
+
+    def fetch_json(self, url):
+        response = self.fetch("/tornado-profiler/api/flamegraph" + url)
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_route_sampled(self):
+        self.assertEqual(self.fetch("/cpu").body, b"ok")
+        routes = self.fetch_json("")["routes"]
+        route = [route for route in routes if route["name"] == "/cpu"][0]
+        self.assertEqual(route["method"], "GET")
+        self.assertGreater(route["samples"], 10)
+
+        stacks = self.fetch_json("?name=/cpu&method=GET")["stacks"]
+        self.assertEqual(sum(stack["samples"] for stack in stacks),
+                         route["samples"])
+        self.assertTrue(all(stack["stack"].split(";")[-1].startswith(
+            "spin (") for stack in stacks[:1]))
+
+        response = self.fetch(
+            "/tornado-profiler/api/flamegraph?name=/cpu&format=collapsed")
+        self.assertTrue(response.headers["Content-Type"].startswith(
+            "text/plain"))
+        lines = response.body.decode().splitlines()
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in lines),
+                         route["samples"])
+        self.assertEqual(self.fetch(
+            "/tornado-profiler/api/flamegraph?format=svg").code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
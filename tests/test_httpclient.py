@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import unittest
+
+import tornado.web
+import tornado.testing
+from tornado.httpclient import AsyncHTTPClient
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+from tornado_profiler.httpclient import url_template
+
+
+class UrlTemplateTest(unittest.TestCase):
+
+    def test_ids_and_query_stripped(self):
+        self.assertEqual(url_template("http://u:p@api:8080/users/42?x=1#y"),
+                         "http://api:8080/users/{id}")
+        self.assertEqual(url_template(
+            "https://api/orders/123e4567-e89b-12d3-a456-426614174000/items"),
+            "https://api/orders/{id}/items")
+        self.assertEqual(url_template("http://api/blobs/0123456789abcdef0"),
+                         "http://api/blobs/{id}")
+        self.assertEqual(url_template("http://api/users/me"),
+                         "http://api/users/me")
+
+
+class HTTPClientInstrumentTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        test = self
+
+        class DownHandler(tornado.web.RequestHandler):
+
+            async def get(self, _id):
+                await asyncio.sleep(0.05)
+                if _id == "404":
+                    raise tornado.web.HTTPError(404)
+                self.write("y" * 100)
+
+        class UpHandler(tornado.web.RequestHandler):
+
+            async def get(self):
+                client = AsyncHTTPClient()
+                # NOTE: calls in parallel wait for 0.05s, not 0.1s
+                await asyncio.gather(client.fetch(test.get_url("/down/1?q")),
+                                     client.fetch(test.get_url("/down/2")))
+                await client.fetch(test.get_url("/down/404"),
+                                   raise_error=False)
+                self.write("ok")
+
+        app = tornado.web.Application([(r"/up", UpHandler),
+                                       (r"/down/(\d+)", DownHandler)])
+        self.backend = Memory()
+        self.fetch_ = AsyncHTTPClient.fetch
+        Profiler(self.backend, cache_ttl=None, flush_interval=0.01,
+                 trace_http=True, max_http_calls=2).init_app(app)
+        return app
+
+    def tearDown(self):
+        AsyncHTTPClient.fetch = self.fetch_
+        super(HTTPClientInstrumentTest, self).tearDown()
+
+    def wait_measurement(self, name):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.io_loop.run_sync(lambda: asyncio.sleep(0.02))
+            measurements = self.backend.filter(name=name)
+            if measurements:
+                return self.backend.filter(id=measurements[0]["id"])
+        self.fail("No measurement of %s stored" % name)
+
+    def test_calls_recorded(self):
+        self.assertEqual(self.fetch("/up").body, b"ok")
+        measurement = self.wait_measurement("/up")
+        metrics = measurement["metrics"]
+        self.assertEqual(metrics["http.count"], 3)
+        self.assertGreaterEqual(metrics["http.time"], 0.15)
+        self.assertGreaterEqual(metrics["http.wait"], 0.1)
+        self.assertLess(metrics["http.wait"], metrics["http.time"])
+
+        # NOTE: only max_http_calls calls are kept
+        calls = measurement["context"]["http_calls"]
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(call["url"] for call in calls),
+                         [self.get_url("/down/{id}")] * 2)
+        self.assertEqual([call["status"] for call in calls], [200, 200])
+        self.assertEqual([call["response_size"] for call in calls],
+                         [100, 100])
+
+    def test_calls_outside_requests_ignored(self):
+        self.assertEqual(self.fetch("/down/1").code, 200)
+        measurement = self.wait_measurement(r"/down/(\d+)")
+        self.assertNotIn("http.count", measurement["metrics"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import tracemalloc
+
+from tornado_profiler import memory
+from tornado_profiler.memory import MemoryProfiler
+from tornado_profiler.routing import RouteRegistry
+from tornado_profiler.trace import RequestTrace
+
+
+class _Request(object):
+    pass
+
+
+class _Handler(object):
+
+    def __init__(self, route):
+        self.request = _Request()
+        self.request.profiler_route_ = route
+        self.profiler_trace_ = RequestTrace()
+
+
+class MemoryProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.route = RouteRegistry().register("/leak")
+
+    def profile(self, profiler, allocate):
+        handler = _Handler(self.route)
+        profiler.begin(handler)
+        kept = allocate()
+        profiler.end(handler)
+        return kept, handler.profiler_trace_
+
+    def test_sites_of_kept_allocations(self):
+        profiler = MemoryProfiler(rate=1.0, max_sites=2)
+        kept, trace = self.profile(
+            profiler, lambda: [bytearray(1000) for _ in range(1000)])
+        self.assertFalse(tracemalloc.is_tracing())
+        result = trace.extensions["memory"]
+        self.assertIn(len(result["sites"]), (1, 2))
+        self.assertIn(__file__, result["sites"][0]["site"])
+        self.assertGreaterEqual(result["sites"][0]["size"], 1000 * 1000)
+        self.assertGreaterEqual(result["delta"], 1000 * 1000)
+        self.assertGreaterEqual(result["peak"], result["delta"])
+        self.assertEqual(trace.metrics["memory.samples"], 1)
+
+    def test_without_sites(self):
+        profiler = MemoryProfiler(rate=1.0, max_sites=0)
+        kept, trace = self.profile(profiler, lambda: bytearray(100000))
+        self.assertEqual(trace.extensions["memory"]["sites"], [])
+        self.assertGreaterEqual(trace.metrics["memory.delta"], 100000)
+
+    def test_peak_without_reset_peak(self):
+        profiler = MemoryProfiler(rate=1.0, max_sites=0)
+        reset_peak = memory._RESET_PEAK
+        memory._RESET_PEAK = False
+        try:
+            kept, trace = self.profile(profiler, lambda: bytearray(100000))
+        finally:
+            memory._RESET_PEAK = reset_peak
+        self.assertGreaterEqual(trace.metrics["memory.peak"], 100000)
+
+    def test_not_sampled(self):
+        profiler = MemoryProfiler(rate=0.0)
+        kept, trace = self.profile(profiler, lambda: None)
+        self.assertEqual(trace.metrics, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from tornado_profiler.backend._memory import Memory
+
+
+def make_record(i, elapse_time=None):
+    return dict(name="/r%d" % (i % 2), method="GET",
+                begin_time=1000.0 + i, finish_time=1000.5 + i,
+                elapse_time=elapse_time or 0.1 * (i + 1),
+                status=500 if i % 5 == 0 else 200)
+
+
+class MemoryTest(unittest.TestCase):
+
+    def test_evict_oldest(self):
+        backend = Memory(max_records=3)
+        backend.insert_many([make_record(i) for i in range(5)])
+        self.assertEqual(len(backend), 3)
+        self.assertIsNone(backend.filter(id=2))
+        self.assertEqual(backend.filter(id=3)["name"], "/r0")
+        self.assertEqual([record["id"] for record in backend.filter(
+            sort="id,asc")], [3, 4, 5])
+        self.assertEqual([record["id"] for record in backend.filter(
+            name="/r1")], [4])
+
+    def test_groups_follow_eviction(self):
+        backend = Memory(max_records=3)
+        backend.insert_many([make_record(i) for i in range(5)])
+        groups = dict((group["name"], group) for group in backend.group())
+        self.assertEqual(groups["/r0"]["count"], 2)
+        self.assertEqual(groups["/r1"]["count"], 1)
+        # NOTE: the only error was evicted
+        self.assertEqual(groups["/r0"]["errors"], 0)
+        # NOTE: the min of /r0 was evicted and is recomputed
+        self.assertAlmostEqual(groups["/r0"]["min"], 0.3)
+        self.assertAlmostEqual(groups["/r0"]["max"], 0.5)
+
+        backend.insert_many([make_record(6), make_record(8)])
+        groups = dict((group["name"], group) for group in backend.group())
+        self.assertEqual(list(groups), ["/r0"])
+        self.assertEqual(groups["/r0"]["count"], 3)
+
+    def test_compaction_keeps_ids(self):
+        backend = Memory(max_records=10)
+        backend.insert_many([make_record(i) for i in range(3000)])
+        self.assertEqual(len(backend), 10)
+        self.assertIsNone(backend.filter(id=2990))
+        self.assertEqual(backend.filter(id=2991)["begin_time"], 3990.0)
+        self.assertEqual(sum(group["count"]
+                             for group in backend.group()), 10)
+        self.assertEqual(len(backend.filter(begin_time=3995.0)), 5)
+
+    def test_page_out_of_finish_order(self):
+        backend = Memory(max_records=50)
+        # NOTE: every third record finishes late, like deferred phases
+        records = [make_record(i) for i in range(80)]
+        for i, record in enumerate(records):
+            if i % 3 == 0:
+                record["finish_time"] += 7
+        backend.insert_many(records)
+        for sort in ("finish_time,asc", "finish_time,desc"):
+            expected = [record["id"] for record in backend.filter(
+                sort=sort, limit=None)]
+            for kwargs in (dict(), dict(name="/r1"),
+                           dict(begin_time=1040.0, finish_time=1070.0)):
+                ids = []
+                after = None
+                while True:
+                    page = backend.filter(sort=sort, limit=7, after=after,
+                                          with_cursor=True, **kwargs)
+                    ids.extend(record["id"] for record in page)
+                    if len(page) < 7:
+                        break
+                    after = page[-1]["cursor"]
+                self.assertEqual(ids, [record["id"] for record
+                                       in backend.filter(sort=sort,
+                                                         **kwargs)])
+            self.assertEqual(len(expected), 50)
+            finish_times = [backend.filter(id=_id)["finish_time"]
+                            for _id in expected]
+            self.assertEqual(finish_times, sorted(
+                finish_times, reverse=sort.endswith("desc")))
+        total, _ = backend.filter(begin_time=1040.0, finish_time=1070.0,
+                                  after="1050.5,51", limit=3,
+                                  return_total=True)
+        self.assertEqual(total, sum(
+            1 for record in records[30:]
+            if 1040.0 <= record["begin_time"] and
+            record["finish_time"] <= 1070.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import glob
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+from tornado_profiler.otlp import (SpanExporter, parse_traceparent,
+                                   SPAN_KIND_SERVER, SPAN_KIND_CLIENT,
+                                   STATUS_CODE_ERROR)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+TRACEPARENT = "00-%s-%s-01" % (TRACE_ID, PARENT_ID)
+
+
+def make_record(**kwargs):
+    record = dict(name="/users/(\\d+)", method="GET", begin_time=1000.0,
+                  finish_time=1000.25, status=503, path="/users/1",
+                  host="example.com", traceparent=TRACEPARENT,
+                  metrics={"phase.handler": 0.2},
+                  http_calls=[dict(method="GET", url="http://api/x/{id}",
+                                   status=200, begin_time=1000.1,
+                                   time=0.05)])
+    record.update(kwargs)
+    return record
+
+
+def attributes(span):
+    return dict((attribute["key"], list(attribute["value"].values())[0])
+                for attribute in span["attributes"])
+
+
+def read_spans(data):
+    return [span for line in data.splitlines()
+            for resource in json.loads(line)["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]]
+
+
+class SpanExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_traceparent(self):
+        self.assertEqual(parse_traceparent(TRACEPARENT.upper()),
+                         (TRACE_ID, PARENT_ID))
+        for value in (None, "", "00-%s-%s" % (TRACE_ID, PARENT_ID),
+                      "ff-%s-%s-01" % (TRACE_ID, PARENT_ID),
+                      "00-%s-%s-01" % ("0" * 32, PARENT_ID)):
+            self.assertIsNone(parse_traceparent(value))
+
+    def test_to_spans(self):
+        exporter = SpanExporter(directory=self.directory)
+        server, client = exporter.to_spans(make_record())
+        self.assertEqual(server["traceId"], TRACE_ID)
+        self.assertEqual(server["parentSpanId"], PARENT_ID)
+        self.assertEqual(server["name"], "GET /users/(\\d+)")
+        self.assertEqual(server["kind"], SPAN_KIND_SERVER)
+        self.assertEqual(server["startTimeUnixNano"], "1000000000000")
+        self.assertEqual(server["endTimeUnixNano"], "1000250000000")
+        self.assertEqual(server["status"], dict(code=STATUS_CODE_ERROR))
+        self.assertEqual(attributes(server), {
+            "http.request.method": "GET",
+            "http.route": "/users/(\\d+)",
+            "http.response.status_code": "503",
+            "url.path": "/users/1",
+            "server.address": "example.com",
+            "tornado_profiler.phase.handler": 0.2,
+        })
+        self.assertEqual(client["traceId"], TRACE_ID)
+        self.assertEqual(client["parentSpanId"], server["spanId"])
+        self.assertEqual(client["kind"], SPAN_KIND_CLIENT)
+        self.assertEqual(client["status"], {})
+        self.assertEqual(attributes(client)["url.full"], "http://api/x/{id}")
+
+        # NOTE: a new trace without a valid parent
+        server, = exporter.to_spans(make_record(traceparent="nope",
+                                                http_calls=None))
+        self.assertNotEqual(server["traceId"], TRACE_ID)
+        self.assertNotIn("parentSpanId", server)
+
+    def test_export_to_directory(self):
+        exporter = SpanExporter(directory=self.directory, max_files=2,
+                                max_file_size=1)
+        for i in range(3):
+            # NOTE: one batch per file, the oldest file is removed
+            exporter._export([make_record(status=200 + i)])
+            # NOTE: file names have a millisecond resolution
+            time.sleep(0.002)
+        paths = sorted(glob.glob(os.path.join(self.directory,
+                                              "spans-*.ndjson.gz")))
+        self.assertEqual(len(paths), 2)
+        statuses = []
+        for path in paths:
+            with gzip.open(path, "rt") as f:
+                statuses.extend(attributes(span)["http.response.status_code"]
+                                for span in read_spans(f.read())
+                                if span["kind"] == SPAN_KIND_SERVER)
+        self.assertEqual(statuses, ["201", "202"])
+
+    def test_post_to_collector(self):
+        requests = []
+
+        class CollectorHandler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                requests.append((dict(self.headers), gzip.decompress(body)))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), CollectorHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            exporter = SpanExporter(
+                endpoint="http://127.0.0.1:%d/v1/traces" % server.server_port,
+                headers={"Authorization": "token"})
+            exporter.start()
+            exporter.put(make_record())
+            exporter.stop()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(len(requests), 1)
+        headers, data = requests[0]
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Authorization"], "token")
+        payload = json.loads(data)
+        resource = payload["resourceSpans"][0]
+        self.assertEqual(attributes(resource["resource"])["service.name"],
+                         "tornado")
+        self.assertEqual(len(read_spans(data)), 2)
+
+
+class SpanExportHookTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        class MainHandler(tornado.web.RequestHandler):
+
+            def get(self):
+                self.write("ok")
+
+        self.directory = tempfile.mkdtemp()
+        app = tornado.web.Application([(r"/", MainHandler)])
+        self.profiler = Profiler(Memory(), cache_ttl=None,
+                                 span_dir=self.directory,
+                                 service_name="shop")
+        self.profiler.init_app(app)
+        return app
+
+    def tearDown(self):
+        super(SpanExportHookTest, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_request_exported(self):
+        self.fetch("/", headers={"traceparent": TRACEPARENT})
+        self.profiler.span_exporter.stop()
+        path, = glob.glob(os.path.join(self.directory, "spans-*.ndjson.gz"))
+        with gzip.open(path, "rt") as f:
+            data = f.read()
+        span, = read_spans(data)
+        self.assertEqual(span["traceId"], TRACE_ID)
+        self.assertEqual(span["parentSpanId"], PARENT_ID)
+        self.assertEqual(attributes(span)["url.path"], "/")
+        resource = json.loads(data)["resourceSpans"][0]["resource"]
+        self.assertEqual(attributes(resource)["service.name"], "shop")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+
+
+class RequestHookTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        # NOTE: handler classes are patched for good, one per test
+        class MainHandler(tornado.web.RequestHandler):
+
+            def get(self):
+                self.write("ok")
+
+        class SubHandler(MainHandler):
+            pass
+
+        self.calls = []
+        app = tornado.web.Application([(r"/", MainHandler),
+                                       (r"/sub", SubHandler)])
+        self.profiler = Profiler(Memory(), cache_ttl=None)
+        for name in ("first", "second"):
+            self.profiler.add_request_hook(
+                lambda handler, name=name: self.calls.append(
+                    ("begin", name, type(handler).__name__)),
+                lambda handler, name=name: self.calls.append(
+                    ("end", name, type(handler).__name__)))
+        self.profiler.init_app(app)
+        return app
+
+    def test_hooks_run_in_order(self):
+        self.assertEqual(self.fetch("/").body, b"ok")
+        self.assertEqual(self.calls, [("begin", "first", "MainHandler"),
+                                      ("begin", "second", "MainHandler"),
+                                      ("end", "second", "MainHandler"),
+                                      ("end", "first", "MainHandler")])
+
+    def test_hooks_run_once_for_subclasses(self):
+        self.fetch("/sub")
+        self.assertEqual([call[:2] for call in self.calls],
+                         [("begin", "first"), ("begin", "second"),
+                          ("end", "second"), ("end", "first")])
+
+
+class TimeseriesHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        app = tornado.web.Application()
+        Profiler(Memory()).init_app(app)
+        return app
+
+    def test_max_points_bounded(self):
+        url = "/tornado-profiler/api/timeseries?max_points=%d"
+        self.assertEqual(self.fetch(url % 1000).code, 200)
+        self.assertEqual(self.fetch(url % 1001).code, 400)
+        self.assertEqual(self.fetch(url % 1).code, 400)
+
+
+if __name__ == '__main__':
+    tornado.testing.main()
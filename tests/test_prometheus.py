@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+from tornado_profiler.prometheus import PrometheusMetrics
+
+
+class PrometheusMetricsTest(unittest.TestCase):
+
+    def test_render_histogram(self):
+        metrics = PrometheusMetrics(namespace="app", buckets=(1, 0.1))
+        for elapse_time in (0.05, 0.1, 0.5, 2.0):
+            metrics.observe('/a"b', "GET", 200, elapse_time)
+        metrics.observe("/c", "POST", 500, 0.25)
+        text = metrics.render(dict(written=5, pending=1))
+        self.assertEqual(text, "\n".join([
+            "# HELP app_request_duration_seconds Latency of requests by "
+            "route, method and status.",
+            "# TYPE app_request_duration_seconds histogram",
+            'app_request_duration_seconds_bucket{route="/a\\"b",'
+            'method="GET",status="200",le="0.1"} 2',
+            'app_request_duration_seconds_bucket{route="/a\\"b",'
+            'method="GET",status="200",le="1.0"} 3',
+            'app_request_duration_seconds_bucket{route="/a\\"b",'
+            'method="GET",status="200",le="+Inf"} 4',
+            'app_request_duration_seconds_sum{route="/a\\"b",'
+            'method="GET",status="200"} 2.65',
+            'app_request_duration_seconds_count{route="/a\\"b",'
+            'method="GET",status="200"} 4',
+            'app_request_duration_seconds_bucket{route="/c",'
+            'method="POST",status="500",le="0.1"} 0',
+            'app_request_duration_seconds_bucket{route="/c",'
+            'method="POST",status="500",le="1.0"} 1',
+            'app_request_duration_seconds_bucket{route="/c",'
+            'method="POST",status="500",le="+Inf"} 1',
+            'app_request_duration_seconds_sum{route="/c",'
+            'method="POST",status="500"} 0.25',
+            'app_request_duration_seconds_count{route="/c",'
+            'method="POST",status="500"} 1',
+            "# HELP app_requests_total Requests by route, method and "
+            "status.",
+            "# TYPE app_requests_total counter",
+            'app_requests_total{route="/a\\"b",method="GET",'
+            'status="200"} 4',
+            'app_requests_total{route="/c",method="POST",status="500"} 1',
+            "# HELP app_writer_pending Measurements waiting to be stored.",
+            "# TYPE app_writer_pending gauge",
+            "app_writer_pending 1",
+            "# HELP app_writer_written_total Measurements stored by the "
+            "writer.",
+            "# TYPE app_writer_written_total counter",
+            "app_writer_written_total 5",
+            "",
+        ]))
+
+
+class MetricsHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        class MainHandler(tornado.web.RequestHandler):
+
+            def get(self):
+                self.write("ok")
+
+        app = tornado.web.Application([(r"/", MainHandler)])
+        Profiler(Memory(), cache_ttl=None,
+                 prometheus_buckets=(0.5, 1)).init_app(app)
+        return app
+
+    def test_requests_observed(self):
+        for _ in range(3):
+            self.fetch("/")
+        response = self.fetch("/tornado-profiler/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith(
+            "text/plain; version=0.0.4"))
+        lines = response.body.decode().splitlines()
+        self.assertIn('tornado_profiler_request_duration_seconds_bucket{'
+                      'route="/",method="GET",status="200",le="+Inf"} 3',
+                      lines)
+        self.assertIn('tornado_profiler_requests_total{route="/",'
+                      'method="GET",status="200"} 3', lines)
+        self.assertIn("# TYPE tornado_profiler_writer_pending gauge", lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
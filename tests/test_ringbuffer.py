@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from tornado_profiler.backend._ringbuffer import Ringbuffer
+
+
+def make_record(i):
+    return dict(name="/r%d" % (i % 3), method="GET",
+                begin_time=1000.0 + i, finish_time=1000.5 + i,
+                elapse_time=0.5, status=500 if i % 4 == 0 else 200,
+                context={"i": i, "headers": {"X": "y"}},
+                metrics={"phase.prepare": 0.1})
+
+
+class RingbufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "test.ring")
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend._names_file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def open(self, **kwargs):
+        kwargs.setdefault("capacity", 10)
+        kwargs.setdefault("context_size", 4096)
+        kwargs.setdefault("metrics_size", 4096)
+        backend = Ringbuffer(path=self.path, **kwargs)
+        backend.initialize()
+        self.backends.append(backend)
+        return backend
+
+    def test_round_trip_after_reopen(self):
+        backend = self.open()
+        backend.insert_many([make_record(i) for i in range(5)])
+        backend.purge()
+
+        backend = self.open()
+        record = backend.filter(id=3)
+        self.assertEqual(record["name"], "/r2")
+        self.assertEqual(record["method"], "GET")
+        self.assertEqual(record["begin_time"], 1002.0)
+        self.assertEqual(record["finish_time"], 1002.5)
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["context"], {"i": 2, "headers": {"X": "y"}})
+        self.assertEqual(record["metrics"], {"phase.prepare": 0.1})
+        backend.insert(**make_record(5))
+        self.assertEqual([record["id"] for record in backend.filter(
+            sort="id,asc")], [1, 2, 3, 4, 5, 6])
+
+    def test_oldest_overwritten(self):
+        backend = self.open(capacity=4)
+        backend.insert_many([make_record(i) for i in range(10)])
+        self.assertEqual([record["id"] for record in backend.filter(
+            sort="id,asc")], [7, 8, 9, 10])
+        self.assertIsNone(backend.filter(id=6))
+        self.assertEqual(sum(group["count"] for group in backend.group()), 4)
+
+    def test_overwritten_context(self):
+        backend = self.open(context_size=128)
+        backend.insert_many([make_record(i) for i in range(10)])
+        self.assertIsNone(backend.filter(id=1)["context"])
+        self.assertEqual(backend.filter(id=10)["context"]["i"], 9)
+
+    def test_reopen_with_another_capacity(self):
+        self.open().insert(**make_record(0))
+        with self.assertRaises(Exception):
+            self.open(capacity=20)
+
+    def test_page_through_names(self):
+        backend = self.open()
+        backend.insert_many([make_record(i) for i in range(10)])
+        ids = []
+        after = None
+        while True:
+            records = backend.filter(sort="name,asc", limit=3, after=after,
+                                     with_cursor=True)
+            ids.extend(record["id"] for record in records)
+            if len(records) < 3:
+                break
+            after = records[-1]["cursor"]
+        self.assertEqual(ids, [record["id"] for record in backend.filter(
+            sort="name,asc")])
+
+    def test_group_errors_and_metrics(self):
+        backend = self.open()
+        backend.insert_many([make_record(i) for i in range(9)])
+        groups = dict((group["name"], group) for group in backend.group())
+        self.assertEqual(groups["/r0"]["count"], 3)
+        # NOTE: records 0, 4 and 8 failed
+        self.assertEqual(groups["/r0"]["errors"], 1)
+        self.assertEqual(groups["/r1"]["errors"], 1)
+        self.assertEqual(groups["/r2"]["errors"], 1)
+        self.assertIn("phase.prepare", groups["/r0"]["metrics"])
+
+    def test_timeseries(self):
+        backend = self.open()
+        backend.insert_many([make_record(i) for i in range(9)])
+        series = backend.timeseries(begin_time=1000, finish_time=1010,
+                                    width=5)
+        self.assertEqual([(point["count"], point["errors"])
+                          for point in series["points"]], [(5, 2), (4, 1)])
+
+    def test_iter_measurements(self):
+        backend = self.open()
+        # NOTE: inserted out of finish_time order
+        backend.insert_many([make_record(i) for i in (3, 1, 2, 0, 4)])
+        measurements = list(backend.iter_measurements(
+            chunk_size=2, begin_time=1001, with_context=True))
+        self.assertEqual([record["finish_time"] for record in measurements],
+                         [1001.5, 1002.5, 1003.5, 1004.5])
+        self.assertEqual(measurements[0]["context"]["i"], 1)
+
+    def test_reopen_older_version(self):
+        self.open().insert(**make_record(0))
+        with open(self.path, "r+b") as f:
+            f.write(b"TPRING01")
+        with self.assertRaises(Exception):
+            self.open()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from tornado_profiler.routing import RouteRegistry
+from tornado_profiler.sampling import Sampler
+
+
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.routes = RouteRegistry()
+        self.health = self.routes.register("/health")
+        self.users = self.routes.register("/api/users/(?P<id>\\d+)")
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            Sampler(rate=1.5)
+        with self.assertRaises(ValueError):
+            Sampler(rules={"/health": -0.1})
+
+    def test_first_matched_rule_wins(self):
+        sampler = Sampler(rate=0.5, rules=[("^/health", 0.0),
+                                           ("/api/", 1.0),
+                                           ("users", 0.2)])
+        self.assertEqual(sampler.get_rate(self.health), 0.0)
+        self.assertEqual(sampler.get_rate(self.users), 1.0)
+        other = self.routes.register("/other")
+        self.assertEqual(sampler.get_rate(other), 0.5)
+
+    def test_head_sampling(self):
+        sampler = Sampler(rules={"^/health": 0.0})
+        self.assertFalse(sampler.sample_head(self.health))
+        self.assertTrue(sampler.sample_head(self.users))
+
+        random.seed(0)
+        sampler = Sampler(rate=0.25)
+        kept = sum(sampler.sample_head(self.users) for _ in range(10000))
+        self.assertTrue(2000 < kept < 3000, kept)
+
+    def test_tail_sampling_keeps_slow_and_errors(self):
+        sampler = Sampler(rate=0.0, slow_threshold=1.0, error_status=500)
+        self.assertFalse(sampler.should_record(self.users, 0.1, 200))
+        self.assertFalse(sampler.should_record(self.users, 0.1, 404))
+        self.assertTrue(sampler.should_record(self.users, 1.0, 200))
+        self.assertTrue(sampler.should_record(self.users, 0.1, 503))
+
+    def test_tail_sampling_disabled(self):
+        sampler = Sampler(rate=0.0, slow_threshold=None, error_status=None)
+        self.assertFalse(sampler.should_record(self.users, 100.0, 500))
+
+
+if __name__ == '__main__':
+    unittest.main()
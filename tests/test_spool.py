@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from tornado_profiler.spool import Spool, SpoolAggregator, fcntl
+
+
+@unittest.skipIf(fcntl is None, "fcntl is not available")
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory)
+        self.flushed = []
+
+    def tearDown(self):
+        self.spool.unlock()
+        shutil.rmtree(self.directory)
+
+    def make_aggregator(self, flush=None, **kwargs):
+        return SpoolAggregator(self.spool, flush or self.flushed.extend,
+                               **kwargs)
+
+    def filenames(self, suffix):
+        return [filename for filename in os.listdir(self.directory)
+                if filename.endswith(suffix)]
+
+    def test_write_read(self):
+        self.spool.write([{"i": 0}, {"i": 1}])
+        self.spool.write([])
+        paths = self.spool.batch_files()
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(self.spool.read(paths[0]), [{"i": 0}, {"i": 1}])
+        self.assertEqual(self.filenames(Spool.TEMP_SUFFIX), [])
+
+    def test_single_aggregator_elected(self):
+        other = Spool(self.directory)
+        self.assertTrue(self.spool.try_lock())
+        self.assertTrue(self.spool.try_lock())
+        self.assertFalse(other.try_lock())
+        self.spool.unlock()
+        self.assertTrue(other.try_lock())
+        other.unlock()
+
+    def test_drain_in_order(self):
+        for i in range(5):
+            self.spool.write([{"i": i * 2}, {"i": i * 2 + 1}])
+        self.assertEqual(self.make_aggregator(batch_size=3).drain(), 10)
+        self.assertEqual([record["i"] for record in self.flushed],
+                         list(range(10)))
+        self.assertEqual(self.spool.batch_files(), [])
+
+    def test_corrupted_file_set_aside(self):
+        self.spool.write([{"i": 0}])
+        with open(os.path.join(self.directory, "0" + Spool.SUFFIX),
+                  "wt") as f:
+            f.write("{nope\n")
+        self.assertEqual(self.make_aggregator().drain(), 1)
+        self.assertEqual(self.filenames(Spool.BAD_SUFFIX),
+                         ["0" + Spool.BAD_SUFFIX])
+
+    def test_failing_file_quarantined(self):
+        for i in range(3):
+            self.spool.write([{"i": i}])
+
+        def flush(records):
+            if any(record["i"] == 1 for record in records):
+                raise ValueError("poisoned")
+            self.flushed.extend(records)
+
+        aggregator = self.make_aggregator(flush, max_attempts=2)
+        # NOTE: files around the failing one are flushed one by one
+        self.assertEqual(aggregator.drain(), 2)
+        self.assertEqual(self.flushed, [{"i": 0}, {"i": 2}])
+        self.assertEqual(len(self.spool.batch_files()), 1)
+        # NOTE: a lone failing file isn't counted, nothing else flushed
+        with self.assertRaises(ValueError):
+            aggregator.drain()
+        self.assertEqual(self.filenames(Spool.BAD_SUFFIX), [])
+        self.spool.write([{"i": 3}])
+        self.assertEqual(aggregator.drain(), 1)
+        self.assertEqual(len(self.filenames(Spool.BAD_SUFFIX)), 1)
+        self.assertEqual(self.flushed, [{"i": 0}, {"i": 2}, {"i": 3}])
+        self.assertEqual(self.spool.batch_files(), [])
+
+    def test_outage_quarantines_nothing(self):
+        for i in range(3):
+            self.spool.write([{"i": i}])
+        attempts = []
+
+        def flush(records):
+            attempts.append(len(records))
+            raise IOError("backend down")
+
+        aggregator = self.make_aggregator(flush, max_attempts=2)
+        for _ in range(3):
+            with self.assertRaises(IOError):
+                aggregator.drain()
+        # NOTE: every file is retried in each round
+        self.assertEqual(attempts, [3, 1, 1, 1] * 3)
+        self.assertEqual(self.filenames(Spool.BAD_SUFFIX), [])
+        self.assertEqual(len(self.spool.batch_files()), 3)
+
+    def test_oldest_files_dropped(self):
+        for i in range(5):
+            self.spool.write([{"i": i}])
+        self.assertEqual(self.make_aggregator(max_files=2).drain(), 2)
+        self.assertEqual(self.flushed, [{"i": 3}, {"i": 4}])
+
+
+if __name__ == '__main__':
+    unittest.main()
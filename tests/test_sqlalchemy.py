@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+try:
+    import sqlalchemy
+except ImportError:
+    sqlalchemy = None
+
+from tornado_profiler.backend._sqlalchemy import Sqlalchemy
+
+
+def make_records(count, begin_time=3600.0 * 1000, step=7.0):
+    return [dict(name="/r%d" % (i % 3), method="GET",
+                 begin_time=begin_time + i * step,
+                 finish_time=begin_time + i * step + 0.5 * (i % 4),
+                 elapse_time=0.5 * (i % 4) or 0.001,
+                 status=500 if i % 10 == 0 else 200)
+            for i in range(count)]
+
+
+@unittest.skipIf(sqlalchemy is None, "sqlalchemy is not installed")
+class SqlalchemyTestCase(unittest.TestCase):
+
+    backend_kwargs = dict()
+
+    def setUp(self):
+        self.backend = Sqlalchemy(db_url="sqlite://", **self.backend_kwargs)
+        self.backend.initialize()
+
+    def tearDown(self):
+        self.backend.db_pool.remove()
+        self.backend.db_read_pool.remove()
+        self.backend.db_engine.dispose()
+
+
+class RollupTest(SqlalchemyTestCase):
+
+    def test_group_same_count_on_rollup_and_raw_paths(self):
+        begin_time = 3600.0 * 1000 + 600
+        finish_time = begin_time + 3600
+        # NOTE: begins in the range but finishes after it
+        self.backend.insert_many(make_records(1000) + [dict(
+            name="/r0", method="GET", begin_time=finish_time - 1,
+            finish_time=finish_time + 1, elapse_time=2.0, status=200)])
+        ranges = ((begin_time, finish_time),
+                  # NOTE: unaligned edges around hours and minutes
+                  (begin_time - 1234.5, finish_time + 61.5),
+                  (None, finish_time - 30), (begin_time + 30, None),
+                  (None, None))
+        results = [self.group(*args) for args in ranges]
+        # NOTE: force the raw scan on the same ranges
+        self.backend.ROLLUP_RESOLUTIONS = ()
+        self.assertEqual(results, [self.group(*args) for args in ranges])
+
+    def group(self, begin_time, finish_time):
+        return sorted((group["name"], group["count"], group["errors"],
+                       round(group["max"], 6))
+                      for group in self.backend.group(
+                          begin_time=begin_time, finish_time=finish_time))
+
+    def test_split_range(self):
+        self.assertEqual(self.backend._split_range(3600, 7200),
+                         [(3600, 3600, 7200)])
+        self.assertEqual(self.backend._split_range(3570.5, 7261),
+                         [(None, 3570.5, 3600), (3600, 3600, 7200),
+                          (60, 7200, 7260), (None, 7260, 7261)])
+        self.assertEqual(self.backend._split_range(10, 20),
+                         [(None, 10, 20)])
+        self.assertEqual(self.backend._split_range(None, 90),
+                         [(3600, None, 0), (60, 0, 60), (None, 60, 90)])
+
+    def test_init_rollups_in_chunks(self):
+        from tornado_profiler.backend._sqlalchemy import Rollup
+
+        self.backend.insert_many(make_records(100))
+        session = self.backend.db_pool()
+        expected = sorted((row.resolution, row.bucket, row.name, row.count)
+                          for row in session.query(Rollup))
+        session.query(Rollup).delete()
+        session.commit()
+
+        self.backend._init_rollups(chunk_size=7)
+        rebuilt = sorted((row.resolution, row.bucket, row.name, row.count)
+                         for row in session.query(Rollup))
+        session.commit()
+        self.assertEqual(rebuilt, expected)
+
+    def test_insert_retried_on_integrity_error(self):
+        from sqlalchemy.exc import IntegrityError
+
+        update_rollups = self.backend._update_rollups
+        calls = []
+
+        def flaky(session, records):
+            calls.append(len(records))
+            if len(calls) == 1:
+                raise IntegrityError("INSERT", {}, Exception("duplicate"))
+            return update_rollups(session, records)
+
+        self.backend._update_rollups = flaky
+        self.backend.insert_many(make_records(10))
+        self.assertEqual(calls, [10, 10])
+        self.assertEqual(len(self.backend.filter()), 10)
+        self.assertEqual(sum(group["count"]
+                             for group in self.backend.group()), 10)
+
+
+class KeysetTest(SqlalchemyTestCase):
+
+    def page_through(self, sort, limit=7):
+        ids = []
+        after = None
+        while True:
+            records = self.backend.filter(sort=sort, limit=limit, after=after,
+                                          with_cursor=True)
+            ids.extend(record["id"] for record in records)
+            if len(records) < limit:
+                return ids
+            after = records[-1]["cursor"]
+            self.assertLessEqual(len(ids), 100, "pagination doesn't end")
+
+    def test_page_through_every_sort(self):
+        self.backend.insert_many(make_records(50))
+        for sort in ("id,asc", "name,asc", "name,desc", "method,asc",
+                     "finish_time,desc", "elapse_time,asc"):
+            expected = [record["id"] for record in self.backend.filter(
+                sort=sort, limit=100)]
+            self.assertEqual(self.page_through(sort), expected, sort)
+
+
+class ContextTest(SqlalchemyTestCase):
+
+    backend_kwargs = dict(context_dictionary_samples=None)
+
+    def make_contexts(self, count):
+        return [dict(record, context=dict(
+            uri="/r?i=%d" % i, headers={"Host": "example.com",
+                                        "X-Index": str(i % 2)}))
+                for i, record in enumerate(make_records(count))]
+
+    def count(self, model):
+        session = self.backend.db_pool()
+        try:
+            return session.query(model).count()
+        finally:
+            session.commit()
+
+    def assert_round_trip(self, records):
+        self.backend.insert_many(records)
+        for _id, record in enumerate(records, 1):
+            if record.get("context") is not None:
+                self.assertEqual(self.backend.filter(id=_id)["context"],
+                                 record["context"])
+
+    def test_round_trip_deduplicated(self):
+        from tornado_profiler.backend._sqlalchemy import HeaderSet
+
+        records = self.make_contexts(10)
+        records[3]["context"] = None
+        self.assert_round_trip(records)
+        self.assertEqual(self.count(HeaderSet), 2)
+        self.assertIsNone(self.backend.filter(id=4)["context"])
+
+    def test_round_trip_without_returning(self):
+        dialect = self.backend.db_engine.dialect
+        dialect.insert_executemany_returning_sort_by_parameter_order = False
+        records = self.make_contexts(10)
+        records[0]["context"] = records[5]["context"] = None
+        self.assert_round_trip(records)
+        self.assertEqual([record["id"] for record in self.backend.filter(
+            sort="id,asc")], list(range(1, 11)))
+
+    def test_header_set_purged_by_another_writer(self):
+        from tornado_profiler.backend._sqlalchemy import (HeaderSet,
+                                                          MeasurementContext)
+
+        self.backend.insert_many(self.make_contexts(2))
+        session = self.backend.db_pool()
+        session.query(MeasurementContext).delete()
+        session.query(HeaderSet).delete()
+        session.commit()
+        records = self.make_contexts(2)
+        self.backend.insert_many(records)
+        self.assertEqual(self.backend.filter(id=3)["context"],
+                         records[0]["context"])
+
+    def test_header_set_inserted_by_another_writer(self):
+        from tornado_profiler.backend._context import dumps, digest, compress
+        from tornado_profiler.backend._sqlalchemy import HeaderSet
+
+        records = self.make_contexts(2)
+        find_header_sets = self.backend._find_header_sets
+        calls = []
+
+        def racing(session, digests):
+            calls.append(digests)
+            if len(calls) == 1:
+                # NOTE: missing at first, then inserted by another writer
+                for record in records:
+                    data = dumps(dict(headers=record["context"]["headers"]))
+                    session.execute(HeaderSet.__table__.insert(), dict(
+                        digest=digest(data), data=compress(data)))
+                return {}
+            return find_header_sets(session, digests)
+
+        self.backend._find_header_sets = racing
+        self.assert_round_trip(records)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.count(HeaderSet), 2)
+
+class PurgeTest(SqlalchemyTestCase):
+
+    backend_kwargs = dict(max_rows=5, purge_chunk_size=3)
+
+    def test_purge_deletes_all_chunks(self):
+        self.backend.insert_many(make_records(100))
+        self.assertEqual(self.backend.purge(), 95)
+        self.assertEqual([record["id"] for record in self.backend.filter(
+            sort="id,asc")], list(range(96, 101)))
+
+    def test_purge_stops_at_deadline(self):
+        self.backend.insert_many(make_records(100))
+        self.backend._purge_max_seconds = 0
+        self.assertEqual(self.backend.purge(), 0)
+        self.assertEqual(len(self.backend.filter(limit=200)), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from tornado_profiler.stats import (LatencySketch, LatencyStats, Timeseries,
+                                    TIMESERIES_POINTS_LIMIT, query_groups,
+                                    timeseries_range)
+
+
+class LatencySketchTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        self.values = [rng.lognormvariate(-4, 1.5) for _ in range(20000)]
+
+    def assert_accurate(self, sketch, values):
+        values = sorted(values)
+        for q in (0.0, 0.5, 0.9, 0.99, 0.999, 1.0):
+            exact = values[int(q * (len(values) - 1))]
+            estimate = sketch.quantile(q)
+            self.assertLessEqual(abs(estimate - exact),
+                                 LatencySketch.ALPHA * exact + 1e-12,
+                                 "q=%s exact=%r estimate=%r"
+                                 % (q, exact, estimate))
+
+    def test_relative_accuracy(self):
+        sketch = LatencySketch()
+        for value in self.values:
+            sketch.add(value)
+        self.assertEqual(sketch.count, len(self.values))
+        self.assert_accurate(sketch, self.values)
+
+    def test_merge_equals_single_sketch(self):
+        left, right, whole = LatencySketch(), LatencySketch(), LatencySketch()
+        for i, value in enumerate(self.values):
+            (left if i % 2 else right).add(value)
+            whole.add(value)
+        left.merge(right)
+        self.assertEqual(left.bins, whole.bins)
+        self.assertEqual(left.zero_count, whole.zero_count)
+
+    def test_dumps_loads_round_trip(self):
+        sketch = LatencySketch()
+        for value in self.values[:100] + [0.0, 1e-9]:
+            sketch.add(value)
+        loaded = LatencySketch.loads(sketch.dumps())
+        self.assertEqual(loaded.bins, sketch.bins)
+        self.assertEqual(loaded.zero_count, 2)
+
+    def test_remove(self):
+        sketch = LatencySketch()
+        for value in self.values:
+            sketch.add(value)
+        for value in self.values[:10000]:
+            sketch.remove(value)
+        self.assert_accurate(sketch, self.values[10000:])
+
+    def test_empty(self):
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+
+class LatencyStatsTest(unittest.TestCase):
+
+    def test_as_dict(self):
+        stats = LatencyStats()
+        for value in (0.1, 0.2, 0.3, 0.4):
+            stats.add(value, {"phase.prepare": value / 10,
+                              "memory.samples": 1, "memory.peak": 100})
+        data = stats.as_dict()
+        self.assertEqual(data["count"], 4)
+        self.assertEqual(data["min"], 0.1)
+        self.assertEqual(data["max"], 0.4)
+        self.assertAlmostEqual(data["avg"], 0.25)
+        self.assertLessEqual(data["p50"], 0.4)
+        self.assertAlmostEqual(data["metrics"]["phase.prepare"], 0.025)
+        self.assertEqual(data["metrics"]["memory.samples"], 4)
+        self.assertEqual(data["metrics"]["memory.peak"], 100)
+
+    def test_percentile_clamped_to_range(self):
+        stats = LatencyStats()
+        stats.add(0.123)
+        self.assertEqual(stats.percentile(0.5), 0.123)
+
+    def test_query_groups(self):
+        groups = dict()
+        for name, count in (("/a", 3), ("/b", 1), ("/c", 2)):
+            stats = groups[(name, "GET")] = LatencyStats()
+            for _ in range(count):
+                stats.add(0.1)
+        total, data = query_groups(groups, sort="count,asc", limit=2,
+                                   return_total=True)
+        self.assertEqual(total, 3)
+        self.assertEqual([group["name"] for group in data], ["/b", "/c"])
+        with self.assertRaises(ValueError):
+            query_groups(groups, sort="nope")
+
+
+class TimeseriesTest(unittest.TestCase):
+
+    def test_range_kept(self):
+        self.assertEqual(timeseries_range(3600, 7200, 60), (3600, 7200, 60))
+
+    def test_range_aligned(self):
+        self.assertEqual(timeseries_range(3610, 7190, 60), (3600, 7200, 60))
+
+    def test_width_widened(self):
+        self.assertEqual(timeseries_range(0, 3600), (0, 3600, 15))
+        begin, finish, width = timeseries_range(0, 3600, 1, max_points=10)
+        self.assertEqual(width, 600)
+        self.assertLessEqual((finish - begin) / width, 10)
+        # NOTE: wider than all widths
+        begin, finish, width = timeseries_range(0, 86400 * 365, 1)
+        self.assertLessEqual((finish - begin) / width, 300)
+
+    def test_invalid_range(self):
+        for args, kwargs in (((10, 10), {}), ((0, 10, 0), {}),
+                             ((0, 10), dict(max_points=1)),
+                             ((0, 10), dict(
+                                 max_points=TIMESERIES_POINTS_LIMIT + 1))):
+            with self.assertRaises(ValueError):
+                timeseries_range(*args, **kwargs)
+
+    def test_buckets(self):
+        series = Timeseries.create(begin_time=0, finish_time=180, width=60)
+        series.add(10, 0.1)
+        series.add(20, 0.3, 500)
+        series.add(130, 0.2)
+        series.add(180, 1.0)
+        stats = LatencyStats()
+        stats.add(0.5)
+        series.merge(60, stats)
+        data = series.as_dict()
+        self.assertEqual((data["begin_time"], data["finish_time"],
+                          data["width"]), (0, 180, 60))
+        self.assertEqual([point["time"] for point in data["points"]],
+                         [0, 60, 120])
+        self.assertEqual([point["count"] for point in data["points"]],
+                         [2, 1, 1])
+        self.assertEqual(data["points"][0]["errors"], 1)
+        self.assertAlmostEqual(data["points"][0]["rate"], 2 / 60.0, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
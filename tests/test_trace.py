@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import tornado.testing
+from tornado.ioloop import IOLoop
+
+from tornado_profiler.trace import (RequestTrace, _CURRENT_TRACE,
+                                    current_trace, run_in_executor)
+
+
+class RunInExecutorTest(tornado.testing.AsyncTestCase):
+
+    @tornado.testing.gen_test
+    def test_trace_propagated(self):
+        trace = RequestTrace()
+        _CURRENT_TRACE.set(trace)
+        self.assertIs((yield run_in_executor(None, current_trace)), trace)
+        self.assertIsNone(
+            (yield IOLoop.current().run_in_executor(None, current_trace)))
+
+    @tornado.testing.gen_test
+    def test_arguments(self):
+        trace = RequestTrace()
+        _CURRENT_TRACE.set(trace)
+        yield run_in_executor(None, trace.add_metric, "sql.count", 2)
+        self.assertEqual(trace.metrics, {"sql.count": 2})
+
+
+if __name__ == '__main__':
+    tornado.testing.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+
+
+def make_record(i):
+    return dict(name="/r%d" % (i % 2), method="GET",
+                begin_time=1000.0 + i, finish_time=1000.5 + i,
+                elapse_time=0.5, status=500 if i == 3 else 200,
+                context={"i": i}, metrics={"phase.handler": 0.25})
+
+
+class ExportHandlerTest(tornado.testing.AsyncHTTPTestCase):
+
+    URL = "/tornado-profiler/api/measurements/export"
+
+    def get_app(self):
+        app = tornado.web.Application()
+        self.backend = Memory()
+        # NOTE: inserted out of finish_time order
+        self.backend.insert_many([make_record(i) for i in (4, 0, 2, 1, 3)])
+        Profiler(self.backend, cache_ttl=None).init_app(app)
+        return app
+
+    def test_ndjson(self):
+        response = self.fetch(self.URL + "?chunk_size=2")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"],
+                         "application/x-ndjson")
+        self.assertEqual(response.headers["Content-Disposition"],
+                         "attachment; filename=measurements.ndjson")
+        rows = [json.loads(line)
+                for line in response.body.decode().splitlines()]
+        self.assertEqual([row["finish_time"] for row in rows],
+                         [1000.5, 1001.5, 1002.5, 1003.5, 1004.5])
+        self.assertEqual(rows[3], dict(id=5, name="/r1", method="GET",
+                                       begin_time=1003.0,
+                                       finish_time=1003.5, elapse_time=0.5,
+                                       status=500))
+
+    def test_ndjson_filtered_with_context(self):
+        response = self.fetch(self.URL + "?name=/r0&with_context=true"
+                                         "&begin_time=1001")
+        rows = [json.loads(line)
+                for line in response.body.decode().splitlines()]
+        self.assertEqual([row["context"] for row in rows],
+                         [{"i": 2}, {"i": 4}])
+        self.assertEqual(rows[0]["metrics"], {"phase.handler": 0.25})
+
+    def test_csv(self):
+        response = self.fetch(self.URL + "?format=csv&with_context=1"
+                                         "&chunk_size=3")
+        self.assertEqual(response.headers["Content-Type"],
+                         "text/csv; charset=UTF-8")
+        rows = list(csv.reader(io.StringIO(response.body.decode())))
+        self.assertEqual(rows[0], ["id", "name", "method", "begin_time",
+                                   "finish_time", "elapse_time", "status",
+                                   "metrics", "context"])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1], ["2", "/r0", "GET", "1000.0", "1000.5",
+                                   "0.5", "200", '{"phase.handler": 0.25}',
+                                   '{"i": 0}'])
+
+    def test_csv_header_without_context(self):
+        response = self.fetch(self.URL + "?format=csv&name=/nope")
+        self.assertEqual(response.body.decode(),
+                         "id,name,method,begin_time,finish_time,"
+                         "elapse_time,status\n")
+
+    def test_param_error(self):
+        for query in ("?format=xml", "?chunk_size=0", "?begin_time=x"):
+            self.assertEqual(self.fetch(self.URL + query).code, 400)
+
+
+if __name__ == '__main__':
+    tornado.testing.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+import tornado.web
+import tornado.testing
+
+from tornado_profiler import Profiler
+from tornado_profiler.backend._memory import Memory
+
+
+def block(seconds):
+    time.sleep(seconds)
+
+
+class BlockingWatchdogTest(tornado.testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        class SlowHandler(tornado.web.RequestHandler):
+
+            async def get(self):
+                await asyncio.sleep(0.01)
+                block(0.3)
+                self.write("ok")
+
+        app = tornado.web.Application([(r"/slow", SlowHandler)])
+        self.backend = Memory()
+        self.profiler = Profiler(self.backend, cache_ttl=None,
+                                 blocking_threshold=0.05)
+        self.profiler.init_app(app)
+        return app
+
+    def tearDown(self):
+        self.profiler.watchdog.stop()
+        super(BlockingWatchdogTest, self).tearDown()
+
+    def wait_events(self, count):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.io_loop.run_sync(lambda: asyncio.sleep(0.05))
+            events = self.backend.filter_blocking(with_stack=True)
+            if len(events) >= count:
+                return events
+        self.fail("No blocking event reported")
+
+    def test_attributed_to_request(self):
+        self.assertEqual(self.fetch("/slow").body, b"ok")
+        event = self.wait_events(1)[0]
+        self.assertEqual(event["name"], "/slow")
+        self.assertEqual(event["method"], "GET")
+        self.assertEqual(event["uri"], "/slow")
+        self.assertEqual(event["handler"], "BlockingWatchdogTest.get_app."
+                                           "<locals>.SlowHandler")
+        self.assertGreaterEqual(event["duration"], 0.25)
+        self.assertTrue(event["stack"][-1].endswith(" in block"))
+
+    def test_callback_not_attributed(self):
+        # NOTE: let the first heartbeat run
+        self.io_loop.run_sync(lambda: asyncio.sleep(0.05))
+        self.io_loop.add_callback(block, 0.2)
+        event = self.wait_events(1)[0]
+        self.assertIsNone(event["name"])
+        self.assertIsNone(event["handler"])
+        self.assertGreaterEqual(event["duration"], 0.15)
+        self.assertTrue(any(" in block" in frame
+                            for frame in event["stack"]))
+
+
+if __name__ == '__main__':
+    tornado.testing.main()
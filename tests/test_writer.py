@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import unittest
+
+from tornado_profiler.writer import BatchWriter, LoopWriter
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def make_writer(self, overflow, max_queue_size=3):
+        self.batches = []
+        return BatchWriter(self.batches.append, batch_size=100,
+                           flush_interval=0.01,
+                           max_queue_size=max_queue_size, overflow=overflow)
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            BatchWriter(list, overflow="nope")
+
+    def test_drop_oldest(self):
+        writer = self.make_writer("drop_oldest")
+        for i in range(5):
+            self.assertTrue(writer.put(i))
+        self.assertEqual(list(writer._queue), [2, 3, 4])
+        stats = writer.stats()
+        self.assertEqual(stats["dropped_oldest"], 2)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(stats["pending"], 3)
+
+    def test_drop_newest(self):
+        writer = self.make_writer("drop_newest")
+        results = [writer.put(i) for i in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(list(writer._queue), [0, 1, 2])
+        self.assertEqual(writer.stats()["dropped_newest"], 2)
+
+    def test_block_until_flushed(self):
+        writer = self.make_writer("block", max_queue_size=2)
+        writer.put(0)
+        writer.put(1)
+        done = threading.Event()
+
+        def put():
+            writer.put(2)
+            done.set()
+
+        thread = threading.Thread(target=put)
+        thread.start()
+        self.assertFalse(done.wait(0.05))
+        writer.start()
+        try:
+            self.assertTrue(done.wait(5))
+        finally:
+            writer.stop(5)
+        thread.join(5)
+        self.assertEqual(sum(self.batches, []), [0, 1, 2])
+        stats = writer.stats()
+        self.assertEqual(stats["blocked"], 1)
+        self.assertEqual(stats["written"], 3)
+        self.assertEqual(stats["dropped"], 0)
+
+    def test_stop_flushes_queue(self):
+        writer = self.make_writer("drop_oldest", max_queue_size=1000)
+        writer.start()
+        for i in range(250):
+            writer.put(i)
+        writer.stop(5)
+        self.assertEqual(sum(self.batches, []), list(range(250)))
+        self.assertTrue(all(len(batch) <= 100 for batch in self.batches))
+
+    def test_failed_flush_is_counted(self):
+        def flush(batch):
+            raise RuntimeError("down")
+
+        writer = BatchWriter(flush, flush_interval=0.01)
+        writer.start()
+        writer.put(1)
+        writer.stop(5)
+        stats = writer.stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["written"], 0)
+
+
+class LoopWriterTest(unittest.TestCase):
+
+    def make_writer(self, **kwargs):
+        self.batches = []
+
+        async def flush(batch):
+            await asyncio.sleep(0)
+            self.batches.append(batch)
+
+        return LoopWriter(flush, batch_size=10, **kwargs)
+
+    def test_stop_flushes_queue_without_loop(self):
+        writer = self.make_writer()
+        for i in range(25):
+            writer.put(i)
+        writer.stop(5)
+        self.assertEqual(sum(self.batches, []), list(range(25)))
+        self.assertEqual(writer.stats()["pending"], 0)
+
+    def test_stop_flushes_queue_on_loop(self):
+        writer = self.make_writer(flush_interval=60)
+
+        async def run():
+            writer.start()
+            for i in range(5):
+                writer.put(i)
+            writer.stop()
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        self.assertEqual(self.batches, [[0, 1, 2, 3, 4]])
+
+    def test_block_policy_never_blocks(self):
+        writer = self.make_writer(max_queue_size=2, overflow="block")
+
+        async def run():
+            return [writer.put(i) for i in range(3)]
+
+        self.assertEqual(asyncio.run(run()), [True, True, False])
+        self.assertEqual(writer.stats()["blocked"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
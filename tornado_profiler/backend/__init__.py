@@ -1,8 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import abc
+import asyncio
+import itertools
+import functools
+import threading
+import collections
+import concurrent.futures
+
+from tornado.ioloop import IOLoop
 
 from tornado_profiler.utils import BaseLoader
+from tornado_profiler.stats import Timeseries
 
 
 class Backend(metaclass=abc.ABCMeta):
@@ -10,6 +19,9 @@ class Backend(metaclass=abc.ABCMeta):
         : backend uses to store datas
     """
 
+    # max number of blocking events kept by the default implementation
+    MAX_BLOCKING_EVENTS = 1000
+
     def __init__(self, **kwargs):
         """ backend's constructor
 
@@ -29,7 +41,23 @@ class Backend(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
     def insert(self, **kwargs):
-        """This method used to insert new data"""
+        """This method used to insert new data
+
+        :param kwargs: name, method, begin_time, finish_time, elapse_time,
+                       status, the response status code or None, context,
+                       a JSON-serializable dict or None, and metrics, a
+                       dict mapping metric names such as "phase.prepare"
+                       to numbers, or None
+        """
+
+    def insert_many(self, records):
+        """This method used to insert a batch of new datas
+
+        :param records: a list of dicts, each of which are `insert` kwargs
+        :subclass should override this method to do a bulk insert
+        """
+        for record in records:
+            self.insert(**record)
 
     @abc.abstractmethod
     def filter(self, **kwargs):
@@ -39,11 +67,346 @@ class Backend(metaclass=abc.ABCMeta):
     def group(self, **kwargs):
         """This method used to group datas"""
 
+    def iter_measurements(self, chunk_size=1000, **kwargs):
+        """ This method used to iterate over all measurements matching
+            filter arguments, without holding them all in memory
+
+        :param chunk_size: number of measurements fetched at once
+        :param kwargs: begin_time, finish_time, method, name, name_regex,
+                       elapse_time and with_context, see `filter`
+        :return: an iterator of measurement dicts
+        :subclass should override this method to stream rows, measurements
+         are paginated with `filter` by default
+        """
+        after = None
+        while True:
+            page = self.filter(sort="finish_time,asc", limit=chunk_size,
+                               after=after, with_cursor=True, **kwargs)
+            for measurement in page:
+                after = measurement.pop("cursor")
+                yield measurement
+            if len(page) < chunk_size:
+                break
+
+    def timeseries(self, **kwargs):
+        """ This method used to get count, error count and latency
+            percentiles of measurements over time
+
+        :param kwargs: begin_time, finish_time, name, method, width and
+                       max_points, see `tornado_profiler.stats.Timeseries`
+        :return: a dict, see `Timeseries.as_dict`
+        :subclass should override this method to bucket datas inside the
+         database, measurements are iterated with `iter_measurements` by
+         default
+        """
+        series = Timeseries.create(**kwargs)
+        for measurement in self.iter_measurements(
+                begin_time=series.begin_time,
+                finish_time=series.finish_time,
+                name=kwargs.get("name"), method=kwargs.get("method")):
+            series.add(measurement["begin_time"], measurement["elapse_time"],
+                       measurement.get("status"))
+        return series.as_dict()
+
+    def purge(self):
+        """ Enforce retention policies, called periodically by the writer.
+            :subclass should override this method to delete old datas in
+             small chunks
+        :return: number of affected datas
+        """
+        return 0
+
+    def insert_blocking(self, events):
+        """ This method used to insert IOLoop blocking events, see
+            `tornado_profiler.watchdog.BlockingWatchdog`
+
+        :param events: a list of dicts with begin_time, duration, name,
+                       method, uri, handler and stack, a list of strings
+        :subclass should override this method to persist events, the
+         latest `MAX_BLOCKING_EVENTS` are kept in memory by default
+        """
+        if getattr(self, "_blocking_events", None) is None:
+            self._blocking_events = collections.deque(
+                maxlen=self.MAX_BLOCKING_EVENTS)
+            self._blocking_ids = itertools.count(1)
+        for event in events:
+            event = dict(event, id=next(self._blocking_ids))
+            self._blocking_events.append(event)
+
+    def filter_blocking(self, **kwargs):
+        """ This method used to filter blocking events, newest first
+
+        :param kwargs: id, name, method, begin_time, finish_time,
+                       min_duration, offset, limit, with_stack and
+                       return_total
+        :return: an event dict or None if id is given, otherwise a list of
+                 event dicts, or (total, list) if return_total
+        """
+        # NOTE: copy first, events may be inserted by another thread
+        events = list(getattr(self, "_blocking_events", None) or ())
+        _id = kwargs.get("id")
+        if _id is not None:
+            for event in events:
+                if event["id"] == int(_id):
+                    return dict(event)
+            return None
+
+        def match(event):
+            for key in ("name", "method"):
+                value = kwargs.get(key)
+                if value is not None and event[key] != value:
+                    return False
+            begin_time = kwargs.get("begin_time")
+            if begin_time is not None and event["begin_time"] < begin_time:
+                return False
+            finish_time = kwargs.get("finish_time")
+            if finish_time is not None and \
+                    event["begin_time"] + event["duration"] > finish_time:
+                return False
+            min_duration = kwargs.get("min_duration")
+            if min_duration is not None and event["duration"] < min_duration:
+                return False
+            return True
+
+        data = sorted(filter(match, events),
+                      key=lambda event: (event["begin_time"], event["id"]),
+                      reverse=True)
+        total = len(data)
+        offset = kwargs.get("offset") or 0
+        limit = kwargs.get("limit")
+        data = data[offset:] if limit is None else data[offset:offset + limit]
+        with_stack = kwargs.get("with_stack", False)
+        data = [dict(event) if with_stack else
+                dict((key, value) for key, value in event.items()
+                     if key != "stack")
+                for event in data]
+        if kwargs.get("return_total", False):
+            return total, data
+        return data
+
     def is_nonblock(self):
         """Used to indicate whether the backend's CRUD will be blocked!"""
         return False
 
 
+class AsyncBackend(Backend):
+    """ Base class of natively asynchronous backends, whose insert,
+        insert_many, filter, group, timeseries and purge are coroutines.
+        They are awaited on the IOLoop directly, without hopping to a
+        thread.
+    """
+
+    async def insert_many(self, records):
+        for record in records:
+            await self.insert(**record)
+
+    async def purge(self):
+        return 0
+
+    async def iter_chunks(self, render=None, chunk_size=1000, **kwargs):
+        """ Iterate over all measurements matching filter arguments in
+            chunks, paginated with `filter` by default
+
+        :param render: a callable converting a list of measurement dicts
+                       into what is yielded, e.g. a str
+        :param chunk_size: number of measurements of a chunk
+        :return: an async iterator of chunks
+        """
+        after = None
+        while True:
+            page = await self.filter(sort="finish_time,asc", limit=chunk_size,
+                                     after=after, with_cursor=True, **kwargs)
+            for measurement in page:
+                after = measurement.pop("cursor")
+            if page:
+                yield render(page) if render is not None else page
+            if len(page) < chunk_size:
+                break
+
+    async def timeseries(self, **kwargs):
+        series = Timeseries.create(**kwargs)
+        async for chunk in self.iter_chunks(
+                begin_time=series.begin_time,
+                finish_time=series.finish_time,
+                name=kwargs.get("name"), method=kwargs.get("method")):
+            for measurement in chunk:
+                series.add(measurement["begin_time"],
+                           measurement["elapse_time"],
+                           measurement.get("status"))
+        return series.as_dict()
+
+    async def insert_blocking(self, events):
+        Backend.insert_blocking(self, events)
+
+    async def filter_blocking(self, **kwargs):
+        return Backend.filter_blocking(self, **kwargs)
+
+    def is_nonblock(self):
+        return True
+
+
+class SyncBackendAdapter(object):
+    """ Adapt a synchronous backend to the asynchronous backend interface.
+        Blocking operations run in an executor, non-blocking ones are
+        called on the IOLoop directly.
+    """
+
+    def __init__(self, backend, executor=None, export_executor=None):
+        """
+        :param backend: a synchronous `Backend` instance
+        :param executor: a `concurrent.futures.Executor` for blocking
+                         backends, None for non-blocking ones
+        :param export_executor: a bounded executor running producers of
+                                `iter_chunks`, `executor` by default
+        """
+        self.backend = backend
+        self._executor = executor
+        self._export_executor = export_executor or executor
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    async def _call(self, func, *args, **kwargs):
+        if self._executor is None:
+            return func(*args, **kwargs)
+        return await IOLoop.current().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def insert(self, **kwargs):
+        return await self._call(self.backend.insert, **kwargs)
+
+    async def insert_many(self, records):
+        return await self._call(self.backend.insert_many, records)
+
+    async def filter(self, **kwargs):
+        return await self._call(self.backend.filter, **kwargs)
+
+    async def group(self, **kwargs):
+        return await self._call(self.backend.group, **kwargs)
+
+    async def timeseries(self, **kwargs):
+        return await self._call(self.backend.timeseries, **kwargs)
+
+    async def purge(self):
+        return await self._call(self.backend.purge)
+
+    async def insert_blocking(self, events):
+        return await self._call(self.backend.insert_blocking, events)
+
+    async def filter_blocking(self, **kwargs):
+        return await self._call(self.backend.filter_blocking, **kwargs)
+
+    async def iter_chunks(self, render=None, chunk_size=1000, max_chunks=4,
+                          **kwargs):
+        """ Iterate over all measurements matching filter arguments in
+            chunks, see `AsyncBackend.iter_chunks`. A producer running in
+            the export executor renders chunks ahead, at most `max_chunks`
+            of them, so memory stays flat. Measurements of non-blocking
+            backends are still fetched on the IOLoop, one chunk at a time.
+        """
+        render = render or list
+        measurements = self.backend.iter_measurements(chunk_size=chunk_size,
+                                                      **kwargs)
+
+        def next_chunk():
+            return list(itertools.islice(measurements, chunk_size))
+
+        if self._export_executor is None:
+            try:
+                while True:
+                    chunk = next_chunk()
+                    if not chunk:
+                        return
+                    yield render(chunk)
+            finally:
+                measurements.close()
+
+        loop = IOLoop.current().asyncio_loop
+        queue = asyncio.Queue(maxsize=max_chunks)
+        stopped = threading.Event()
+
+        def wait(future):
+            """ Wait for a future of the IOLoop
+
+            :return: (True, result), or (False, None) if the consumer is
+                     gone
+            """
+            while True:
+                try:
+                    return True, future.result(0.5)
+                except concurrent.futures.TimeoutError:
+                    if stopped.is_set():
+                        future.cancel()
+                        return False, None
+
+        def put(item):
+            """Put an item into queue, False if the consumer is gone"""
+            return wait(asyncio.run_coroutine_threadsafe(
+                queue.put(item), loop))[0]
+
+        def fetch():
+            """Get the next chunk, on the IOLoop for non-blocking backends"""
+            if self._executor is not None:
+                return True, next_chunk()
+
+            future = concurrent.futures.Future()
+
+            def run():
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    future.set_result(next_chunk())
+                except Exception as ex:
+                    future.set_exception(ex)
+
+            loop.call_soon_threadsafe(run)
+            return wait(future)
+
+        def produce():
+            try:
+                while True:
+                    fetched, chunk = fetch()
+                    if not fetched:
+                        return
+                    if not chunk:
+                        break
+                    if not put((render(chunk), None)):
+                        return
+                put((None, None))
+            except Exception as ex:
+                put((None, ex))
+            finally:
+                measurements.close()
+
+        self._export_executor.submit(produce)
+        try:
+            while True:
+                chunk, error = await queue.get()
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            stopped.set()
+
+
+def as_async(backend, executor=None):
+    """ Get the asynchronous interface of a backend
+
+    :param backend: a `Backend` instance
+    :param executor: executor used to run blocking operations, and
+                     exports of synchronous backends
+    :return: the backend itself if natively asynchronous, otherwise a
+             `SyncBackendAdapter`
+    """
+    if isinstance(backend, AsyncBackend):
+        return backend
+    if backend.is_nonblock():
+        return SyncBackendAdapter(backend, export_executor=executor)
+    return SyncBackendAdapter(backend, executor)
+
+
 class BackendFinder(BaseLoader):
     """ Backend Finder class
         : use to find all backend classes
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Context encoding helpers of backends which store contexts apart from
+    measurements: a context is split into its header set (headers and
+    cookies), which is mostly repeated across requests and deduplicated by
+    content hash, and the rest. Both are canonical JSON compressed by zlib
+    with an optional preset dictionary trained on sample contexts.
+"""
+import json
+import zlib
+import hashlib
+import collections
+
+
+# context keys making up the header set
+HEADER_KEYS = ("headers", "cookies")
+# zlib can't look back further than its 32KB window
+MAX_DICTIONARY_SIZE = 32 * 1024
+COMPRESS_LEVEL = 6
+
+
+def split_context(context):
+    """ Split a context into the rest and its header set
+
+    :param context: a context dict or None
+    :return: (rest dict or None, header set dict or None)
+    """
+    if context is None:
+        return None, None
+    if not any(key in context for key in HEADER_KEYS):
+        return context, None
+    rest = dict((key, value) for key, value in context.items()
+                if key not in HEADER_KEYS)
+    header_set = dict((key, context[key]) for key in HEADER_KEYS
+                      if key in context)
+    return rest, header_set
+
+
+def join_context(rest, header_set):
+    """Join what `split_context` splits"""
+    if header_set is None:
+        return rest
+    context = dict(rest or {})
+    context.update(header_set)
+    return context
+
+
+def dumps(value):
+    """Serialize a value into canonical JSON bytes"""
+    return json.dumps(value, sort_keys=True,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def digest(data):
+    """Content hash of serialized datas"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compress(data, dictionary=None):
+    if dictionary is None:
+        return zlib.compress(data, COMPRESS_LEVEL)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=dictionary)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, dictionary=None):
+    if dictionary is None:
+        return zlib.decompress(data)
+    decompressor = zlib.decompressobj(zdict=dictionary)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _fragments(value, fragments):
+    """Collect serialized "key":value items of a dict, recursively"""
+    for key, item in value.items():
+        if isinstance(item, dict) and item:
+            fragments.add(dumps(key) + b":{")
+            _fragments(item, fragments)
+        else:
+            fragments.add(dumps({key: item})[1:-1])
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """ Train a preset dictionary on sample datas: the JSON items found in
+        most samples, weighted by their length, the most valuable last as
+        zlib encodes closer matches more cheaply.
+
+    :param samples: a list of dicts, e.g. parts of contexts
+    :param size: max bytes of the dictionary
+    :return: bytes, empty if samples have nothing in common
+    """
+    counter = collections.Counter()
+    for sample in samples:
+        fragments = set()
+        _fragments(sample, fragments)
+        counter.update(fragments)
+
+    chosen = []
+    total = 0
+    ranked = sorted(((count * len(fragment), fragment)
+                     for fragment, count in counter.items() if count > 1),
+                    reverse=True)
+    for _, fragment in ranked:
+        if total + len(fragment) + 1 > size:
+            continue
+        chosen.append(fragment)
+        total += len(fragment) + 1
+    chosen.reverse()
+    return b",".join(chosen)
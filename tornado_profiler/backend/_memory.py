@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import bisect
+import heapq
+import itertools
+import collections
+
+from tornado_profiler.backend import Backend
+from tornado_profiler.backend._query import (parse_sort, parse_cursor,
+                                             make_cursor, jsonify, paginate,
+                                             after_cursor)
+from tornado_profiler.stats import (LatencyStats, Timeseries, is_error,
+                                    query_groups)
+
+
+class _Record(object):
+
+    __slots__ = ("id", "name", "method", "begin_time", "finish_time",
+                 "elapse_time", "status", "context", "metrics")
+
+    def __init__(self, _id, name, method, begin_time, finish_time,
+                 elapse_time, status, context, metrics):
+        self.id = _id
+        self.name = name
+        self.method = method
+        self.begin_time = begin_time
+        self.finish_time = finish_time
+        self.elapse_time = elapse_time
+        self.status = status
+        self.context = context
+        self.metrics = metrics
+
+
+class Memory(Backend):
+    """ Keep the latest measurements in memory, indexed by name, method and
+        finish time. Groups without a time range are maintained
+        incrementally. Datas are lost when the process stops.
+    """
+
+    def __init__(self, max_records=1000000, **kwargs):
+        """
+        :param max_records: max number of measurements retained, the
+                            oldest ones are evicted first
+        """
+        super(Memory, self).__init__()
+        self._max_records = max_records
+
+        # records[head:] are alive, ordered by id
+        self._records = []
+        self._head = 0
+        # id of records[0]
+        self._base_id = 1
+        # sorted (finish_time, id) of records, phases defer records out of
+        # finish time order, entries of evicted records are dropped when
+        # records are compacted
+        self._by_finish = []
+
+        self._by_name = dict()
+        self._by_method = dict()
+        self._groups = dict()
+        # groups whose min or max must be recomputed
+        self._dirty_groups = set()
+
+    @classmethod
+    def get_name(cls):
+        return "memory"
+
+    def is_nonblock(self):
+        return True
+
+    def __len__(self):
+        return len(self._records) - self._head
+
+    def insert(self, **kwargs):
+        self.insert_many([kwargs])
+
+    def insert_many(self, records):
+        for record in records:
+            finish_time = record.get("finish_time") or 0.0
+            rec = _Record(self._base_id + len(self._records),
+                          record["name"],
+                          record["method"],
+                          record.get("begin_time") or 0.0,
+                          finish_time,
+                          record["elapse_time"],
+                          record.get("status"),
+                          record.get("context"),
+                          record.get("metrics") or None)
+            self._records.append(rec)
+            entry = (finish_time, rec.id)
+            if not self._by_finish or entry > self._by_finish[-1]:
+                self._by_finish.append(entry)
+            else:
+                # NOTE: late records usually land near the end
+                bisect.insort(self._by_finish, entry)
+            self._by_name.setdefault(rec.name, collections.deque()) \
+                .append(rec)
+            self._by_method.setdefault(rec.method, collections.deque()) \
+                .append(rec)
+            key = (rec.name, rec.method)
+            stats = self._groups.get(key)
+            if stats is None:
+                stats = self._groups[key] = LatencyStats()
+            stats.add(rec.elapse_time, rec.metrics, is_error(rec.status))
+
+            if len(self) > self._max_records:
+                self._evict()
+
+    def _evict(self):
+        rec = self._records[self._head]
+        self._records[self._head] = None
+        self._head += 1
+
+        for index, value in ((self._by_name, rec.name),
+                             (self._by_method, rec.method)):
+            records = index[value]
+            records.popleft()
+            if not records:
+                del index[value]
+
+        key = (rec.name, rec.method)
+        stats = self._groups[key]
+        if not stats.count - 1:
+            del self._groups[key]
+            self._dirty_groups.discard(key)
+        elif stats.remove(rec.elapse_time, rec.metrics,
+                          is_error(rec.status)):
+            self._dirty_groups.add(key)
+
+        # NOTE: compact amortizedly
+        if self._head > len(self._records) // 2 and self._head > 1024:
+            del self._records[:self._head]
+            self._base_id += self._head
+            self._head = 0
+            base_id = self._base_id
+            self._by_finish = [entry for entry in self._by_finish
+                               if entry[1] >= base_id]
+
+    def _get(self, _id):
+        index = _id - self._base_id
+        if index < self._head or index >= len(self._records):
+            return None
+        return self._records[index]
+
+    @staticmethod
+    def _jsonify(rec, with_context=False, cursor_attr=None):
+        extra = dict()
+        if with_context:
+            extra["context"] = rec.context
+            extra["metrics"] = rec.metrics or {}
+        if cursor_attr is not None:
+            extra["cursor"] = make_cursor(getattr(rec, cursor_attr), rec.id)
+        return jsonify(rec.id, rec.name, rec.method, rec.begin_time,
+                       rec.finish_time, rec.elapse_time, rec.status, **extra)
+
+    def _time_range(self, begin_time, finish_time):
+        """ Get a view of records which may be in a time range, in finish
+            time order
+        """
+        lo, hi = 0, len(self._by_finish)
+        # NOTE: finish_time >= begin_time for every record
+        if begin_time is not None:
+            lo = bisect.bisect_left(self._by_finish, (begin_time,))
+        if finish_time is not None:
+            hi = bisect.bisect_right(self._by_finish,
+                                     (finish_time, float("inf")), lo)
+        return _FinishView(self, lo, hi)
+
+    def _sources(self, kwargs, by_id=False):
+        """ Choose the narrowest index for a query
+
+        :param by_id: whether sequences must be ordered by id
+
+        :return: (a list of id-ordered sequences, whether the sequences
+                 only contain records matching name and method)
+        """
+        name = kwargs.get("name")
+        name_regex = kwargs.get("name_regex")
+        method = kwargs.get("method")
+        if name is not None:
+            return [self._by_name.get(name, ())], method is None
+        elif name_regex is not None:
+            name_regex = name_regex.lower()
+            return [records for name, records in self._by_name.items()
+                    if name_regex in name.lower()], method is None
+        elif method is not None:
+            return [self._by_method.get(method, ())], True
+
+        begin_time = kwargs.get("begin_time")
+        finish_time = kwargs.get("finish_time")
+        if by_id or (begin_time is None and finish_time is None):
+            return [_Slice(self._records, self._head,
+                           len(self._records))], True
+        return [self._time_range(begin_time, finish_time)], True
+
+    @staticmethod
+    def _predicate(kwargs, matched, indexed=True):
+        """ Build a predicate for conditions not covered by the index
+
+        :param matched: whether records only match name and method
+        :param indexed: whether records were chosen by name or method
+        """
+        conditions = []
+        if not indexed:
+            name = kwargs.get("name")
+            name_regex = kwargs.get("name_regex")
+            if name is not None:
+                conditions.append(lambda rec: rec.name == name)
+            elif name_regex is not None:
+                name_regex = name_regex.lower()
+                conditions.append(
+                    lambda rec: name_regex in rec.name.lower())
+        method = kwargs.get("method")
+        if method is not None and not matched:
+            conditions.append(lambda rec: rec.method == method)
+        elapse_time = kwargs.get("elapse_time")
+        if elapse_time is not None:
+            conditions.append(lambda rec: rec.elapse_time >= elapse_time)
+        begin_time = kwargs.get("begin_time")
+        if begin_time is not None:
+            conditions.append(lambda rec: rec.begin_time >= begin_time)
+        finish_time = kwargs.get("finish_time")
+        if finish_time is not None:
+            conditions.append(lambda rec: rec.finish_time <= finish_time)
+
+        if not conditions:
+            return None
+        return lambda rec: all(condition(rec) for condition in conditions)
+
+    def filter(self, **kwargs):
+        _id = kwargs.get("id")
+        if _id is not None:
+            rec = self._get(int(_id))
+            if rec is None:
+                return None
+            with_context = kwargs.get("with_context", True)
+            return self._jsonify(rec, with_context=with_context)
+
+        attr, order = parse_sort(kwargs.get("sort", "finish_time,desc"))
+        reverse = order == "desc"
+        sources, matched = self._sources(kwargs, by_id=attr == "id")
+        predicate = self._predicate(kwargs, matched)
+        after = kwargs.get("after")
+        if after is not None:
+            after = parse_cursor(after, attr)
+        offset = kwargs.get("offset") or 0
+        limit = kwargs.get("limit")
+        stop = None if limit is None else offset + limit
+
+        def key(rec):
+            return getattr(rec, attr), rec.id
+
+        if attr == "finish_time" and self._walk_by_finish(sources):
+            # NOTE: walk the finish time index from the cursor, so a page
+            # costs O(page) even if records came out of finish time order
+            sources = [self._time_range(kwargs.get("begin_time"),
+                                        kwargs.get("finish_time"))]
+            predicate = self._predicate(kwargs, False, indexed=False)
+            view = sources[0]
+            if after is not None:
+                view.seek(after, reverse)
+            records = reversed(view) if reverse else iter(view)
+            if predicate is not None:
+                records = filter(predicate, records)
+            rows = list(itertools.islice(records, offset, stop))
+        elif attr == "id":
+            # NOTE: records are in id order, paginated without being sorted
+            if after is not None and isinstance(sources[0], _Slice):
+                # NOTE: jump to the cursor directly
+                index = after[1] - self._base_id
+                if reverse:
+                    sources[0].stop = max(sources[0].start,
+                                          min(sources[0].stop, index))
+                else:
+                    sources[0].start = min(sources[0].stop,
+                                           max(sources[0].start, index + 1))
+            if len(sources) == 1:
+                records = reversed(sources[0]) if reverse \
+                    else iter(sources[0])
+            else:
+                records = heapq.merge(
+                    *[reversed(source) if reverse else source
+                      for source in sources],
+                    key=lambda rec: rec.id, reverse=reverse)
+            if after is not None:
+                if reverse:
+                    records = itertools.dropwhile(
+                        lambda rec: rec.id >= after[1], records)
+                else:
+                    records = itertools.dropwhile(
+                        lambda rec: rec.id <= after[1], records)
+            if predicate is not None:
+                records = filter(predicate, records)
+            rows = list(itertools.islice(records, offset, stop))
+        else:
+            records = itertools.chain(*sources)
+            if predicate is not None:
+                records = filter(predicate, records)
+            if after is not None:
+                records = filter(after_cursor(key, order, after), records)
+            rows = paginate(records, key, order, offset, limit)
+
+        with_context = kwargs.get("with_context", False)
+        cursor_attr = attr if kwargs.get("with_cursor", False) else None
+        data = [self._jsonify(rec, with_context=with_context,
+                              cursor_attr=cursor_attr)
+                for rec in rows]
+
+        if kwargs.get("return_total", False):
+            if isinstance(sources[0], _FinishView):
+                # NOTE: count the whole range, not from the cursor
+                sources = [self._time_range(kwargs.get("begin_time"),
+                                            kwargs.get("finish_time"))]
+            if predicate is None:
+                total = sum(len(source) for source in sources)
+            else:
+                total = sum(1 for source in sources
+                            for rec in source if predicate(rec))
+            return total, data
+        return data
+
+    def _walk_by_finish(self, sources):
+        """ Whether to page by finish time over the finish time index
+            rather than sort records of name or method indexes
+        """
+        if isinstance(sources[0], (_Slice, _FinishView)):
+            return True
+        # NOTE: sorting a narrow index is cheaper than skipping records of
+        # other names while walking
+        return sum(len(source) for source in sources) * 8 >= len(self)
+
+    def _recompute(self, key):
+        """Recompute min and max of a group"""
+        name, method = key
+        stats = self._groups[key]
+        values = [rec.elapse_time for rec in self._by_name[name]
+                  if rec.method == method]
+        stats.min = min(values)
+        stats.max = max(values)
+
+    def group(self, **kwargs):
+        begin_time = kwargs.get("begin_time")
+        finish_time = kwargs.get("finish_time")
+        if begin_time is None and finish_time is None:
+            for key in self._dirty_groups:
+                self._recompute(key)
+            self._dirty_groups.clear()
+            return query_groups(self._groups, **kwargs)
+
+        groups = dict()
+        predicate = self._predicate(dict(begin_time=begin_time,
+                                         finish_time=finish_time), True)
+        for rec in self._time_range(begin_time, finish_time):
+            if not predicate(rec):
+                continue
+            key = (rec.name, rec.method)
+            stats = groups.get(key)
+            if stats is None:
+                stats = groups[key] = LatencyStats()
+            stats.add(rec.elapse_time, rec.metrics, is_error(rec.status))
+        return query_groups(groups, **kwargs)
+
+    def timeseries(self, **kwargs):
+        series = Timeseries.create(**kwargs)
+        # NOTE: records finishing before the range can't begin in it
+        sources, matched = self._sources(dict(
+            name=kwargs.get("name"), method=kwargs.get("method"),
+            begin_time=series.begin_time))
+        method = kwargs.get("method")
+        for source in sources:
+            for rec in source:
+                if rec.begin_time < series.begin_time or \
+                        rec.begin_time >= series.finish_time:
+                    continue
+                if method is not None and not matched and \
+                        rec.method != method:
+                    continue
+                series.add(rec.begin_time, rec.elapse_time, rec.status)
+        return series.as_dict()
+
+
+class _Slice(object):
+    """A sized and reversible view of a list range, without copying"""
+
+    __slots__ = ("items", "start", "stop")
+
+    def __init__(self, items, start, stop):
+        self.items = items
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        items = self.items
+        return (items[i] for i in range(self.start, self.stop))
+
+    def __reversed__(self):
+        items = self.items
+        return (items[i] for i in range(self.stop - 1, self.start - 1, -1))
+
+
+class _FinishView(object):
+    """ A reversible view of a range of the finish time index, yielding
+        records which are still alive
+    """
+
+    __slots__ = ("memory", "start", "stop")
+
+    def __init__(self, memory, start, stop):
+        self.memory = memory
+        self.start = start
+        self.stop = stop
+
+    def seek(self, after, reverse):
+        """Narrow the view to entries after a (finish_time, id) cursor"""
+        entries = self.memory._by_finish
+        if reverse:
+            self.stop = max(self.start, bisect.bisect_left(
+                entries, after, self.start, self.stop))
+        else:
+            self.start = min(self.stop, bisect.bisect_right(
+                entries, after, self.start, self.stop))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def _records(self, indexes):
+        entries = self.memory._by_finish
+        get = self.memory._get
+        for index in indexes:
+            rec = get(entries[index][1])
+            if rec is not None:
+                yield rec
+
+    def __iter__(self):
+        return self._records(range(self.start, self.stop))
+
+    def __reversed__(self):
+        return self._records(range(self.stop - 1, self.start - 1, -1))
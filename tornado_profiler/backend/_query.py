@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Query helpers shared by backends which evaluate `Backend.filter`
+    semantics themselves, instead of delegating them to a database.
+"""
+import heapq
+
+
+MEASUREMENT_SORT_KEYS = ("id", "name", "method", "begin_time",
+                         "finish_time", "elapse_time")
+
+
+def parse_sort(sort):
+    """ Parse a sort argument like "finish_time,desc"
+
+    :return: (attribute, order) where order is "asc" or "desc"
+    """
+    sort = sort.split(",")
+    if sort[0] not in MEASUREMENT_SORT_KEYS:
+        raise ValueError("Unknown sort attribute %r" % sort[0])
+    order = "asc"
+    if len(sort) >= 2:
+        order = sort[1].lower()
+        if order not in ["asc", "desc"]:
+            raise ValueError("Unknown sort order %r" % sort[1])
+    return sort[0], order
+
+
+def parse_cursor(after, attr):
+    """ Parse a keyset cursor of the form "<sort value>,<id>"
+
+    :return: (sort value, id)
+    """
+    value, _, after_id = after.rpartition(",")
+    try:
+        after_id = int(after_id)
+        if attr == "id":
+            value = int(value)
+        elif attr not in ("name", "method"):
+            value = float(value)
+    except ValueError:
+        raise ValueError("Unknown cursor %r" % after)
+    return value, after_id
+
+
+def make_cursor(value, _id):
+    """Make a keyset cursor, see `parse_cursor`"""
+    return "%s,%d" % (value if isinstance(value, str) else repr(value), _id)
+
+
+def jsonify(_id, name, method, begin_time, finish_time, elapse_time,
+            status=None, **extra):
+    """Build a measurement dict the way `Sqlalchemy.jsonify` does"""
+    data = {
+        "id": _id,
+        "name": name,
+        "method": method,
+        "begin_time": round(begin_time, 6),
+        "finish_time": round(finish_time, 6),
+        "elapse_time": round(elapse_time, 6),
+        "status": status,
+    }
+    data.update(extra)
+    return data
+
+
+def paginate(candidates, key, order, offset=None, limit=None):
+    """ Sort and paginate candidates without sorting all of them when a
+        limit is given.
+
+    :param candidates: an iterable of rows
+    :param key: a function mapping a row to (sort value, id)
+    :param order: "asc" or "desc"
+    :return: a list of rows
+    """
+    offset = offset or 0
+    if limit is None:
+        rows = sorted(candidates, key=key, reverse=order == "desc")
+    elif order == "desc":
+        rows = heapq.nlargest(offset + limit, candidates, key=key)
+    else:
+        rows = heapq.nsmallest(offset + limit, candidates, key=key)
+    if limit is None:
+        return rows[offset:]
+    return rows[offset:offset + limit]
+
+
+def after_cursor(key, order, cursor):
+    """ Build a predicate keeping rows after a keyset cursor
+
+    :param key: a function mapping a row to (sort value, id)
+    :param cursor: (sort value, id) returned by `parse_cursor`
+    """
+    if order == "desc":
+        return lambda row: key(row) < cursor
+    return lambda row: key(row) > cursor
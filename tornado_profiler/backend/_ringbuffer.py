@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import mmap
+import struct
+
+from tornado_profiler.backend import Backend
+from tornado_profiler.backend._query import (parse_sort, parse_cursor,
+                                             make_cursor, jsonify, paginate,
+                                             after_cursor)
+from tornado_profiler.stats import (LatencyStats, Timeseries, is_error,
+                                    query_groups)
+
+
+class Ringbuffer(Backend):
+    """ Store the latest measurements as fixed-size records in a
+        memory-mapped ring file, which survives process restarts.
+
+        Records are laid out column by column, so queries scan typed views
+        of the mapped file. Names and methods are interned into a side
+        table, contexts and metrics are kept in separate rings of
+        variable-length entries. It's non-blocking and must be used by one
+        process.
+    """
+
+    MAGIC = b"TPRING02"
+    # magic, capacity, context ring size, metrics ring size, next id,
+    # context ring head, metrics ring head
+    HEADER = struct.Struct("<8sQQQQQQ")
+    HEADER_SIZE = 4096
+    # column name, typecode
+    COLUMNS = (
+        ("id", "Q"),
+        ("name", "I"),
+        ("method", "I"),
+        ("begin_time", "d"),
+        ("finish_time", "d"),
+        ("elapse_time", "d"),
+        # status code, 0 for None
+        ("status", "H"),
+        ("context_offset", "Q"),
+        ("context_length", "I"),
+        ("metrics_offset", "Q"),
+        ("metrics_length", "I"),
+    )
+
+    def __init__(self, path="tornado_profiler.ring", capacity=100000,
+                 context_size=16 * 1024 * 1024,
+                 metrics_size=4 * 1024 * 1024, **kwargs):
+        """
+        :param path: path of the ring file, names are interned into
+                     `<path>.names`, contexts kept in `<path>.ctx` and
+                     metrics in `<path>.metrics`
+        :param capacity: max number of measurements retained
+        :param context_size: bytes of the context ring
+        :param metrics_size: bytes of the metrics ring
+        """
+        super(Ringbuffer, self).__init__()
+        self._path = os.path.abspath(path)
+        self._capacity = capacity
+
+        self._map = None
+        self._contexts = _EntryRing(self._path + ".ctx", context_size)
+        self._metrics = _EntryRing(self._path + ".metrics", metrics_size)
+        self._columns = dict()
+        self._next_id = 1
+
+        # interned string id <-> string
+        self._strings = []
+        self._string_ids = dict()
+        self._names_file = None
+
+    @classmethod
+    def get_name(cls):
+        return "ringbuffer"
+
+    def is_nonblock(self):
+        return True
+
+    @staticmethod
+    def _map_file(path, size):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def initialize(self):
+        size = self.HEADER_SIZE
+        for _, typecode in self.COLUMNS:
+            size += struct.calcsize(typecode) * self._capacity
+
+        exists = os.path.exists(self._path) and \
+            os.path.getsize(self._path) > 0
+        if exists:
+            with open(self._path, "rb") as f:
+                header = self.HEADER.unpack(f.read(self.HEADER.size))
+            magic, capacity, context_size, metrics_size, next_id, \
+                context_head, metrics_head = header
+            if magic != self.MAGIC or capacity != self._capacity or \
+                    context_size != self._contexts.size or \
+                    metrics_size != self._metrics.size:
+                raise Exception("Ring file %s was created with another "
+                                "version, capacity or ring size"
+                                % self._path)
+
+        self._map = self._map_file(self._path, size)
+        self._contexts.map = self._map_file(self._contexts.path,
+                                            self._contexts.size)
+        self._metrics.map = self._map_file(self._metrics.path,
+                                           self._metrics.size)
+        if exists:
+            self._next_id = next_id
+            self._contexts.head = context_head
+            self._metrics.head = metrics_head
+        else:
+            self._write_header()
+
+        view = memoryview(self._map)
+        offset = self.HEADER_SIZE
+        for column, typecode in self.COLUMNS:
+            length = struct.calcsize(typecode) * self._capacity
+            self._columns[column] = \
+                view[offset:offset + length].cast(typecode)
+            offset += length
+
+        names_path = self._path + ".names"
+        if os.path.exists(names_path):
+            with open(names_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._add_string(json.loads(line))
+        self._names_file = open(names_path, "at", encoding="utf-8")
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self._capacity,
+                              self._contexts.size, self._metrics.size,
+                              self._next_id, self._contexts.head,
+                              self._metrics.head)
+
+    def _add_string(self, string):
+        string_id = self._string_ids[string] = len(self._strings)
+        self._strings.append(string)
+        return string_id
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._add_string(string)
+            self._names_file.write(json.dumps(string) + "\n")
+            self._names_file.flush()
+        return string_id
+
+    def insert(self, **kwargs):
+        self.insert_many([kwargs])
+
+    def insert_many(self, records):
+        columns = self._columns
+        for record in records:
+            slot = (self._next_id - 1) % self._capacity
+            # NOTE: invalidate the slot first, write id at last
+            columns["id"][slot] = 0
+            columns["name"][slot] = self._intern(record["name"])
+            columns["method"][slot] = self._intern(record["method"])
+            columns["begin_time"][slot] = record.get("begin_time") or 0.0
+            columns["finish_time"][slot] = record.get("finish_time") or 0.0
+            columns["elapse_time"][slot] = record["elapse_time"]
+            columns["status"][slot] = record.get("status") or 0
+            offset, length = self._contexts.write(record.get("context"))
+            columns["context_offset"][slot] = offset
+            columns["context_length"][slot] = length
+            offset, length = self._metrics.write(record.get("metrics"))
+            columns["metrics_offset"][slot] = offset
+            columns["metrics_length"][slot] = length
+            columns["id"][slot] = self._next_id
+            self._next_id += 1
+        self._write_header()
+
+    def purge(self):
+        # NOTE: ring is bounded by itself, just sync it to disk
+        self._map.flush()
+        self._contexts.map.flush()
+        self._metrics.map.flush()
+        return 0
+
+    def _scan(self, kwargs):
+        """Yield slots of measurements matching kwargs, newest first"""
+        columns = self._columns
+        ids = columns["id"]
+        begin_times = columns["begin_time"]
+        finish_times = columns["finish_time"]
+        elapse_times = columns["elapse_time"]
+        names = columns["name"]
+        methods = columns["method"]
+
+        method_id = None
+        method = kwargs.get("method")
+        if method is not None:
+            method_id = self._string_ids.get(method)
+            if method_id is None:
+                return
+
+        name_ids = None
+        name = kwargs.get("name")
+        name_regex = kwargs.get("name_regex")
+        if name is not None:
+            name_ids = set([self._string_ids.get(name)])
+        elif name_regex is not None:
+            name_regex = name_regex.lower()
+            name_ids = set(string_id for string_id, string
+                           in enumerate(self._strings)
+                           if name_regex in string.lower())
+
+        elapse_time = kwargs.get("elapse_time")
+        begin_time = kwargs.get("begin_time")
+        finish_time = kwargs.get("finish_time")
+
+        last_id = self._next_id - 1
+        first_id = max(1, last_id - self._capacity + 1)
+        for _id in range(last_id, first_id - 1, -1):
+            slot = (_id - 1) % self._capacity
+            if ids[slot] != _id:
+                continue
+            if method_id is not None and methods[slot] != method_id:
+                continue
+            if name_ids is not None and names[slot] not in name_ids:
+                continue
+            if elapse_time is not None and elapse_times[slot] < elapse_time:
+                continue
+            if begin_time is not None and begin_times[slot] < begin_time:
+                continue
+            if finish_time is not None and finish_times[slot] > finish_time:
+                continue
+            yield slot
+
+    def _jsonify(self, slot, with_context=False, cursor_attr=None):
+        columns = self._columns
+        extra = dict()
+        if with_context:
+            extra["context"] = self._contexts.read(
+                columns["context_offset"][slot],
+                columns["context_length"][slot])
+            extra["metrics"] = self._read_metrics(slot) or {}
+        if cursor_attr is not None:
+            extra["cursor"] = make_cursor(self._sort_value(slot, cursor_attr),
+                                          columns["id"][slot])
+        return jsonify(
+            columns["id"][slot],
+            self._strings[columns["name"][slot]],
+            self._strings[columns["method"][slot]],
+            columns["begin_time"][slot],
+            columns["finish_time"][slot],
+            columns["elapse_time"][slot],
+            columns["status"][slot] or None,
+            **extra)
+
+    def _read_metrics(self, slot):
+        return self._metrics.read(self._columns["metrics_offset"][slot],
+                                  self._columns["metrics_length"][slot])
+
+    def _sort_value(self, slot, attr):
+        value = self._columns[attr][slot]
+        if attr in ("name", "method"):
+            value = self._strings[value]
+        return value
+
+    def filter(self, **kwargs):
+        _id = kwargs.get("id")
+        if _id is not None:
+            _id = int(_id)
+            slot = (_id - 1) % self._capacity
+            if _id <= 0 or self._columns["id"][slot] != _id:
+                return None
+            with_context = kwargs.get("with_context", True)
+            return self._jsonify(slot, with_context=with_context)
+
+        attr, order = parse_sort(kwargs.get("sort", "finish_time,desc"))
+        ids = self._columns["id"]
+
+        def key(slot):
+            return self._sort_value(slot, attr), ids[slot]
+
+        candidates = self._scan(kwargs)
+        return_total = kwargs.get("return_total", False)
+        if return_total:
+            candidates = list(candidates)
+            total = len(candidates)
+
+        after = kwargs.get("after")
+        if after is not None:
+            candidates = filter(
+                after_cursor(key, order, parse_cursor(after, attr)),
+                candidates)
+
+        slots = paginate(candidates, key, order,
+                         kwargs.get("offset"), kwargs.get("limit"))
+        with_context = kwargs.get("with_context", False)
+        cursor_attr = attr if kwargs.get("with_cursor", False) else None
+        data = [self._jsonify(slot, with_context=with_context,
+                              cursor_attr=cursor_attr)
+                for slot in slots]
+        if return_total:
+            return total, data
+        else:
+            return data
+
+    def group(self, **kwargs):
+        columns = self._columns
+        names = columns["name"]
+        methods = columns["method"]
+        elapse_times = columns["elapse_time"]
+        statuses = columns["status"]
+
+        # NOTE: search is applied by query_groups
+        scan_kwargs = dict(
+            begin_time=kwargs.get("begin_time"),
+            finish_time=kwargs.get("finish_time"),
+        )
+        stats_by_id = dict()
+        for slot in self._scan(scan_kwargs):
+            key = (names[slot], methods[slot])
+            stats = stats_by_id.get(key)
+            if stats is None:
+                stats = stats_by_id[key] = LatencyStats()
+            stats.add(elapse_times[slot], self._read_metrics(slot),
+                      is_error(statuses[slot]))
+
+        groups = dict(
+            ((self._strings[name_id], self._strings[method_id]), stats)
+            for (name_id, method_id), stats in stats_by_id.items())
+        return query_groups(groups, **kwargs)
+
+    def iter_measurements(self, chunk_size=1000, **kwargs):
+        # NOTE: one scan of the ring, sorting slots instead of paging
+        finish_times = self._columns["finish_time"]
+        ids = self._columns["id"]
+        slots = sorted(self._scan(kwargs),
+                       key=lambda slot: (finish_times[slot], ids[slot]))
+        with_context = kwargs.get("with_context", False)
+        for slot in slots:
+            yield self._jsonify(slot, with_context=with_context)
+
+    def timeseries(self, **kwargs):
+        columns = self._columns
+        begin_times = columns["begin_time"]
+        elapse_times = columns["elapse_time"]
+        statuses = columns["status"]
+
+        series = Timeseries.create(**kwargs)
+        # NOTE: records beginning in the range, like `Memory.timeseries`
+        for slot in self._scan(dict(
+                name=kwargs.get("name"), method=kwargs.get("method"),
+                begin_time=series.begin_time)):
+            begin_time = begin_times[slot]
+            if begin_time < series.finish_time:
+                series.add(begin_time, elapse_times[slot],
+                           statuses[slot] or None)
+        return series.as_dict()
+
+
+class _EntryRing(object):
+    """ A memory-mapped ring of variable-length JSON entries, addressed by
+        offsets growing forever, older entries are overwritten first
+    """
+
+    def __init__(self, path, size):
+        """
+        :param path: path of the ring file
+        :param size: bytes of the ring
+        """
+        self.path = path
+        self.size = size
+        self.map = None
+        # offset of the next entry
+        self.head = 0
+
+    def write(self, value):
+        """Append a JSON-serializable value, return (offset, length)"""
+        if value is None:
+            return 0, 0
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        data = value.encode("utf-8")
+        length = len(data)
+        if length == 0 or length > self.size:
+            return 0, 0
+
+        position = self.head % self.size
+        if position + length > self.size:
+            # NOTE: entries never wrap, skip the tail of the ring
+            self.head += self.size - position
+            position = 0
+        self.map[position:position + length] = data
+        offset = self.head
+        self.head += length
+        return offset, length
+
+    def read(self, offset, length):
+        if length == 0 or offset < self.head - self.size:
+            # no entry, or already overwritten
+            return None
+        position = offset % self.size
+        return json.loads(bytes(self.map[position:position + length]).decode())
@@ -1,13 +1,68 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+import math
+import time
+import itertools
+import functools
 
 from tornado_profiler.backend import Backend
+from tornado_profiler.backend._context import (split_context, join_context,
+                                               dumps, digest, compress,
+                                               decompress, train_dictionary)
+from tornado_profiler.backend._query import make_cursor
+from tornado_profiler.stats import (LatencySketch, LatencyStats, Timeseries,
+                                    is_error, query_groups)
 
 
 class Sqlalchemy(Backend):
 
-    def __init__(self, db_url="sqlite:///tornado_profiler.db", **kwargs):
+    # seconds each rollup row covers, from fine to coarse
+    ROLLUP_RESOLUTIONS = (60, 3600)
+
+    # attempts of a batch insert racing with other writers on unique rows
+    INSERT_ATTEMPTS = 3
+
+    # pragmas of file sqlite connections, see `sqlite_pragmas`
+    SQLITE_PRAGMAS = (
+        # readers don't block the writer, nor the other way round
+        ("journal_mode", "WAL"),
+        # WAL is still consistent, only durability of last commits is lost
+        ("synchronous", "NORMAL"),
+        # in KiB if negative
+        ("cache_size", -16000),
+        ("mmap_size", 256 * 1024 * 1024),
+        ("busy_timeout", 5000),
+        ("temp_store", "MEMORY"),
+    )
+
+    def __init__(self, db_url="sqlite:///tornado_profiler.db", max_age=None,
+                 max_rows=None, max_context_size=None, rollup_max_age=None,
+                 purge_chunk_size=1000, purge_max_seconds=5, count_cap=10000,
+                 sqlite_pragmas=None, context_dictionary_samples=1000,
+                 **kwargs):
+        """
+        :param db_url: database url
+        :param max_age: delete measurements and blocking events older
+                        than it(seconds)
+        :param max_rows: delete oldest measurements beyond this many rows
+        :param max_context_size: drop contexts larger than it(bytes) when
+                                 they are stored
+        :param rollup_max_age: a dict mapping rollup resolution to seconds
+                               its rows are kept, rollups are kept forever
+                               by default, so trends survive raw deletion
+        :param purge_chunk_size: max rows affected by one purge statement
+        :param purge_max_seconds: time budget of one purge(seconds), rows
+                                  left are deleted by the next purge
+        :param count_cap: max rows counted for an approximate total
+        :param sqlite_pragmas: a dict overriding `SQLITE_PRAGMAS` of a file
+                               sqlite database, None values disable pragmas
+        :param context_dictionary_samples: number of contexts the zlib
+                                           dictionary of contexts is
+                                           trained on, None to compress
+                                           without dictionary
+        :param kwargs: arguments of `sqlalchemy.create_engine`
+        """
         super(Sqlalchemy, self).__init__()
         try:
             from sqlalchemy import create_engine
@@ -17,15 +72,86 @@ class Sqlalchemy(Backend):
                             "'sqlalchemy' manually. Use command:\n"
                             "'pip install sqlalchemy'.")
 
+        self._max_age = max_age
+        self._max_rows = max_rows
+        self._max_context_size = max_context_size
+        self._rollup_max_age = dict(rollup_max_age or {})
+        self._purge_chunk_size = purge_chunk_size
+        self._purge_max_seconds = purge_max_seconds
+        self._count_cap = count_cap
+        self._dictionary_samples = context_dictionary_samples
+        # contexts kept to train the dictionary
+        self._samples = []
+        # id of the dictionary new contexts are compressed with
+        self._dictionary_id = None
+        # dictionary id -> dictionary, None for no dictionary
+        self._dictionaries = {None: None}
+        # contexts of older versions of measurements with id no greater
+        # than it are moved to the side table, None once all are moved
+        self._context_moved_id = 0
+
         self.db_engine = create_engine(db_url, **kwargs)
+        self.db_read_engine = self.db_engine
+        if self.db_engine.name == "sqlite" and not self.is_nonblock():
+            self._init_sqlite_engines(db_url, sqlite_pragmas, kwargs)
+
+        # NOTE: sessions of db_pool write, sessions of db_read_pool query
         self.db_pool = sessionmaker(bind=self.db_engine, autocommit=False)
+        self.db_read_pool = sessionmaker(bind=self.db_read_engine,
+                                         autocommit=False)
         # NOTE: sqlite connection can't share across threads
         if self.db_engine.name == "sqlite":
             self.db_pool = scoped_session(self.db_pool)
+            self.db_read_pool = scoped_session(self.db_read_pool)
+
+    def _init_sqlite_engines(self, db_url, pragmas, kwargs):
+        """ Use a single writer connection and separate read-only
+            connections for a file sqlite database, so that writes don't
+            race for the database lock across threads.
+        """
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.pool import QueuePool
+
+        self.db_engine.dispose()
+        pragmas = [(key, value) for key, value
+                   in dict(self.SQLITE_PRAGMAS, **(pragmas or {})).items()
+                   if value is not None]
+        connect_args = dict(kwargs.pop("connect_args", {}),
+                            check_same_thread=False)
+
+        # NOTE: threads take turns on the only connection of the pool
+        # instead of retrying on "database is locked"
+        writer_kwargs = dict(kwargs, poolclass=QueuePool, pool_size=1,
+                             max_overflow=0)
+        self.db_engine = create_engine(db_url, connect_args=connect_args,
+                                       **writer_kwargs)
+        event.listen(self.db_engine, "connect",
+                     functools.partial(self._set_pragmas, pragmas=pragmas))
+
+        # NOTE: journal mode is persistent and set by the writer
+        read_pragmas = [(key, value) for key, value in pragmas
+                        if key != "journal_mode"]
+        read_pragmas.append(("query_only", "ON"))
+        self.db_read_engine = create_engine(db_url,
+                                            connect_args=connect_args,
+                                            **kwargs)
+        event.listen(self.db_read_engine, "connect",
+                     functools.partial(self._set_pragmas,
+                                       pragmas=read_pragmas))
+
+    @staticmethod
+    def _set_pragmas(dbapi_connection, connection_record, pragmas):
+        cursor = dbapi_connection.cursor()
+        try:
+            for key, value in pragmas:
+                cursor.execute("PRAGMA %s=%s" % (key, value))
+        finally:
+            cursor.close()
 
     def initialize(self):
         from sqlalchemy.ext.declarative import declarative_base
-        from sqlalchemy import Column, Text, Float, Integer, String
+        from sqlalchemy import (Column, Text, Float, Integer, String, Index,
+                                LargeBinary, ForeignKey)
         from sqlalchemy.orm import deferred
 
         base = declarative_base()
@@ -33,24 +159,176 @@ class Sqlalchemy(Backend):
         class Measurement(base):
             """Table used to store measurements"""
             __tablename__ = "measurements"
+            # NOTE: indexes match the access patterns of MeasurementHandler
+            __table_args__ = (
+                Index("ix_measurements_finish_time", "finish_time", "id"),
+                Index("ix_measurements_begin_time", "begin_time"),
+                Index("ix_measurements_elapse_time", "elapse_time"),
+                Index("ix_measurements_name_method", "name", "method",
+                      "finish_time", mysql_length={"name": 255}),
+                Index("ix_measurements_method", "method", "finish_time"),
+            )
 
             id = Column(Integer, primary_key=True)
             name = Column(Text, nullable=False)
             method = Column(String(32), nullable=False)
+            # NOTE: contexts are stored in measurement_contexts, only
+            # measurements of older versions not moved yet have one here
             context = deferred(Column(Text, nullable=True))
+            # a JSON dict of metrics, e.g. phase timings
+            metrics = deferred(Column(Text, nullable=True))
 
             begin_time = Column(Float, nullable=True)
             finish_time = Column(Float, nullable=True)
             elapse_time = Column(Float, nullable=False)
+            # response status code
+            status = Column(Integer, nullable=True)
 
             def __repr__(self):
                 return "<Measurement {id}, {name}, {method}>".format(
                     id=self.id, name=self.name, method=self.method
                 )
 
+        class Rollup(base):
+            """Table used to store pre-aggregated measurements"""
+            __tablename__ = "measurement_rollups"
+            __table_args__ = (
+                Index("ix_rollups_bucket", "resolution", "bucket", "name",
+                      "method", unique=True, mysql_length={"name": 255}),
+            )
+
+            id = Column(Integer, primary_key=True)
+            resolution = Column(Integer, nullable=False)
+            bucket = Column(Float, nullable=False)
+            name = Column(Text, nullable=False)
+            method = Column(String(32), nullable=False)
+
+            count = Column(Integer, nullable=False)
+            # number of error responses, see `tornado_profiler.stats`
+            errors = Column(Integer, nullable=True)
+            total = Column(Float, nullable=False)
+            min = Column(Float, nullable=False)
+            max = Column(Float, nullable=False)
+            histogram = Column(Text, nullable=False)
+            # a JSON dict of metric sums
+            metrics = Column(Text, nullable=True)
+
+            def __repr__(self):
+                return "<Rollup {resolution}, {bucket}, {name}, {method}>" \
+                    .format(resolution=self.resolution, bucket=self.bucket,
+                            name=self.name, method=self.method)
+
+        class MeasurementContext(base):
+            """Table used to store compressed contexts of measurements"""
+            __tablename__ = "measurement_contexts"
+            __table_args__ = (
+                Index("ix_measurement_contexts_header_set", "header_set_id"),
+            )
+
+            # id of the measurement
+            id = Column(Integer, ForeignKey("measurements.id"),
+                        primary_key=True, autoincrement=False)
+            header_set_id = Column(Integer,
+                                   ForeignKey("context_header_sets.id"),
+                                   nullable=True)
+            dictionary_id = Column(Integer, nullable=True)
+            # bytes of the serialized context
+            size = Column(Integer, nullable=False)
+            # the context but its header set, compressed JSON
+            data = Column(LargeBinary, nullable=False)
+
+            def __repr__(self):
+                return "<MeasurementContext {id}>".format(id=self.id)
+
+        class HeaderSet(base):
+            """Table used to store header sets of contexts, deduplicated"""
+            __tablename__ = "context_header_sets"
+            __table_args__ = (
+                Index("ix_context_header_sets_digest", "digest", unique=True),
+            )
+
+            id = Column(Integer, primary_key=True)
+            # sha256 of the serialized header set
+            digest = Column(String(64), nullable=False)
+            dictionary_id = Column(Integer, nullable=True)
+            # headers and cookies, compressed JSON
+            data = Column(LargeBinary, nullable=False)
+
+            def __repr__(self):
+                return "<HeaderSet {id}>".format(id=self.id)
+
+        class ContextDictionary(base):
+            """Table used to store zlib dictionaries of contexts"""
+            __tablename__ = "context_dictionaries"
+
+            id = Column(Integer, primary_key=True)
+            created_time = Column(Float, nullable=False)
+            data = Column(LargeBinary, nullable=False)
+
+            def __repr__(self):
+                return "<ContextDictionary {id}>".format(id=self.id)
+
+        class BlockingEvent(base):
+            """Table used to store IOLoop blocking events"""
+            __tablename__ = "blocking_events"
+            __table_args__ = (
+                Index("ix_blocking_events_begin_time", "begin_time", "id"),
+            )
+
+            id = Column(Integer, primary_key=True)
+            name = Column(Text, nullable=True)
+            method = Column(String(32), nullable=True)
+            uri = Column(Text, nullable=True)
+            handler = Column(Text, nullable=True)
+            begin_time = Column(Float, nullable=False)
+            duration = Column(Float, nullable=False)
+            stack = deferred(Column(Text, nullable=True))
+
+            def __repr__(self):
+                return "<BlockingEvent {id}, {name}, {duration}>".format(
+                    id=self.id, name=self.name, duration=self.duration
+                )
+
         base.metadata.create_all(self.db_engine)
+        # NOTE: create_all doesn't add new columns and indexes to existing
+        # tables
+        self._add_missing_columns(base)
+        for table in base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.db_engine, checkfirst=True)
         globals()["Base"] = base
         globals()["Measurement"] = Measurement
+        globals()["Rollup"] = Rollup
+        globals()["MeasurementContext"] = MeasurementContext
+        globals()["HeaderSet"] = HeaderSet
+        globals()["ContextDictionary"] = ContextDictionary
+        globals()["BlockingEvent"] = BlockingEvent
+
+        self._init_rollups()
+        self._init_dictionary()
+
+    def _add_missing_columns(self, base):
+        """Add nullable columns missing in existing tables"""
+        from sqlalchemy import inspect, text
+
+        dialect = self.db_engine.dialect
+        preparer = dialect.identifier_preparer
+        with self.db_engine.begin() as connection:
+            inspector = inspect(connection)
+            for table in base.metadata.sorted_tables:
+                existing = set(column["name"] for column
+                               in inspector.get_columns(table.name))
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    if not column.nullable:
+                        raise Exception("Column %s.%s is missing, migrate "
+                                        "it manually" % (table.name,
+                                                         column.name))
+                    connection.execute(text("ALTER TABLE %s ADD COLUMN %s %s"
+                                            % (preparer.quote(table.name),
+                                               preparer.quote(column.name),
+                                               column.type.compile(dialect))))
 
     @classmethod
     def get_name(cls):
@@ -64,19 +342,281 @@ class Sqlalchemy(Backend):
 
         return False
 
+    @staticmethod
+    def _load_context(context):
+        if context is None or isinstance(context, dict):
+            return context
+        return json.loads(context)
+
+    @staticmethod
+    def _dump_metrics(metrics):
+        if not metrics:
+            return None
+        return json.dumps(metrics, separators=(",", ":"))
+
+    def _init_dictionary(self):
+        """Load the latest dictionary new contexts are compressed with"""
+        ContextDictionary = globals()["ContextDictionary"]
+        session = self.db_read_pool()
+        try:
+            row = session.query(ContextDictionary).order_by(
+                ContextDictionary.id.desc()).first()
+        finally:
+            session.close()
+        if row is not None:
+            self._dictionaries[row.id] = row.data
+            self._dictionary_id = row.id
+
+    def _get_dictionary(self, session, dictionary_id):
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None and dictionary_id is not None:
+            # NOTE: trained by another process, e.g. the aggregator
+            ContextDictionary = globals()["ContextDictionary"]
+            dictionary = session.query(ContextDictionary.data).filter(
+                ContextDictionary.id == dictionary_id).scalar()
+            self._dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+    def _train_dictionary(self, contexts):
+        """ Keep contexts as samples until there are enough of them, then
+            train a dictionary on them, committed at once
+        """
+        if self._dictionary_id is not None or not self._dictionary_samples:
+            return
+        self._samples.extend(context for context in contexts if context)
+        if len(self._samples) < self._dictionary_samples:
+            return
+
+        samples, self._samples = self._samples, []
+        dictionary = train_dictionary(samples)
+        if not dictionary:
+            # NOTE: samples have nothing in common, don't retry
+            self._dictionary_samples = None
+            return
+        ContextDictionary = globals()["ContextDictionary"]
+        session = self.db_pool()
+        try:
+            result = session.execute(ContextDictionary.__table__.insert(),
+                                     dict(created_time=time.time(),
+                                          data=dictionary))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        dictionary_id = result.inserted_primary_key[0]
+        self._dictionaries[dictionary_id] = dictionary
+        self._dictionary_id = dictionary_id
+
+    def _insert_ignore(self, table):
+        """ Build an insert statement skipping rows which duplicate a unique
+            key, where the dialect supports it
+        """
+        name = self.db_engine.dialect.name
+        if name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+
+            return insert(table).on_conflict_do_nothing()
+        if name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+
+            return insert(table).on_conflict_do_nothing()
+        if name == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+
+            statement = insert(table)
+            return statement.on_duplicate_key_update(
+                id=statement.table.c.id)
+        return table.insert()
+
+    def _find_header_sets(self, session, digests):
+        """ Find header sets by content hash, locked until the session
+            commits so the purge of another writer can't delete them
+
+        :return: a dict mapping digest to header set id
+        """
+        HeaderSet = globals()["HeaderSet"]
+        ids = dict()
+        # NOTE: keep the IN clause short
+        for i in range(0, len(digests), 500):
+            ids.update(session.query(HeaderSet.digest, HeaderSet.id).filter(
+                HeaderSet.digest.in_(digests[i:i + 500])).with_for_update())
+        return ids
+
+    def _header_set_ids(self, session, header_sets, dictionary):
+        """ Get ids of serialized header sets, new ones are inserted
+
+        :param header_sets: a dict mapping digest to serialized header set
+        :return: a dict mapping digest to header set id
+        """
+        HeaderSet = globals()["HeaderSet"]
+        ids = self._find_header_sets(session, list(header_sets))
+        missing = [key for key in header_sets if key not in ids]
+        if missing:
+            # NOTE: another writer may insert the same header sets
+            # meanwhile, they're found again once inserted
+            session.execute(self._insert_ignore(HeaderSet.__table__), [
+                dict(digest=key, dictionary_id=self._dictionary_id,
+                     data=compress(header_sets[key], dictionary))
+                for key in missing])
+            ids.update(self._find_header_sets(session, missing))
+        return ids
+
+    def _insert_contexts(self, session, contexts):
+        """ Compress contexts into the side table, not committed
+
+        :param contexts: a list of (measurement id, context dict) tuples
+        """
+        MeasurementContext = globals()["MeasurementContext"]
+        dictionary = self._dictionaries[self._dictionary_id]
+        rows = []
+        # digest -> serialized header set
+        header_sets = dict()
+        for _id, context in contexts:
+            rest, header_set = split_context(context)
+            data = dumps(rest)
+            size = len(data)
+            header_data = None
+            if header_set is not None:
+                header_data = dumps(header_set)
+                size += len(header_data)
+            if self._max_context_size is not None and \
+                    size > self._max_context_size:
+                data = dumps(dict(context_dropped=True, context_size=size))
+                header_data = None
+            header_set_id = None
+            if header_data is not None:
+                header_set_id = digest(header_data)
+                header_sets[header_set_id] = header_data
+            rows.append(dict(
+                id=_id,
+                header_set_id=header_set_id,
+                dictionary_id=self._dictionary_id,
+                size=size,
+                data=compress(data, dictionary),
+            ))
+        if header_sets:
+            ids = self._header_set_ids(session, header_sets, dictionary)
+            for row in rows:
+                if row["header_set_id"] is not None:
+                    row["header_set_id"] = ids[row["header_set_id"]]
+        if rows:
+            session.execute(MeasurementContext.__table__.insert(), rows)
+
+    def _load_contexts(self, session, ids):
+        """ Load and decode contexts of measurements
+
+        :return: a dict mapping measurement id to context, measurements
+                 without context in the side table are missing
+        """
+        MeasurementContext = globals()["MeasurementContext"]
+        HeaderSet = globals()["HeaderSet"]
+        ids = list(ids)
+        rows = []
+        # NOTE: keep the IN clause short
+        for i in range(0, len(ids), 500):
+            rows.extend(session.query(MeasurementContext).filter(
+                MeasurementContext.id.in_(ids[i:i + 500])))
+
+        header_set_ids = list(set(row.header_set_id for row in rows
+                                  if row.header_set_id is not None))
+        header_sets = dict()
+        for i in range(0, len(header_set_ids), 500):
+            for header_set in session.query(HeaderSet).filter(
+                    HeaderSet.id.in_(header_set_ids[i:i + 500])):
+                header_sets[header_set.id] = json.loads(decompress(
+                    header_set.data,
+                    self._get_dictionary(session, header_set.dictionary_id)))
+
+        contexts = dict()
+        for row in rows:
+            rest = json.loads(decompress(
+                row.data, self._get_dictionary(session, row.dictionary_id)))
+            contexts[row.id] = join_context(
+                rest, header_sets.get(row.header_set_id))
+        return contexts
+
     def insert(self, **kwargs):
-        # Prevent IDE from error reporting
+        self.insert_many([kwargs])
+
+    def insert_many(self, records):
+        from sqlalchemy.exc import IntegrityError
+
+        if not records:
+            return
+
         Measurement = globals()["Measurement"]
-        measurement = Measurement(**kwargs)
+        rows = []
+        contexts = []
+        for record in records:
+            # NOTE: records are left untouched, so that they can be retried
+            contexts.append(self._load_context(record.get("context")))
+            rows.append(dict(record, context=None,
+                             metrics=self._dump_metrics(record.get("metrics")),
+                             # NOTE: a bulk insert needs the same keys in
+                             # every record
+                             status=record.get("status")))
+        self._train_dictionary(contexts)
 
         session = self.db_pool()
-        session.add(measurement)
-        session.commit()
+        for attempt in range(self.INSERT_ATTEMPTS):
+            try:
+                if any(context is not None for context in contexts):
+                    # NOTE: ids are needed to link contexts
+                    ids = self._insert_returning_ids(session, rows, contexts)
+                    self._insert_contexts(session, [
+                        (_id, context) for _id, context in zip(ids, contexts)
+                        if context is not None])
+                else:
+                    session.execute(Measurement.__table__.insert(), rows)
+                self._update_rollups(session, rows)
+                session.commit()
+                return
+            except IntegrityError:
+                session.rollback()
+                # NOTE: another writer inserted the same rollup meanwhile,
+                # it's found by the next attempt
+                if attempt + 1 >= self.INSERT_ATTEMPTS:
+                    raise
+            except Exception:
+                session.rollback()
+                raise
 
-        return measurement
+    def _insert_returning_ids(self, session, rows, contexts):
+        """ Insert measurements, ids of those with a context are returned
+
+        :return: a list of ids, None for measurements without context
+        """
+        Measurement = globals()["Measurement"]
+        table = Measurement.__table__
+        if getattr(self.db_engine.dialect,
+                   "insert_executemany_returning_sort_by_parameter_order",
+                   False):
+            result = session.execute(table.insert().returning(
+                table.c.id, sort_by_parameter_order=True), rows)
+            return result.scalars().all()
+
+        # NOTE: without RETURNING, only measurements with a context are
+        # inserted one by one, in order
+        ids = []
+        for without_context, group in itertools.groupby(
+                zip(rows, contexts), lambda item: item[1] is None):
+            group = [row for row, _ in group]
+            if without_context:
+                session.execute(table.insert(), group)
+                ids.extend([None] * len(group))
+                continue
+            for row in group:
+                ids.append(session.execute(
+                    table.insert(), row).inserted_primary_key[0])
+        return ids
 
     @staticmethod
-    def jsonify(measurement, with_context=False):
+    def jsonify(measurement, with_context=False, cursor_attr=None,
+                contexts=None):
+        """
+        :param contexts: a dict mapping measurement id to context, see
+                         `_load_contexts`, needed if with_context
+        """
         if not measurement:
             return measurement
 
@@ -87,23 +627,68 @@ class Sqlalchemy(Backend):
             "begin_time": round(measurement.begin_time, 6),
             "finish_time": round(measurement.finish_time, 6),
             "elapse_time": round(measurement.elapse_time, 6),
+            "status": measurement.status,
         }
         if with_context:
-            data["context"] = json.loads(measurement.context or "null")
+            if contexts is not None and measurement.id in contexts:
+                data["context"] = contexts[measurement.id]
+            else:
+                data["context"] = json.loads(measurement.context or "null")
+            data["metrics"] = json.loads(measurement.metrics or "{}")
+        if cursor_attr is not None:
+            # NOTE: use unrounded value, or keyset pagination may skip rows
+            data["cursor"] = make_cursor(getattr(measurement, cursor_attr),
+                                         measurement.id)
         return data
 
-    def filter(self, **kwargs):
-        from sqlalchemy.orm.attributes import InstrumentedAttribute
+    def _count(self, query, exact):
+        """ Count rows of a query
+
+        :param exact: if False, an approximate total is returned: rows are
+                      only counted up to `count_cap`, and the id span is
+                      used for the unfiltered table.
+        """
+        from sqlalchemy import func
+
+        if exact:
+            return query.count()
 
         Measurement = globals()["Measurement"]
-        session = self.db_pool()
-        query = session.query(Measurement)
+        if query.whereclause is None:
+            session = self.db_read_pool()
+            min_id, max_id = session.query(
+                func.min(Measurement.id), func.max(Measurement.id)).one()
+            if max_id is None:
+                return 0
+            return max_id - min_id + 1
+        return query.limit(self._count_cap).count()
 
-        _id = kwargs.get("id")
-        if _id is not None:
-            measurement = query.get(_id)
-            with_context = kwargs.get("with_context", True)
-            return self.jsonify(measurement, with_context=with_context)
+    @staticmethod
+    def _keyset(query, sort_attr, order, after):
+        """ Filter rows after a cursor of the form "<sort value>,<id>"
+        """
+        from sqlalchemy import or_, and_
+
+        Measurement = globals()["Measurement"]
+        value, _, after_id = after.rpartition(",")
+        try:
+            after_id = int(after_id)
+            value = sort_attr.type.python_type(value)
+        except (ValueError, NotImplementedError):
+            raise ValueError("Unknown cursor %r" % after)
+
+        if order == "desc":
+            return query.filter(or_(
+                sort_attr < value,
+                and_(sort_attr == value, Measurement.id < after_id)))
+        return query.filter(or_(
+            sort_attr > value,
+            and_(sort_attr == value, Measurement.id > after_id)))
+
+    @staticmethod
+    def _filter_query(query, kwargs):
+        """Apply filter arguments of measurements to a query"""
+        Measurement = globals()["Measurement"]
 
         elapse_time = kwargs.get("elapse_time")
         if elapse_time is not None:
@@ -128,22 +713,55 @@ class Sqlalchemy(Backend):
         elif name_regex is not None:
             name_regex = ''.join(['%', name_regex, '%'])
             query = query.filter(Measurement.name.ilike(name_regex))
+        return query
+
+    def filter(self, **kwargs):
+        from sqlalchemy.orm import undefer
+        from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+        Measurement = globals()["Measurement"]
+        session = self.db_read_pool()
+        query = session.query(Measurement)
+
+        _id = kwargs.get("id")
+        if _id is not None:
+            with_context = kwargs.get("with_context", True)
+            if with_context:
+                # NOTE: contexts of older versions are still in the table
+                query = query.options(undefer(Measurement.context))
+            measurement = query.get(_id)
+            contexts = None
+            if measurement is not None and with_context:
+                contexts = self._load_contexts(session, [measurement.id])
+            return self.jsonify(measurement, with_context=with_context,
+                                contexts=contexts)
+
+        query = self._filter_query(query, kwargs)
+        with_context = kwargs.get("with_context", False)
+        if with_context:
+            query = query.options(undefer(Measurement.context))
 
         sort = kwargs.get("sort", "finish_time,desc").split(",")
         sort_attr = getattr(Measurement, sort[0], None)
         if sort_attr is None or not isinstance(sort_attr, InstrumentedAttribute):
             raise ValueError("Unknown sort attribute %r" % sort[0])
+        order = "asc"
         if len(sort) >= 2:
             order = sort[1].lower()
             if order not in ["asc", "desc"]:
                 raise ValueError("Unknown sort order %r" % sort[1])
-            else:
-                sort_attr = getattr(sort_attr, order)()
-        query = query.order_by(sort_attr)
 
+        # return_total may be True, False or "approximate"
         return_total = kwargs.get("return_total", False)
         if return_total:
-            total = query.count()
+            total = self._count(query, return_total != "approximate")
+
+        after = kwargs.get("after")
+        if after is not None:
+            query = self._keyset(query, sort_attr, order, after)
+        # NOTE: id breaks ties, so that keyset pagination is stable
+        query = query.order_by(getattr(sort_attr, order)(),
+                               getattr(Measurement.id, order)())
 
         offset = kwargs.get("offset")
         if offset is not None:
@@ -153,91 +771,532 @@ class Sqlalchemy(Backend):
         if limit is not None:
             query = query.limit(limit)
 
-        with_context = kwargs.get("with_context", False)
-        data = [self.jsonify(row, with_context=with_context)
-                for row in query.all()]
+        cursor_attr = sort[0] if kwargs.get("with_cursor", False) else None
+        rows = query.all()
+        contexts = None
+        if with_context:
+            contexts = self._load_contexts(session, [row.id for row in rows])
+        data = [self.jsonify(row, with_context=with_context,
+                             cursor_attr=cursor_attr, contexts=contexts)
+                for row in rows]
+        if return_total == "approximate":
+            # NOTE: never let an approximate total end pagination early
+            seen = (offset or 0) + len(data)
+            if limit is not None and len(data) == limit:
+                seen += 1
+            total = max(total, seen)
         if return_total:
             return total, data
         else:
             return data
 
-    def group(self, **kwargs):
-        from sqlalchemy import func, or_
+    def iter_measurements(self, chunk_size=1000, **kwargs):
+        from sqlalchemy.orm import undefer
 
         Measurement = globals()["Measurement"]
+        session = self.db_read_pool()
+        # NOTE: contexts are loaded through another connection, a streaming
+        # cursor may be open on the first one. Sessions of sqlite are
+        # scoped, but its cursors are buffered.
+        context_session = self.db_read_pool()
+        try:
+            query = self._filter_query(session.query(Measurement), kwargs)
+            with_context = kwargs.get("with_context", False)
+            if with_context:
+                query = query.options(undefer(Measurement.context),
+                                      undefer(Measurement.metrics))
+            # NOTE: stream rows with a server-side cursor where the driver
+            # supports it, chunk by chunk otherwise
+            rows = iter(query.order_by(Measurement.id).yield_per(chunk_size))
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                contexts = None
+                if with_context:
+                    contexts = self._load_contexts(
+                        context_session, [row.id for row in chunk])
+                for row in chunk:
+                    yield self.jsonify(row, with_context=with_context,
+                                       contexts=contexts)
+        finally:
+            if context_session is not session:
+                context_session.close()
+            session.close()
+
+    def insert_blocking(self, events):
+        BlockingEvent = globals()["BlockingEvent"]
+        records = [dict(event, stack=json.dumps(event.get("stack") or []))
+                   for event in events]
+        if not records:
+            return
+
         session = self.db_pool()
-        query = session.query(
-            Measurement.name,
-            Measurement.method,
-            func.count(Measurement.id).label("count"),
-            func.min(Measurement.elapse_time).label("min"),
-            func.max(Measurement.elapse_time).label("max"),
-            func.avg(Measurement.elapse_time).label("avg"),
-        ).group_by(
-            Measurement.name,
-            Measurement.method,
-        )
+        try:
+            session.execute(BlockingEvent.__table__.insert(), records)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
 
-        begin_time = kwargs.get("begin_time")
-        if begin_time is not None:
-            query = query.filter(Measurement.begin_time >= begin_time)
+    @staticmethod
+    def _jsonify_blocking(event, with_stack=False):
+        data = {
+            "id": event.id,
+            "name": event.name,
+            "method": event.method,
+            "uri": event.uri,
+            "handler": event.handler,
+            "begin_time": round(event.begin_time, 6),
+            "duration": round(event.duration, 6),
+        }
+        if with_stack:
+            data["stack"] = json.loads(event.stack or "[]")
+        return data
 
-        finish_time = kwargs.get("finish_time")
-        if finish_time is not None:
-            query = query.filter(Measurement.finish_time <= finish_time)
+    def filter_blocking(self, **kwargs):
+        from sqlalchemy.orm import undefer
 
-        search = kwargs.get("search")
-        if search is not None:
-            search = ''.join(['%', search, '%'])
-            query = query.filter(or_(
-                Measurement.name.ilike(search),
-                Measurement.method.ilike(search),
-            ))
-        else:
-            method = kwargs.get("method")
-            if method is not None:
-                query = query.filter_by(method=method)
+        BlockingEvent = globals()["BlockingEvent"]
+        session = self.db_read_pool()
+        query = session.query(BlockingEvent)
 
-            name = kwargs.get("name")
-            if name is not None:
-                query = query.filter_by(name=name)
+        _id = kwargs.get("id")
+        if _id is not None:
+            event = query.options(undefer(BlockingEvent.stack)).get(_id)
+            if event is None:
+                return None
+            return self._jsonify_blocking(event, with_stack=True)
 
-        sort = kwargs.get("sort", "count,desc").split(",")
-        if sort[0] not in ["name", "method", "count", "min", "max", "avg"]:
-            raise ValueError("Unknown sort attribute %r" % sort[0])
-        if len(sort) >= 2:
-            sort[1] = sort[1].lower()
-            if sort[1] not in ["asc", "desc"]:
-                raise ValueError("Unknown sort order %r" % sort[1])
-        query = query.order_by(' '.join(sort))
+        for key in ("name", "method"):
+            value = kwargs.get(key)
+            if value is not None:
+                query = query.filter(getattr(BlockingEvent, key) == value)
+        begin_time = kwargs.get("begin_time")
+        if begin_time is not None:
+            query = query.filter(BlockingEvent.begin_time >= begin_time)
+        finish_time = kwargs.get("finish_time")
+        if finish_time is not None:
+            query = query.filter(
+                BlockingEvent.begin_time + BlockingEvent.duration <=
+                finish_time)
+        min_duration = kwargs.get("min_duration")
+        if min_duration is not None:
+            query = query.filter(BlockingEvent.duration >= min_duration)
 
         return_total = kwargs.get("return_total", False)
         if return_total:
             total = query.count()
 
+        with_stack = kwargs.get("with_stack", False)
+        if with_stack:
+            query = query.options(undefer(BlockingEvent.stack))
+        query = query.order_by(BlockingEvent.begin_time.desc(),
+                               BlockingEvent.id.desc())
         offset = kwargs.get("offset")
         if offset is not None:
             query = query.offset(offset)
-
         limit = kwargs.get("limit")
         if limit is not None:
             query = query.limit(limit)
 
-        data = [
-            dict(
-                name=row[0],
-                method=row[1],
-                count=row[2],
-                min=round(row[3], 6),
-                max=round(row[4], 6),
-                avg=round(row[5], 6),
-            )
-            for row in query.all()
-        ]
+        data = [self._jsonify_blocking(event, with_stack=with_stack)
+                for event in query.all()]
         if return_total:
             return total, data
+        return data
+
+    @classmethod
+    def _aggregate(cls, records):
+        """ Aggregate measurements into rollup buckets
+
+        :param records: an iterable of (name, method, begin_time,
+                        elapse_time, status, metrics) tuples, metrics is a
+                        JSON string or None
+        :return: a dict mapping (resolution, bucket, name, method) to
+                 `LatencyStats`
+        """
+        rollups = dict()
+        for name, method, begin_time, elapse_time, status, metrics \
+                in records:
+            if begin_time is None:
+                continue
+            if metrics:
+                metrics = json.loads(metrics)
+            error = is_error(status)
+            for resolution in cls.ROLLUP_RESOLUTIONS:
+                bucket = begin_time - begin_time % resolution
+                key = (resolution, bucket, name, method)
+                stats = rollups.get(key)
+                if stats is None:
+                    stats = rollups[key] = LatencyStats()
+                stats.add(elapse_time, metrics, error)
+        return rollups
+
+    @staticmethod
+    def _rollup_stats(rollup):
+        return LatencyStats.from_values(
+            rollup.count, rollup.total, rollup.min, rollup.max,
+            LatencySketch.loads(rollup.histogram),
+            json.loads(rollup.metrics or "{}"), rollup.errors)
+
+    def _merge_rollups(self, session, rollups):
+        """Merge aggregated buckets into rollup rows, not committed"""
+        from sqlalchemy import tuple_
+
+        Rollup = globals()["Rollup"]
+        existing = dict()
+        keys = list(rollups.keys())
+        # NOTE: keep the IN clause short
+        for i in range(0, len(keys), 100):
+            # NOTE: lock rows, so concurrent writers don't lose updates
+            query = session.query(Rollup).filter(tuple_(
+                Rollup.resolution, Rollup.bucket, Rollup.name, Rollup.method
+            ).in_(keys[i:i + 100])).with_for_update()
+            for rollup in query:
+                key = (rollup.resolution, rollup.bucket, rollup.name,
+                       rollup.method)
+                existing[key] = rollup
+
+        for key, stats in rollups.items():
+            rollup = existing.get(key)
+            if rollup is not None:
+                merged = self._rollup_stats(rollup)
+                merged.merge(stats)
+                stats = merged
+            else:
+                rollup = Rollup(resolution=key[0], bucket=key[1],
+                                name=key[2], method=key[3])
+                session.add(rollup)
+            rollup.count = stats.count
+            rollup.errors = stats.errors
+            rollup.total = stats.total
+            rollup.min = stats.min
+            rollup.max = stats.max
+            rollup.histogram = stats.sketch.dumps()
+            rollup.metrics = self._dump_metrics(stats.metrics)
+        session.flush()
+
+    def _update_rollups(self, session, records):
+        """Incrementally update rollups with new measurements"""
+        rollups = self._aggregate(
+            (record["name"], record["method"], record.get("begin_time"),
+             record["elapse_time"], record.get("status"),
+             record.get("metrics"))
+            for record in records)
+        if rollups:
+            self._merge_rollups(session, rollups)
+
+    def _init_rollups(self, chunk_size=10000):
+        """ Build rollups from existing measurements if there are none,
+            committing chunk by chunk so memory stays flat
+        """
+        Measurement = globals()["Measurement"]
+        Rollup = globals()["Rollup"]
+        session = self.db_pool()
+        try:
+            if session.query(Rollup.id).first() is not None:
+                session.commit()
+                return
+
+            last_id = 0
+            while True:
+                rows = session.query(
+                    Measurement.id,
+                    Measurement.name,
+                    Measurement.method,
+                    Measurement.begin_time,
+                    Measurement.elapse_time,
+                    Measurement.status,
+                    Measurement.metrics,
+                ).filter(Measurement.id > last_id).order_by(
+                    Measurement.id).limit(chunk_size).all()
+                if not rows:
+                    break
+                self._merge_rollups(session, self._aggregate(
+                    row[1:] for row in rows))
+                session.commit()
+                last_id = rows[-1][0]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def _split_range(self, begin_time, finish_time, resolutions=None):
+        """ Split a time range into segments aligned with the coarsest
+            rollups possible, and unaligned edges
+
+        :param resolutions: rollup resolutions to try, coarse first
+        :return: a list of (resolution, begin_time, finish_time), where
+                 resolution is None for edges read from raw measurements,
+                 None times are unbounded
+        """
+        if resolutions is None:
+            resolutions = sorted(self.ROLLUP_RESOLUTIONS, reverse=True)
+        if not resolutions:
+            return [(None, begin_time, finish_time)]
+
+        resolution, finer = resolutions[0], resolutions[1:]
+        aligned_begin, aligned_finish = begin_time, finish_time
+        if begin_time is not None:
+            aligned_begin = math.ceil(begin_time / resolution) * resolution
+        if finish_time is not None:
+            aligned_finish = math.floor(finish_time / resolution) * resolution
+        if aligned_begin is not None and aligned_finish is not None and \
+                aligned_begin >= aligned_finish:
+            return self._split_range(begin_time, finish_time, finer)
+
+        segments = []
+        if begin_time is not None and aligned_begin > begin_time:
+            segments.extend(self._split_range(begin_time, aligned_begin,
+                                              finer))
+        segments.append((resolution, aligned_begin, aligned_finish))
+        if finish_time is not None and aligned_finish < finish_time:
+            segments.extend(self._split_range(aligned_finish, finish_time,
+                                              finer))
+        return segments
+
+    @staticmethod
+    def _filter_groups(query, Model, kwargs):
+        """Filter a query of measurements or rollups by group arguments"""
+        from sqlalchemy import or_
+
+        search = kwargs.get("search")
+        if search is not None:
+            search = ''.join(['%', search, '%'])
+            return query.filter(or_(
+                Model.name.ilike(search),
+                Model.method.ilike(search),
+            ))
+        method = kwargs.get("method")
+        if method is not None:
+            query = query.filter(Model.method == method)
+        name = kwargs.get("name")
+        if name is not None:
+            query = query.filter(Model.name == name)
+        return query
+
+    def group(self, **kwargs):
+        session = self.db_read_pool()
+        groups = dict()
+
+        def get_stats(key):
+            stats = groups.get(key)
+            if stats is None:
+                stats = groups[key] = LatencyStats()
+            return stats
+
+        # NOTE: the aligned middle of the range is read from rollups, only
+        # the unaligned edges from raw measurements
+        for resolution, begin_time, finish_time in self._split_range(
+                kwargs.get("begin_time"), kwargs.get("finish_time")):
+            if resolution is not None:
+                Model = globals()["Rollup"]
+                query = session.query(Model).filter(
+                    Model.resolution == resolution)
+                if begin_time is not None:
+                    query = query.filter(Model.bucket >= begin_time)
+                if finish_time is not None:
+                    query = query.filter(
+                        Model.bucket + resolution <= finish_time)
+                query = self._filter_groups(query, Model, kwargs)
+                for rollup in query.yield_per(1000):
+                    get_stats((rollup.name, rollup.method)).merge(
+                        self._rollup_stats(rollup))
+                continue
+
+            Model = globals()["Measurement"]
+            query = session.query(
+                Model.name,
+                Model.method,
+                Model.elapse_time,
+                Model.status,
+                Model.metrics,
+            )
+            # NOTE: rollups bucket measurements by begin_time, so does the
+            # raw scan, both paths count the same measurements
+            if begin_time is not None:
+                query = query.filter(Model.begin_time >= begin_time)
+            if finish_time is not None:
+                query = query.filter(Model.begin_time < finish_time)
+            query = self._filter_groups(query, Model, kwargs)
+            for name, method, elapse_time, status, metrics in \
+                    query.yield_per(10000):
+                if metrics:
+                    metrics = json.loads(metrics)
+                get_stats((name, method)).add(elapse_time, metrics,
+                                              is_error(status))
+
+        return query_groups(groups, **kwargs)
+
+    def timeseries(self, **kwargs):
+        series = Timeseries.create(**kwargs)
+        # NOTE: buckets are aligned on their width, so are rollups of a
+        # resolution dividing it
+        resolution = None
+        for value in sorted(self.ROLLUP_RESOLUTIONS, reverse=True):
+            if not series.width % value:
+                resolution = value
+                break
+
+        session = self.db_read_pool()
+        if resolution is not None:
+            Model = globals()["Rollup"]
+            query = session.query(Model).filter(
+                Model.resolution == resolution,
+                Model.bucket >= series.begin_time,
+                Model.bucket < series.finish_time)
         else:
-            return data
+            # NOTE: buckets are finer than rollups, scan raw table
+            Model = globals()["Measurement"]
+            query = session.query(
+                Model.begin_time,
+                Model.elapse_time,
+                Model.status,
+            ).filter(
+                Model.begin_time >= series.begin_time,
+                Model.begin_time < series.finish_time)
+
+        method = kwargs.get("method")
+        if method is not None:
+            query = query.filter(Model.method == method)
+        name = kwargs.get("name")
+        if name is not None:
+            query = query.filter(Model.name == name)
+
+        if resolution is not None:
+            for rollup in query.yield_per(1000):
+                series.merge(rollup.bucket, self._rollup_stats(rollup))
+        else:
+            for begin_time, elapse_time, status in query.yield_per(10000):
+                series.add(begin_time, elapse_time, status)
+        return series.as_dict()
+
+    def _purge_chunks(self, model, condition, dependents=(), deadline=None):
+        """ Delete rows matching condition in small chunks, committing after
+            each chunk so write locks are held shortly, until no row is left
+            or the deadline is passed.
+
+        :param dependents: models whose rows of the same ids are deleted
+                           first
+        :param deadline: timestamp to stop at, None for no limit
+        :return: number of deleted rows
+        """
+        session = self.db_pool()
+        deleted = 0
+        while deadline is None or time.time() < deadline:
+            ids = [row[0] for row in session.query(model.id).filter(
+                condition).order_by(model.id).limit(self._purge_chunk_size)]
+            if not ids:
+                break
+            try:
+                for dependent in dependents:
+                    session.query(dependent).filter(
+                        dependent.id.in_(ids)).delete(
+                        synchronize_session=False)
+                session.query(model).filter(model.id.in_(ids)).delete(
+                    synchronize_session=False)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            deleted += len(ids)
+            if len(ids) < self._purge_chunk_size:
+                break
+            # NOTE: let other threads waiting for the GIL run between chunks
+            time.sleep(0)
+        # NOTE: give the writer connection back
+        session.commit()
+        return deleted
+
+    def _purge_header_sets(self, deadline=None):
+        """Delete header sets no context refers to"""
+        from sqlalchemy import exists
+
+        MeasurementContext = globals()["MeasurementContext"]
+        HeaderSet = globals()["HeaderSet"]
+        return self._purge_chunks(
+            HeaderSet,
+            ~exists().where(MeasurementContext.header_set_id == HeaderSet.id),
+            deadline=deadline)
+
+    def _move_contexts(self, deadline=None):
+        """ Move contexts stored in the measurements table by older versions
+            into the side table, in chunks until the deadline
+
+        :param deadline: timestamp to stop at, None for no limit
+        :return: number of moved contexts
+        """
+        Measurement = globals()["Measurement"]
+        session = self.db_pool()
+        moved = 0
+        while deadline is None or time.time() < deadline:
+            rows = session.query(Measurement.id, Measurement.context).filter(
+                Measurement.id > self._context_moved_id,
+                Measurement.context.isnot(None),
+            ).order_by(Measurement.id).limit(self._purge_chunk_size).all()
+            if not rows:
+                # NOTE: new measurements never store contexts there
+                self._context_moved_id = None
+                break
+            try:
+                self._insert_contexts(session, [
+                    (_id, self._load_context(context))
+                    for _id, context in rows])
+                session.query(Measurement).filter(Measurement.id.in_(
+                    [row[0] for row in rows])).update(
+                    {"context": None}, synchronize_session=False)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            moved += len(rows)
+            self._context_moved_id = rows[-1][0]
+        session.commit()
+        return moved
+
+    def purge(self):
+        Measurement = globals()["Measurement"]
+        MeasurementContext = globals()["MeasurementContext"]
+        Rollup = globals()["Rollup"]
+        now = time.time()
+        deadline = None
+        if self._purge_max_seconds is not None:
+            deadline = now + self._purge_max_seconds
+        affected = 0
+
+        if self._context_moved_id is not None:
+            self._move_contexts(deadline)
+
+        if self._max_age is not None:
+            affected += self._purge_chunks(
+                Measurement, Measurement.finish_time < now - self._max_age,
+                (MeasurementContext, ), deadline)
+            BlockingEvent = globals()["BlockingEvent"]
+            affected += self._purge_chunks(
+                BlockingEvent,
+                BlockingEvent.begin_time < now - self._max_age,
+                deadline=deadline)
+
+        if self._max_rows is not None:
+            session = self.db_pool()
+            row = session.query(Measurement.id).order_by(
+                Measurement.id.desc()).offset(self._max_rows).first()
+            session.commit()
+            if row is not None:
+                affected += self._purge_chunks(
+                    Measurement, Measurement.id <= row[0],
+                    (MeasurementContext, ), deadline)
+
+        if affected:
+            self._purge_header_sets(deadline)
+
+        for resolution, max_age in self._rollup_max_age.items():
+            affected += self._purge_chunks(
+                Rollup, (Rollup.resolution == resolution) &
+                (Rollup.bucket < now - max_age), deadline=deadline)
+
+        return affected
 
 
 if __name__ == '__main__':
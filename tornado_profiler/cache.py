@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import itertools
+import collections
+
+
+class CachedBackend(object):
+    """ Cache query results of an asynchronous backend interface for view
+        handlers, which poll the same queries over and over.
+
+        Results are keyed on the query and its normalized arguments, kept
+        for `ttl` seconds at most, evicted least recently used first, and
+        invalidated by `invalidate`, called once new datas are stored.
+        Results of queries whose time range doesn't overlap the stored
+        datas survive invalidation. Identical concurrent queries share a
+        single backend call.
+
+        NOTE: cached results are shared by callers, they mustn't be mutated
+    """
+
+    # queries whose results are cached, other attributes are delegated
+    CACHED_QUERIES = ("filter", "group", "timeseries", "filter_blocking")
+    # number of latest invalidations kept, older results are stale
+    MAX_INVALIDATIONS = 64
+
+    def __init__(self, backend, max_entries=256, ttl=2.0):
+        """
+        :param backend: an asynchronous backend interface, see
+                        `tornado_profiler.backend.as_async`
+        :param max_entries: max number of results kept
+        :param ttl: max seconds a result is kept
+        """
+        self.backend = backend
+        self._max_entries = max_entries
+        self._ttl = ttl
+        # key -> (generation, expire time, result)
+        self._entries = collections.OrderedDict()
+        # key -> future of the running backend call
+        self._inflight = dict()
+        self._generations = itertools.count(1)
+        # NOTE: bumped by writer threads, assignment is atomic
+        self._generation = next(self._generations)
+        # (generation, begin_time, finish_time) of latest invalidations
+        self._invalidations = collections.deque(
+            maxlen=self.MAX_INVALIDATIONS)
+        self._counters = collections.Counter()
+
+    def __getattr__(self, name):
+        if name in self.CACHED_QUERIES:
+            query = getattr(self.backend, name)
+
+            async def cached_query(**kwargs):
+                return await self._get(name, query, kwargs)
+            return cached_query
+        return getattr(self.backend, name)
+
+    def invalidate(self, begin_time=None, finish_time=None):
+        """ Invalidate cached results, it can be called by any thread
+
+        :param begin_time: min begin time of changed datas, None for
+                           unbounded
+        :param finish_time: max finish time of changed datas, None for
+                            unbounded
+        """
+        generation = next(self._generations)
+        # NOTE: appended first, so a query seeing the new generation is
+        # checked against it
+        self._invalidations.append((generation, begin_time, finish_time))
+        self._generation = generation
+
+    def _is_stale(self, generation, kwargs):
+        """ Whether a result of a generation was invalidated, datas
+            changed in the time range of its query
+        """
+        invalidations = list(self._invalidations)
+        if not invalidations or invalidations[-1][0] <= generation:
+            return False
+        if invalidations[0][0] > generation + 1:
+            # NOTE: invalidations since the generation were dropped
+            return True
+        begin_time = kwargs.get("begin_time")
+        finish_time = kwargs.get("finish_time")
+        for _generation, changed_begin, changed_finish in invalidations:
+            if _generation <= generation:
+                continue
+            # NOTE: datas finishing before the range, or beginning after
+            # it, aren't in the range
+            if begin_time is not None and changed_finish is not None and \
+                    changed_finish < begin_time:
+                continue
+            if finish_time is not None and changed_begin is not None and \
+                    changed_begin > finish_time:
+                continue
+            return True
+        return False
+
+    def stats(self):
+        """Get cache's counters"""
+        stats = dict(hits=0, misses=0, coalesced=0)
+        stats.update(self._counters)
+        stats["entries"] = len(self._entries)
+        return stats
+
+    @staticmethod
+    def _make_key(name, kwargs):
+        return (name, ) + tuple(sorted(
+            (key, value) for key, value in kwargs.items()
+            if value is not None))
+
+    async def _get(self, name, query, kwargs):
+        key = self._make_key(name, kwargs)
+        generation = self._generation
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic() and \
+                    not self._is_stale(entry[0], kwargs):
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[2]
+            del self._entries[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self._counters["coalesced"] += 1
+            # NOTE: shielded, a cancelled caller mustn't cancel the others
+            return await asyncio.shield(future)
+
+        self._counters["misses"] += 1
+        future = asyncio.ensure_future(query(**kwargs))
+        self._inflight[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        # NOTE: stale at once if datas of its range were stored meanwhile
+        self._entries[key] = (generation, time.monotonic() + self._ttl,
+                              result)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+        return result
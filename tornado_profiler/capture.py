@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+
+from tornado.httputil import parse_cookie
+
+
+CAPTURE_LEVELS = ("none", "minimal", "headers", "full")
+
+
+class ContextSnapshot(object):
+    """ References to the request attributes a context is made of.
+        Taking a snapshot copies nothing but references, so it's cheap
+        enough for the IOLoop, the context is rendered later elsewhere.
+    """
+
+    __slots__ = ("level", "uri", "version", "remote_ip", "protocol", "host",
+                 "path", "headers", "arguments", "body", "path_args",
+                 "extensions")
+
+    def __init__(self, level, request, path_args=None, extensions=None):
+        self.level = level
+        self.extensions = extensions
+        self.uri = request.uri
+        self.version = request.version
+        self.remote_ip = request.remote_ip
+        self.protocol = request.protocol
+        self.host = request.host
+        self.path = request.path
+        self.path_args = path_args
+        if level >= 2:
+            self.headers = request.headers
+        if level >= 3:
+            self.arguments = request.arguments
+            self.body = request.body
+
+
+class ContextCapture(object):
+    """ Capture request context at a configurable level
+
+        none: no context at all
+        minimal: url related attributes and path arguments
+        headers: minimal + headers and cookies
+        full: headers + arguments and body
+    """
+
+    def __init__(self, level="full", max_body_size=None, header_allow=None,
+                 header_deny=None):
+        """
+        :param level: one of "none", "minimal", "headers" and "full"
+        :param max_body_size: max bytes of body to keep, None means no limit
+        :param header_allow: if not None, only keep these headers
+        :param header_deny: never keep these headers
+        """
+        if level not in CAPTURE_LEVELS:
+            raise ValueError("Unknown capture level %r" % level)
+        self._level = CAPTURE_LEVELS.index(level)
+        self._max_body_size = max_body_size
+        self._header_allow = None
+        if header_allow is not None:
+            self._header_allow = set(h.lower() for h in header_allow)
+        self._header_deny = set(h.lower() for h in (header_deny or []))
+
+    def snapshot(self, request, path_args=None, extensions=None):
+        """ Take a snapshot of request, it should be called on the IOLoop
+
+        :param request: a `tornado.httputil.HTTPServerRequest` instance
+        :param path_args: a dict of path_args and path_kwargs
+        :param extensions: a dict of JSON-serializable values collected by
+                           instrumentations, kept at any level
+        :return: a `ContextSnapshot` or None if no context is captured
+        """
+        if self._level == 0 and not extensions:
+            return None
+        return ContextSnapshot(self._level, request, path_args, extensions)
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, bytes):
+            return value.decode("utf-8", errors="replace")
+        elif isinstance(value, dict):
+            return dict((k, ContextCapture._decode(v))
+                        for k, v in value.items())
+        elif isinstance(value, (list, tuple)):
+            return [ContextCapture._decode(v) for v in value]
+        return value
+
+    def _keep_header(self, name):
+        name = name.lower()
+        if self._header_allow is not None and name not in self._header_allow:
+            return False
+        return name not in self._header_deny
+
+    def render(self, snapshot):
+        """ Render a snapshot into a JSON-serializable context dict, it can
+            be called outside of the IOLoop.
+
+        :param snapshot: a `ContextSnapshot` or None
+        :return: a dict or None
+        """
+        if snapshot is None:
+            return None
+        if snapshot.level == 0:
+            return dict(snapshot.extensions)
+
+        context = {
+            "uri": snapshot.uri,
+            "version": snapshot.version,
+            "remote_ip": snapshot.remote_ip,
+            "protocol": snapshot.protocol,
+            "host": snapshot.host,
+            "path": snapshot.path,
+            "full_url": snapshot.protocol + "://" + snapshot.host +
+            snapshot.uri,
+        }
+
+        if snapshot.level >= 2:
+            headers = snapshot.headers
+            context["headers"] = dict(
+                (name, value) for name, value in headers.items()
+                if self._keep_header(name))
+            if "Cookie" in headers and self._keep_header("Cookie"):
+                context["cookies"] = parse_cookie(headers["Cookie"])
+            else:
+                context["cookies"] = {}
+
+        if snapshot.level >= 3:
+            context["arguments"] = self._decode(snapshot.arguments)
+            body = snapshot.body
+            if (self._max_body_size is not None and
+                    len(body) > self._max_body_size):
+                context["body_size"] = len(body)
+                context["body_truncated"] = True
+                body = body[:self._max_body_size]
+            # TODO: maybe decode the body according to Content-Type
+            context["body"] = base64.b64encode(body).decode()
+
+        if snapshot.path_args is not None:
+            context.update(self._decode(snapshot.path_args))
+        if snapshot.extensions:
+            context.update(snapshot.extensions)
+        return context
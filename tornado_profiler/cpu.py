@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Statistical CPU profiling: a `SIGPROF` timer interrupts the process
+    every `interval` seconds of CPU time, and the signal handler counts the
+    stack of the IOLoop thread by the route it was running. Overhead is
+    bounded by the sampling rate.
+"""
+import time
+import signal
+import threading
+
+
+# route name of samples taken while no request handler was running
+IDLE_ROUTE = "<loop>"
+
+
+class CPUSampler(object):
+    """ Sample stacks of the IOLoop thread into collapsed-stack counts per
+        (route name, method). Signal handlers run in the main thread, so
+        the IOLoop must run in the main thread too.
+    """
+
+    def __init__(self, tracker, interval=0.01, max_depth=64,
+                 max_stacks=10000):
+        """
+        :param tracker: a `HandlerTracker` telling the running request
+        :param interval: seconds of CPU time between two samples
+        :param max_depth: max number of innermost frames of a sample
+        :param max_stacks: max number of distinct stacks kept, samples of
+                           new stacks are dropped beyond it
+        """
+        self._tracker = tracker
+        self._interval = interval
+        self._max_depth = max_depth
+        self._max_stacks = max_stacks
+
+        self._loop = None
+        # (route name, method, stack of code objects) -> count
+        self._counts = dict()
+        self._samples = 0
+        self._dropped = 0
+        self._start_time = None
+        self._previous_handler = None
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def start(self):
+        """ Start sampling the current IOLoop, must be called in the main
+            thread
+        """
+        from tornado.ioloop import IOLoop
+
+        if self._start_time is not None:
+            return
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("CPU sampler must be started in the main "
+                               "thread")
+        self._loop = IOLoop.current().asyncio_loop
+        self._start_time = time.time()
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        # NOTE: restart system calls interrupted by the timer
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+
+    def stop(self):
+        if self._start_time is None:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF,
+                      self._previous_handler or signal.SIG_DFL)
+        self._start_time = None
+
+    def _sample(self, signum, frame):
+        """SIGPROF handler, keep it cheap"""
+        if frame is None:
+            return
+        handler = self._tracker.current(self._loop)
+        if handler is None:
+            name, method = IDLE_ROUTE, ""
+        else:
+            route = getattr(handler.request, "profiler_route_", None)
+            name = route.name if route is not None else IDLE_ROUTE
+            method = handler.request.method
+
+        codes = []
+        depth = self._max_depth
+        while frame is not None and depth > 0:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+            depth -= 1
+        key = (name, method, tuple(codes))
+
+        self._samples += 1
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts[key] = count + 1
+        elif len(self._counts) < self._max_stacks:
+            self._counts[key] = 1
+        else:
+            self._dropped += 1
+
+    @staticmethod
+    def _label(code):
+        return "%s (%s:%d)" % (code.co_name, code.co_filename,
+                               code.co_firstlineno)
+
+    def routes(self):
+        """ Get number of samples of each route
+
+        :return: a list of dicts of name, method and samples, most sampled
+                 first
+        """
+        samples = dict()
+        for (name, method, _), count in list(self._counts.items()):
+            samples[(name, method)] = samples.get((name, method), 0) + count
+        data = [dict(name=name, method=method, samples=count)
+                for (name, method), count in samples.items()]
+        data.sort(key=lambda route: route["samples"], reverse=True)
+        return data
+
+    def collapsed(self, name=None, method=None):
+        """ Get collapsed stacks, as consumed by flame graph tools
+
+        :param name: only stacks of this route if not None
+        :param method: only stacks of this HTTP method if not None
+        :return: a dict mapping "outer;...;inner" stacks to sample counts
+        """
+        stacks = dict()
+        labels = dict()
+        for (_name, _method, codes), count in list(self._counts.items()):
+            if name is not None and _name != name:
+                continue
+            if method is not None and _method != method:
+                continue
+            frames = []
+            for code in reversed(codes):
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = self._label(code)
+                frames.append(label)
+            stack = ";".join(frames)
+            stacks[stack] = stacks.get(stack, 0) + count
+        return stacks
+
+    def stats(self):
+        """Get sampler's counters"""
+        return dict(
+            start_time=self._start_time,
+            interval=self._interval,
+            samples=self._samples,
+            dropped=self._dropped,
+            stacks=len(self._counts),
+        )
+
+    def reset(self):
+        """Forget all samples"""
+        self._counts = dict()
+        self._samples = 0
+        self._dropped = 0
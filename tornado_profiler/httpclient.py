@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Outbound HTTP instrumentation: calls of `AsyncHTTPClient.fetch` made
+    while a request is running are recorded into the trace of the request,
+    see `tornado_profiler.trace`.
+
+    Metrics of a request:
+
+    * http.count: number of calls
+    * http.time: sum of call durations
+    * http.wait: wall time at least one call was in flight, the time the
+      request waited for downstream services
+
+    Calls are kept as "http_calls" of the measurement context, each a dict
+    of method, url (a template, ids and query stripped), status, begin_time,
+    time, request_size and response_size, with dns and connect seconds when
+    the client reports them (curl does).
+"""
+import re
+import time
+import functools
+from urllib.parse import urlsplit
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from tornado_profiler.trace import current_trace
+
+
+# path segments of ids: numbers, UUIDs and long hex digests
+_ID_SEGMENT = re.compile(
+    r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+    r"[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})$")
+
+
+def url_template(url):
+    """ Get the template of an URL, so that calls of a same endpoint are
+        grouped together, e.g. "http://api/users/42?x=1" gives
+        "http://api/users/{id}". Credentials, query and fragment are dropped.
+    """
+    parts = urlsplit(url)
+    netloc = parts.hostname or ""
+    if parts.port is not None:
+        netloc += ":%d" % parts.port
+    path = "/".join("{id}" if _ID_SEGMENT.match(segment) else segment
+                    for segment in parts.path.split("/"))
+    return "%s://%s%s" % (parts.scheme, netloc, path)
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    return len(body)
+
+
+def _response_size(response):
+    buffer = response.buffer
+    if buffer is not None:
+        return buffer.getbuffer().nbytes
+    try:
+        return int(response.headers.get("Content-Length", 0))
+    except ValueError:
+        return 0
+
+
+def instrument_http_client(max_calls=20):
+    """ Patch `AsyncHTTPClient.fetch` to record calls made by requests, it
+        does nothing if already patched.
+
+    :param max_calls: max number of calls kept in the context of a request,
+                      all calls are counted in metrics though
+    """
+    fetch = AsyncHTTPClient.fetch
+    if getattr(fetch, "profiler_instrumented_", False):
+        return
+
+    @functools.wraps(fetch)
+    def profiler_fetch(self, request, raise_error=True, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return fetch(self, request, raise_error=raise_error, **kwargs)
+
+        if isinstance(request, HTTPRequest):
+            url, method, body = request.url, request.method, request.body
+        else:
+            url = request
+            method = kwargs.get("method", "GET")
+            body = kwargs.get("body")
+        begin_time = time.time()
+        start = time.perf_counter()
+        trace.begin_wait("http")
+        future = fetch(self, request, raise_error=raise_error, **kwargs)
+
+        def on_done(future):
+            duration = time.perf_counter() - start
+            trace.end_wait("http")
+            trace.add_metric("http.count", 1)
+            trace.add_metric("http.time", duration)
+
+            response = error = None
+            if future.cancelled():
+                status = 599
+            else:
+                error = future.exception()
+                if error is None:
+                    response = future.result()
+                else:
+                    response = getattr(error, "response", None)
+                status = getattr(response or error, "code", 599)
+            call = dict(
+                method=method,
+                url=url_template(url),
+                status=status,
+                begin_time=round(begin_time, 6),
+                time=round(duration, 6),
+                request_size=_body_size(body),
+                response_size=0,
+            )
+            if response is not None:
+                call["response_size"] = _response_size(response)
+                time_info = response.time_info or {}
+                for key, name in (("namelookup", "dns"),
+                                  ("connect", "connect")):
+                    if key in time_info:
+                        call[name] = round(time_info[key], 6)
+            trace.append("http_calls", call, max_calls)
+
+        future.add_done_callback(on_done)
+        return future
+
+    profiler_fetch.profiler_instrumented_ = True
+    AsyncHTTPClient.fetch = profiler_fetch
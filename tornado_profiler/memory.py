@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Memory profiling: `tracemalloc` traces allocations of a sampled
+    fraction of requests, from the start of the request to `on_finish`.
+    Tracing is started when a sampled request begins and stopped once no
+    sampled request is running, so requests which aren't sampled only pay
+    for it while they overlap with sampled ones.
+
+    Metrics of a sampled request, see `tornado_profiler.trace`:
+
+    * memory.samples: 1, group APIs average other "memory." metrics over it
+    * memory.peak: peak traced bytes above the start of the request
+    * memory.delta: traced bytes allocated and not freed by the request
+
+    Its context gets a "memory" dict of peak, delta and sites, the lines
+    which allocated the most bytes still allocated, each a dict of site
+    ("<file>:<line>"), size and count.
+
+    tracemalloc traces the whole process: allocations of concurrent
+    requests are counted in all the sampled requests they overlap with.
+    Before Python 3.9, the traced peak can't be reset, and the peak of a
+    request is only sampled when sampled requests begin and end.
+"""
+import heapq
+import tracemalloc
+
+from tornado_profiler.sampling import Sampler
+
+
+# files whose allocations aren't reported as sites
+_IGNORED_FILES = frozenset((tracemalloc.__file__, __file__,
+                            "<frozen importlib._bootstrap>", "<unknown>"))
+# tracemalloc.reset_peak is new in Python 3.9
+_RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+def _line_sizes(snapshot):
+    """ Reduce a snapshot to its allocated bytes per line, so it isn't kept
+
+    :return: a dict mapping (file, line) to (size, count)
+    """
+    sizes = dict()
+    for stat in snapshot.statistics("lineno"):
+        frame = stat.traceback[0]
+        if frame.filename not in _IGNORED_FILES:
+            sizes[(frame.filename, frame.lineno)] = (stat.size, stat.count)
+    return sizes
+
+
+class _MemoryState(object):
+    """Memory of a sampled request being profiled"""
+
+    __slots__ = ("start", "peak", "sizes")
+
+    def __init__(self, start, sizes):
+        self.start = start
+        self.peak = start
+        # bytes allocated per line at the start, see `_line_sizes`
+        self.sizes = sizes
+
+
+class MemoryProfiler(object):
+    """ Profile memory allocations of sampled requests """
+
+    def __init__(self, rate=0.0, rules=None, max_sites=10, frames=1):
+        """
+        :param rate: default fraction of requests to profile
+        :param rules: per-route rates, see `tornado_profiler.sampling`
+        :param max_sites: max number of allocation sites kept, 0 to skip
+                          snapshots and only measure peak and delta
+        :param frames: number of frames tracemalloc keeps per allocation
+        """
+        self._sampler = Sampler(rate=rate, rules=rules, slow_threshold=None,
+                                error_status=None)
+        self._max_sites = max_sites
+        self._frames = frames
+        # states of the sampled requests running
+        self._active = []
+        # whether tracemalloc was started by us
+        self._started = False
+
+    def _update_peaks(self, peak):
+        for state in self._active:
+            if peak > state.peak:
+                state.peak = peak
+
+    def begin(self, handler):
+        """Begin profiling a request if it's sampled"""
+        route = getattr(handler.request, "profiler_route_", None)
+        if route is None or not self._sampler.sample_head(route):
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._started = True
+        sizes = None
+        if self._max_sites:
+            sizes = _line_sizes(tracemalloc.take_snapshot())
+        if _RESET_PEAK:
+            # NOTE: the peak is global, hand it over to running requests
+            # before resetting it
+            self._update_peaks(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        else:
+            self._update_peaks(tracemalloc.get_traced_memory()[0])
+        state = _MemoryState(tracemalloc.get_traced_memory()[0], sizes)
+        self._active.append(state)
+        handler.profiler_memory_ = state
+
+    def end(self, handler):
+        """ End profiling a request, it does nothing if the request isn't
+            being profiled. Results are recorded into its trace.
+        """
+        state = getattr(handler, "profiler_memory_", None)
+        if state is None:
+            return
+        handler.profiler_memory_ = None
+        current, peak = tracemalloc.get_traced_memory()
+        self._update_peaks(peak if _RESET_PEAK else current)
+        self._active.remove(state)
+        result = dict(peak=state.peak - state.start,
+                      delta=current - state.start,
+                      sites=[])
+        if state.sizes is not None:
+            result["sites"] = self._sites(
+                state.sizes, _line_sizes(tracemalloc.take_snapshot()))
+        if not self._active and self._started:
+            tracemalloc.stop()
+            self._started = False
+
+        trace = getattr(handler, "profiler_trace_", None)
+        if trace is not None:
+            trace.add_metric("memory.samples", 1)
+            trace.add_metric("memory.peak", result["peak"])
+            trace.add_metric("memory.delta", result["delta"])
+            trace.extensions["memory"] = result
+
+    def _sites(self, before, after):
+        """ Get the lines which allocated the most bytes still allocated
+
+        :param before: sizes per line at the start, see `_line_sizes`
+        :param after: sizes per line at the end
+        """
+        diffs = []
+        for key, (size, count) in after.items():
+            old_size, old_count = before.get(key, (0, 0))
+            if size > old_size:
+                diffs.append((size - old_size, count - old_count, key))
+        return [dict(site="%s:%d" % key, size=size, count=count)
+                for size, count, key in heapq.nlargest(self._max_sites,
+                                                       diffs)]
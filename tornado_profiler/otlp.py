@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Span export: measurements are converted into OTLP spans (the JSON
+    encoding of OTLP/HTTP) and exported in gzip-compressed batches, posted
+    to a collector or appended to rotating NDJSON files.
+
+    Spans are queued in a bounded `BatchWriter` and exported by its
+    background thread, a slow collector only makes spans dropped.
+"""
+import os
+import re
+import glob
+import gzip
+import json
+import time
+import logging
+import urllib.request
+
+from tornado_profiler import __version__
+from tornado_profiler.writer import BatchWriter
+
+
+LOG = logging.getLogger(__name__)
+
+# https://www.w3.org/TR/trace-context/#traceparent-header
+_TRACEPARENT = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_ERROR = 2
+
+
+def parse_traceparent(value):
+    """ Parse a W3C `traceparent` header
+
+    :return: (trace id, parent span id) hex strings, or None if invalid
+    """
+    match = _TRACEPARENT.match(value.strip().lower()) if value else None
+    if match is None:
+        return None
+    version, trace_id, span_id, _ = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id
+
+
+def _random_id(size):
+    return os.urandom(size).hex()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return dict(key=key, value=dict(boolValue=value))
+    elif isinstance(value, int):
+        return dict(key=key, value=dict(intValue=str(value)))
+    elif isinstance(value, float):
+        return dict(key=key, value=dict(doubleValue=value))
+    return dict(key=key, value=dict(stringValue=str(value)))
+
+
+def _nanos(seconds):
+    return str(int(seconds * 1e9))
+
+
+class SpanExporter(object):
+    """ Export measurements as spans, to a collector endpoint and/or a
+        directory of rotating NDJSON files
+    """
+
+    def __init__(self, endpoint=None, directory=None, service_name="tornado",
+                 batch_size=512, flush_interval=5.0, max_queue_size=10000,
+                 timeout=10.0, headers=None, max_file_size=64 * 1024 * 1024,
+                 max_files=10):
+        """
+        :param endpoint: URL spans are posted to, e.g.
+                         "http://localhost:4318/v1/traces"
+        :param directory: directory of "spans-<ms>-<pid>.ndjson.gz" files,
+                          each line a batch of spans, files are gzip
+                          streams
+        :param service_name: "service.name" resource attribute
+        :param batch_size: max number of spans exported in one batch
+        :param flush_interval: max seconds a span waits to be exported
+        :param max_queue_size: max number of spans waiting to be exported,
+                               the oldest are dropped beyond it
+        :param timeout: seconds a post to the collector may take
+        :param headers: extra headers of posts, e.g. for authentication
+        :param max_file_size: bytes a file may reach before rotation
+        :param max_files: number of files kept in directory
+        """
+        if endpoint is None and directory is None:
+            raise ValueError("Span exporter needs an endpoint or a directory")
+        self._endpoint = endpoint
+        self._directory = directory
+        self._service_name = service_name
+        self._timeout = timeout
+        self._headers = dict(headers or {})
+        self._max_file_size = max_file_size
+        self._max_files = max_files
+        self._path = None
+        self.writer = BatchWriter(self._export, batch_size=batch_size,
+                                  flush_interval=flush_interval,
+                                  max_queue_size=max_queue_size,
+                                  overflow="drop_oldest",
+                                  name="tornado-profiler-span-exporter")
+
+    def start(self):
+        if self._directory is not None:
+            os.makedirs(self._directory, exist_ok=True)
+        self.writer.start()
+
+    def stop(self, timeout=None):
+        self.writer.stop(timeout)
+
+    def put(self, record):
+        """ Queue a measurement for export, it should be called on the IOLoop
+
+        :param record: a dict of name, method, begin_time, finish_time,
+                       status, path, host, traceparent, metrics and
+                       http_calls
+        :return: False if the record was dropped
+        """
+        return self.writer.put(record)
+
+    def to_spans(self, record):
+        """ Convert a measurement into a server span, and client spans of
+            its outbound HTTP calls
+
+        :return: a list of OTLP span dicts
+        """
+        parent = parse_traceparent(record.get("traceparent"))
+        if parent is not None:
+            trace_id, parent_id = parent
+        else:
+            trace_id, parent_id = _random_id(16), None
+        span_id = _random_id(8)
+        status = record["status"]
+        attributes = [
+            _attribute("http.request.method", record["method"]),
+            _attribute("http.route", record["name"]),
+            _attribute("http.response.status_code", status),
+            _attribute("url.path", record["path"]),
+            _attribute("server.address", record["host"]),
+        ]
+        for key, value in sorted((record.get("metrics") or {}).items()):
+            attributes.append(_attribute("tornado_profiler." + key,
+                                         float(value)))
+        span = dict(
+            traceId=trace_id,
+            spanId=span_id,
+            name="%s %s" % (record["method"], record["name"]),
+            kind=SPAN_KIND_SERVER,
+            startTimeUnixNano=_nanos(record["begin_time"]),
+            endTimeUnixNano=_nanos(record["finish_time"]),
+            attributes=attributes,
+            status=dict(code=STATUS_CODE_ERROR) if status >= 500 else {},
+        )
+        if parent_id is not None:
+            span["parentSpanId"] = parent_id
+        spans = [span]
+
+        for call in record.get("http_calls") or ():
+            spans.append(dict(
+                traceId=trace_id,
+                spanId=_random_id(8),
+                parentSpanId=span_id,
+                name=call["method"],
+                kind=SPAN_KIND_CLIENT,
+                startTimeUnixNano=_nanos(call["begin_time"]),
+                endTimeUnixNano=_nanos(call["begin_time"] + call["time"]),
+                attributes=[
+                    _attribute("http.request.method", call["method"]),
+                    _attribute("url.full", call["url"]),
+                    _attribute("http.response.status_code", call["status"]),
+                ],
+                status=dict(code=STATUS_CODE_ERROR)
+                if call["status"] >= 500 else {},
+            ))
+        return spans
+
+    def _payload(self, records):
+        spans = []
+        for record in records:
+            spans.extend(self.to_spans(record))
+        return dict(resourceSpans=[dict(
+            # NOTE: computed per batch, processes may be forked
+            resource=dict(attributes=[
+                _attribute("service.name", self._service_name),
+                _attribute("process.pid", os.getpid()),
+            ]),
+            scopeSpans=[dict(
+                scope=dict(name="tornado_profiler", version=__version__),
+                spans=spans,
+            )],
+        )])
+
+    def _export(self, records):
+        """Export a batch of records, called by the background writer"""
+        data = json.dumps(self._payload(records),
+                          separators=(",", ":")).encode("utf-8")
+        if self._directory is not None:
+            self._write_file(data)
+        if self._endpoint is not None:
+            self._post(data)
+
+    def _post(self, data):
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+        }
+        headers.update(self._headers)
+        request = urllib.request.Request(self._endpoint,
+                                         data=gzip.compress(data),
+                                         headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self._timeout) as resp:
+            resp.read()
+
+    def _write_file(self, data):
+        path = self._path
+        if path is None or not os.path.exists(path) or \
+                os.path.getsize(path) >= self._max_file_size:
+            path = self._path = self._rotate()
+        # NOTE: gzip members appended to a file make a valid gzip stream
+        with open(path, "ab") as f:
+            f.write(gzip.compress(data + b"\n"))
+
+    def _rotate(self):
+        """Get the path of a new file, removing the oldest files"""
+        # NOTE: names sort by creation time
+        path = os.path.join(self._directory, "spans-%013d-%d.ndjson.gz" % (
+            int(time.time() * 1000), os.getpid()))
+        paths = sorted(glob.glob(os.path.join(self._directory,
+                                              "spans-*.ndjson.gz")))
+        for old_path in paths[:max(len(paths) - self._max_files + 1, 0)]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                LOG.warning("Failed to remove span file %s", old_path)
+        return path
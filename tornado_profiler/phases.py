@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Per-phase timing of requests: handler methods are wrapped to measure
+    where the time of a request goes.
+
+    * queue: from headers received to handler execution, i.e. reading the
+      body, routing and handler initialization
+    * prepare: `prepare()`
+    * handler: the HTTP method, e.g. `get()`
+    * render: `render()`, template rendering
+    * flush: `flush()`, transforms and writes into the stream
+    * finish: `finish()`
+    * send: waiting for the last write to reach the client
+"""
+import time
+import inspect
+import functools
+
+
+PHASES = ("queue", "prepare", "handler", "render", "flush", "finish", "send")
+
+# phases whose awaitable results are awaited by tornado
+AWAITED_PHASES = ("prepare", "handler")
+
+# prefix of phase metric names
+METRIC_PREFIX = "phase."
+
+
+class PhaseTimer(object):
+    """ Phase timer of a request. Time is accounted exclusively: the time
+        of a phase entered while another one is running is not counted in
+        the outer phase.
+    """
+
+    __slots__ = ("durations", "send_future", "_stack", "_callback")
+
+    def __init__(self):
+        self.durations = dict()
+        # future of the last write, see `finish`
+        self.send_future = None
+        # [phase, start, time of inner phases]
+        self._stack = []
+        self._callback = None
+
+    def active(self, phase):
+        for frame in self._stack:
+            if frame[0] == phase:
+                return True
+        return False
+
+    def enter(self, phase):
+        self._stack.append([phase, time.perf_counter(), 0.0])
+
+    def exit(self):
+        phase, start, inner = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.add(phase, elapsed - inner)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        elif self._callback is not None:
+            callback, self._callback = self._callback, None
+            callback()
+
+    def add(self, phase, duration):
+        self.durations[phase] = self.durations.get(phase, 0.0) + duration
+
+    def defer(self, callback):
+        """ Call callback once all phases are done and the last write
+            reached the client
+        """
+        def wait_send():
+            future = self.send_future
+            if future is None or future.done():
+                callback()
+                return
+            start = time.perf_counter()
+
+            def on_sent(_):
+                self.add("send", time.perf_counter() - start)
+                callback()
+            future.add_done_callback(on_sent)
+
+        if self._stack:
+            self._callback = wait_send
+        else:
+            wait_send()
+
+    def as_metrics(self):
+        """Get a dict mapping phase metric names to seconds"""
+        return dict((METRIC_PREFIX + phase, round(duration, 6))
+                    for phase, duration in self.durations.items())
+
+
+async def _exit_after(timer, awaitable):
+    try:
+        return await awaitable
+    finally:
+        timer.exit()
+
+
+def _timed(phase, method):
+    """Wrap a handler method to time a phase"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        timer = getattr(self, "profiler_phases_", None)
+        # NOTE: overridden methods calling super() are timed once
+        if timer is None or timer.active(phase):
+            return method(self, *args, **kwargs)
+
+        timer.enter(phase)
+        try:
+            result = method(self, *args, **kwargs)
+        except BaseException:
+            timer.exit()
+            raise
+        if result is not None and inspect.isawaitable(result):
+            if phase in AWAITED_PHASES:
+                return _exit_after(timer, result)
+            if phase == "finish":
+                timer.send_future = result
+        timer.exit()
+        return result
+
+    wrapper.profiler_phase_ = phase
+    return wrapper
+
+
+def begin_phases(handler):
+    """ Start timing phases of a request, a request hook called once the
+        request starts running
+
+    :param handler: a tornado.web.RequestHandler instance
+    """
+    timer = handler.profiler_phases_ = PhaseTimer()
+    timer.add("queue", time.time() - handler.request._start_time)
+
+
+def patch_phases(handler_class):
+    """ Wrap methods of a handler class to time phases of its requests,
+        timed by `begin_phases`
+
+    :param handler_class: subclass of tornado.web.RequestHandler
+    """
+    methods = [("prepare", "prepare"), ("render", "render"),
+               ("flush", "flush"), ("finish", "finish")]
+    for verb in handler_class.SUPPORTED_METHODS:
+        methods.append((verb.lower(), "handler"))
+
+    for attr, phase in methods:
+        method = getattr(handler_class, attr, None)
+        if method is None or getattr(method, "profiler_phase_", None):
+            # NOTE: inherited from a patched handler class
+            continue
+        setattr(handler_class, attr, _timed(phase, method))
@@ -3,27 +3,132 @@
 import os
 import time
 import itertools
-import json
-import base64
 import inspect
+import atexit
+import logging
 import functools
 from concurrent.futures import ThreadPoolExecutor
 
 import tornado.web
 import tornado.routing
+from tornado.ioloop import IOLoop
 
 from tornado_profiler import backend as _backend
+from tornado_profiler.writer import BatchWriter, LoopWriter
+from tornado_profiler.spool import Spool, SpoolAggregator
+from tornado_profiler.sampling import Sampler
+from tornado_profiler.capture import ContextCapture
+from tornado_profiler.routing import RouteRegistry, tag_router
+from tornado_profiler.stats import StatsAggregator, is_error
+from tornado_profiler.phases import patch_phases, begin_phases
+from tornado_profiler.tracking import HandlerTracker
+from tornado_profiler.trace import begin_trace
+from tornado_profiler.httpclient import instrument_http_client
+from tornado_profiler.memory import MemoryProfiler
+from tornado_profiler.prometheus import PrometheusMetrics, DEFAULT_BUCKETS
+from tornado_profiler.otlp import SpanExporter
+from tornado_profiler.cache import CachedBackend
+from tornado_profiler.watchdog import BlockingWatchdog
+from tornado_profiler.cpu import CPUSampler
 from tornado_profiler.views import (MeasurementHandler, MeasGroupHandler,
-                                    DashboardHandler)
+                                    BlockingHandler, FlameGraphHandler,
+                                    MetricsHandler, ExportHandler,
+                                    TimeseriesHandler, DashboardHandler)
+
+
+LOG = logging.getLogger(__name__)
 
 
 class Profiler(object):
 
-    def __init__(self, backend, max_workers=5, url_prefix="/tornado-profiler"):
+    def __init__(self, backend, max_workers=5, url_prefix="/tornado-profiler",
+                 batch_size=100, flush_interval=1.0, max_queue_size=10000,
+                 overflow="drop_oldest", sample_rate=1.0, sample_rules=None,
+                 slow_threshold=None, error_status=500, capture="full",
+                 max_body_size=None, header_allow=None, header_deny=None,
+                 stats_window=None, stats_bucket_width=60, purge_interval=60,
+                 spool_dir=None, spool_interval=1.0, phases=True,
+                 blocking_threshold=None, cpu_sample_interval=None,
+                 trace_http=False, max_http_calls=20, trace_sql=None,
+                 max_sql_statements=5, memory_rate=0.0, memory_rules=None,
+                 max_memory_sites=10, prometheus=True,
+                 prometheus_buckets=None, span_endpoint=None,
+                 span_dir=None, service_name="tornado", cache_ttl=2.0,
+                 cache_size=256):
         """
         :param backend: a tornado web application instance
-        :param max_workers: use thread pool to store measurements
+        :param max_workers: use thread pool to query and export
+                            measurements
         :param url_prefix: profiler related handlers' url prefix, NO end slash.
+        :param batch_size: max number of measurements stored in one batch
+        :param flush_interval: max seconds a measurement waits to be stored
+        :param max_queue_size: max number of measurements waiting to be stored
+        :param overflow: policy used when the queue is full, one of "block",
+                         "drop_oldest" and "drop_newest", "block" blocks
+                         the IOLoop until the writer catches up
+        :param sample_rate: default fraction of requests to record
+        :param sample_rules: per-route sample rates, a dict or a list of
+                             pairs mapping a route name regex to a rate
+        :param slow_threshold: always record requests slower than it(seconds)
+        :param error_status: always record requests whose status code is
+                             greater than or equal to it
+        :param capture: how much request context to capture, one of "none",
+                        "minimal", "headers" and "full"
+        :param max_body_size: max bytes of request body to capture
+        :param header_allow: if not None, only capture these headers
+        :param header_deny: never capture these headers
+        :param stats_window: if not None, keep streaming statistics with
+                             percentiles of the last `stats_window` seconds
+                             in memory and serve group APIs from them
+        :param stats_bucket_width: seconds each statistics bucket covers
+        :param purge_interval: seconds between two retention enforcements
+        :param spool_dir: if not None, run in multi-process mode: workers
+                          spool measurements into files of this directory
+                          and one of them merges the files into backend
+        :param spool_interval: seconds between two merges of spool files
+        :param phases: whether to time phases of requests, see
+                       `tornado_profiler.phases`
+        :param blocking_threshold: if not None, report callbacks blocking
+                                   the IOLoop for more than it(seconds),
+                                   attributed to the running request
+        :param cpu_sample_interval: if not None, sample stacks of the
+                                    IOLoop every `cpu_sample_interval`
+                                    seconds of CPU time, for flame graphs
+                                    per route
+        :param trace_http: whether to record outbound calls of
+                           `AsyncHTTPClient` made by requests, see
+                           `tornado_profiler.httpclient`
+        :param max_http_calls: max number of outbound calls kept in the
+                               context of a request
+        :param trace_sql: SQLAlchemy engines whose statements made by
+                          requests are timed, a list of engines or True for
+                          all engines, see `tornado_profiler.sql`
+        :param max_sql_statements: number of slowest statements kept in the
+                                   context of a request
+        :param memory_rate: default fraction of requests whose memory
+                            allocations are traced, see
+                            `tornado_profiler.memory`
+        :param memory_rules: per-route fractions of requests whose memory
+                             allocations are traced, like `sample_rules`
+        :param max_memory_sites: max number of allocation sites kept in the
+                                 context of a request
+        :param prometheus: whether to keep latency histograms of all
+                           requests in memory, served in the Prometheus
+                           format by `<url_prefix>/metrics`
+        :param prometheus_buckets: upper bounds(seconds) of histogram
+                                   buckets, see
+                                   `tornado_profiler.prometheus`
+        :param span_endpoint: if not None, export recorded measurements as
+                              OTLP spans posted to this collector URL, see
+                              `tornado_profiler.otlp`
+        :param span_dir: if not None, export recorded measurements as OTLP
+                         spans into rotating files of this directory
+        :param service_name: "service.name" of exported spans
+        :param cache_ttl: max seconds query results of API handlers are
+                          cached, None or 0 to disable the cache, results
+                          are invalidated once new datas of their time
+                          range are stored too
+        :param cache_size: max number of query results cached
         """
         if isinstance(backend, _backend.Backend):
             self.backend = backend
@@ -33,20 +138,174 @@ class Profiler(object):
         else:
             raise ValueError("Unknown backend argument.")
 
+        if overflow not in BatchWriter.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r" % overflow)
+        if spool_dir is not None:
+            if self.backend.is_nonblock():
+                raise ValueError("Backend %r can't be shared by processes"
+                                 % self.backend.get_name())
+            if stats_window is not None:
+                raise ValueError("Streaming statistics are kept per process, "
+                                 "they can't be used with spool_dir")
+
         self._max_workers = max_workers
         self._url_prefix = url_prefix
+        self._writer_options = dict(
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+            overflow=overflow,
+        )
+        self._purge_interval = purge_interval
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self.query_cache = None
+        self._spool_dir = spool_dir
+        self._spool_interval = spool_interval
+        self._phases = phases
+        self._trace_http = trace_http
+        self._max_http_calls = max_http_calls
+        self._trace_sql = trace_sql
+        self._max_sql_statements = max_sql_statements
+        self.memory_profiler = None
+        if memory_rate or memory_rules:
+            self.memory_profiler = MemoryProfiler(
+                rate=memory_rate, rules=memory_rules,
+                max_sites=max_memory_sites)
+        # NOTE: requests run with a trace if any instrumentation is enabled
+        self._tracing = trace_http or bool(trace_sql) or \
+            self.memory_profiler is not None
+        self.sampler = Sampler(rate=sample_rate,
+                               rules=sample_rules,
+                               slow_threshold=slow_threshold,
+                               error_status=error_status)
+        self.capture = ContextCapture(level=capture,
+                                      max_body_size=max_body_size,
+                                      header_allow=header_allow,
+                                      header_deny=header_deny)
+        self.routes = RouteRegistry()
+        # NOTE: tell the request running on the IOLoop to samplers
+        self.tracker = None
+        if blocking_threshold is not None or \
+                cpu_sample_interval is not None:
+            self.tracker = HandlerTracker()
+        self.watchdog = None
+        if blocking_threshold is not None:
+            self.watchdog = BlockingWatchdog(self.store_blocking,
+                                             self.tracker,
+                                             threshold=blocking_threshold)
+        self.cpu_sampler = None
+        if cpu_sample_interval is not None:
+            self.cpu_sampler = CPUSampler(self.tracker,
+                                          interval=cpu_sample_interval)
+        self.metrics = None
+        if prometheus:
+            self.metrics = PrometheusMetrics(
+                buckets=prometheus_buckets or DEFAULT_BUCKETS)
+        self.span_exporter = None
+        if span_endpoint is not None or span_dir is not None:
+            self.span_exporter = SpanExporter(endpoint=span_endpoint,
+                                              directory=span_dir,
+                                              service_name=service_name)
+        self.stats = None
+        if stats_window is not None:
+            self.stats = StatsAggregator(window=stats_window,
+                                         bucket_width=stats_bucket_width)
+
+        # (begin, end) callables of features run with each request
+        self._request_hooks = []
+        # NOTE: traces are set up before other hooks run
+        if self._tracing:
+            self.add_request_hook(begin_trace)
+        if self.memory_profiler is not None:
+            # NOTE: ended by on_finish, unless the request never finished
+            self.add_request_hook(self.memory_profiler.begin,
+                                  self.memory_profiler.end)
+        if self.tracker is not None:
+            self.add_request_hook(self.tracker.begin, self.tracker.end)
+        if self._phases:
+            self.add_request_hook(begin_phases)
+
+    def add_request_hook(self, begin, end=None):
+        """ Run callables with each request of patched handler classes,
+            in the task tornado runs the request in, so they may set
+            context variables and find the request from its task. Hooks
+            must be added before `init_app`.
+
+        :param begin: a callable accepting the handler, called when the
+                      request starts running, in the order hooks are added
+        :param end: a callable accepting the handler, called when the
+                    request stops running, in the reverse order
+        """
+        self._request_hooks.append((begin, end))
 
     def init_app(self, app):
-        self.backend.initialize()
+        if self._spool_dir is not None:
+            self.spool = Spool(self._spool_dir)
+            # NOTE: forked workers would race to create the schema
+            with self.spool.exclusive():
+                self.backend.initialize()
+        else:
+            self.backend.initialize()
 
         # Inject attributions into application
-        # NOTE: Create thread pool to execute backend operations
-        if not self.backend.is_nonblock():
-            app.profiler_executor_ = ThreadPoolExecutor(self._max_workers)
+        # NOTE: Create thread pool to execute blocking backend operations
+        # and exports, handlers await the asynchronous interface of backend
+        executor = ThreadPoolExecutor(self._max_workers)
+        self.async_backend = _backend.as_async(self.backend, executor)
+        # NOTE: handlers query backend through the cache
+        views_backend = self.async_backend
+        if self._cache_ttl:
+            self.query_cache = views_backend = CachedBackend(
+                self.async_backend, max_entries=self._cache_size,
+                ttl=self._cache_ttl)
+
+        # NOTE: Measurements are stored in batches by a background writer,
+        # a thread for blocking backends, otherwise the IOLoop itself
+        if self._spool_dir is not None:
+            writer = self.init_spool()
+        elif not self.backend.is_nonblock():
+            writer = BatchWriter(self.store_measurements,
+                                 periodic=self.purge,
+                                 periodic_interval=self._purge_interval,
+                                 **self._writer_options)
+            atexit.register(writer.stop)
+        else:
+            writer = LoopWriter(self.store_measurements_async,
+                                periodic=self.purge_async,
+                                periodic_interval=self._purge_interval,
+                                **self._writer_options)
+            atexit.register(writer.stop)
+        writer.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+        if self.cpu_sampler is not None:
+            self.cpu_sampler.start()
+            # NOTE: the default action of SIGPROF terminates the process
+            atexit.register(self.cpu_sampler.stop)
+        if self._trace_http:
+            instrument_http_client(self._max_http_calls)
+        if self._trace_sql:
+            self.init_sql_instrument()
+        if self.span_exporter is not None:
+            self.span_exporter.start()
+            atexit.register(self.span_exporter.stop)
+
+        app.profiler_executor_ = executor
+        app.profiler_writer_ = writer
         app.profiler_backend_ = self.backend
+        app.profiler_async_backend_ = views_backend
+        app.profiler_sampler_ = self.sampler
+        app.profiler_capture_ = self.capture
+        app.profiler_routes_ = self.routes
+        app.profiler_stats_ = self.stats
+        app.profiler_cpu_sampler_ = self.cpu_sampler
+        app.profiler_memory_ = self.memory_profiler
+        app.profiler_metrics_ = self.metrics
+        app.profiler_span_exporter_ = self.span_exporter
 
         # patch app
-        self.patch_matcher_match()
+        self.patch_matchers(app)
         for handler_class in self.get_app_handlers(app):
             if issubclass(handler_class, tornado.web.StaticFileHandler):
                 # no need to profile static file handlers
@@ -56,6 +315,144 @@ class Profiler(object):
         # register handlers
         self.register_handlers(app)
 
+    def init_sql_instrument(self):
+        """ Listen to SQLAlchemy engines of the application, those of the
+            profiler's backend excluded
+        """
+        # NOTE: SQLAlchemy is only required by this instrumentation
+        from tornado_profiler.sql import SQLInstrument
+
+        # NOTE: statements of the backend are made by the profiler itself
+        own_engines = set()
+        for attr in ("db_engine", "db_read_engine"):
+            engine = getattr(self.backend, attr, None)
+            if engine is not None:
+                own_engines.add(engine)
+        self.sql_instrument = SQLInstrument(self._max_sql_statements,
+                                            exclude=own_engines)
+        engines = None if self._trace_sql is True else self._trace_sql
+        self.sql_instrument.instrument(engines)
+
+    def init_spool(self):
+        """ Start the aggregator of multi-process mode, and build a writer
+            spooling measurements of the current process.
+
+        :return: a `BatchWriter` instance
+        """
+        # NOTE: only the elected aggregator writes into backend, and it's
+        # the one enforcing retention too
+        aggregator = SpoolAggregator(
+            self.spool, self.insert_spooled,
+            batch_size=self._writer_options["batch_size"] * 10,
+            interval=self._spool_interval,
+            periodic=self.purge,
+            periodic_interval=self._purge_interval)
+        aggregator.start()
+        writer = BatchWriter(self.spool_measurements,
+                             **self._writer_options)
+        # NOTE: exit handlers run in reverse order, the aggregator merges
+        # what the writer spools at last
+        atexit.register(aggregator.stop)
+        atexit.register(writer.stop)
+        return writer
+
+    def invalidate_cache(self, measurements=None):
+        """ Invalidate cached query results once datas changed
+
+        :param measurements: measurement or blocking event dicts stored,
+                             None if any data may have changed
+        """
+        if self.query_cache is None:
+            return
+        begin_time = finish_time = None
+        if measurements:
+            try:
+                begin_time = min(measurement["begin_time"]
+                                 for measurement in measurements)
+                finish_time = max(
+                    measurement["finish_time"] if "finish_time" in
+                    measurement else
+                    measurement["begin_time"] + measurement["duration"]
+                    for measurement in measurements)
+            except (KeyError, TypeError):
+                begin_time = finish_time = None
+        self.query_cache.invalidate(begin_time, finish_time)
+
+    def insert_spooled(self, measurements):
+        """ Store measurements merged from spool files, used by the
+            aggregator in multi-process mode.
+
+        :param measurements: a list of measurement dicts
+        """
+        self.backend.insert_many(measurements)
+        self.invalidate_cache(measurements)
+
+    def purge(self):
+        """ Enforce retention policies of backend, used by the background
+            writer.
+        """
+        affected = self.backend.purge()
+        if affected:
+            self.invalidate_cache()
+        return affected
+
+    async def purge_async(self):
+        """Same as `purge`, used by the IOLoop writer"""
+        affected = await self.async_backend.purge()
+        if affected:
+            self.invalidate_cache()
+        return affected
+
+    def spool_measurements(self, measurements):
+        """ Render captured contexts and spool measurements, used by the
+            background writer in multi-process mode.
+
+        :param measurements: a list of measurement dicts
+        """
+        for measurement in measurements:
+            measurement["context"] = self.capture.render(
+                measurement["context"])
+        self.spool.write(measurements)
+
+    def store_measurements(self, measurements):
+        """ Render captured contexts and store measurements into backend,
+            used by the background writer.
+
+        :param measurements: a list of measurement dicts
+        """
+        for measurement in measurements:
+            measurement["context"] = self.capture.render(
+                measurement["context"])
+        self.backend.insert_many(measurements)
+        self.invalidate_cache(measurements)
+
+    async def store_measurements_async(self, measurements):
+        """ Same as `store_measurements`, used by the IOLoop writer
+        """
+        for measurement in measurements:
+            measurement["context"] = self.capture.render(
+                measurement["context"])
+        await self.async_backend.insert_many(measurements)
+        self.invalidate_cache(measurements)
+
+    def store_blocking(self, event):
+        """ Store a blocking event reported by the watchdog, called on the
+            IOLoop.
+
+        :param event: a blocking event dict
+        """
+        LOG.warning("IOLoop was blocked for %.3fs by %s %s",
+                    event["duration"], event["method"] or "-",
+                    event["uri"] or "a callback")
+        IOLoop.current().spawn_callback(self._store_blocking, [event])
+
+    async def _store_blocking(self, events):
+        try:
+            await self.async_backend.insert_blocking(events)
+            self.invalidate_cache(events)
+        except Exception:
+            LOG.exception("Failed to store %d blocking events", len(events))
+
     @staticmethod
     def _get_router_handlers(router):
         handlers = set()
@@ -96,89 +493,144 @@ class Profiler(object):
 
         return handlers
 
-    def patch_matcher_match(self):
-        """Patch tornado.routing's HostMatches and PathMatches class.
-           FIXME: tornado use regex in `Rule` to match url path or host, we
-                  can't know a request is correspond to which Rule's regex
-                  unless we iterate all Rules in an application
-        """
-        # patch PathMatches
-        old_path_match = tornado.routing.PathMatches.match
-
-        def path_match(self, request):
-            ret = old_path_match(self, request)
-            if ret is not None:
-                # remove final $ or not?
-                pattern = self.regex.pattern
-                if pattern.endswith('$'):
-                    pattern = pattern[:-1]
-                request.profiler_name_ = pattern
-                if ret:
-                    request.profiler_path_args_ = ret
-            return ret
-        tornado.routing.PathMatches.match = functools.partialmethod(path_match)
+    def patch_matchers(self, app):
+        """ Compute route identities of all rules registered in application
+            and patch their matchers to tag the requests they match.
+        :param app: a instance of tornado.web.Application
+        """
+        tag_router(app.default_router, self.routes)
 
     def patch_handler_class(self, handler_class):
         """Patch all handler classes registered in application.
            Record profile datas at key points.
         :param handler_class: subclass of tornado.web.RequestHandler
         """
+        if self._phases:
+            patch_phases(handler_class)
+        self.patch_execute(handler_class)
+
         # patch on_finish method
         old_on_finish = handler_class.on_finish
 
         def on_finish(self):
             old_on_finish(self)
 
+            profiler_memory = getattr(self.application, "profiler_memory_")
+            if profiler_memory is not None:
+                profiler_memory.end(self)
+
             kwargs = dict()
-            # get the corresponding rule(name) for the current request
-            kwargs["name"] = getattr(self.request, "profiler_name_", None)
-            if kwargs["name"] is None:
+            # get the corresponding rule for the current request
+            route = getattr(self.request, "profiler_route_", None)
+            if route is None:
                 return
-
-            kwargs["method"] = self.request.method
-            path_args = getattr(self.request, "profiler_path_args_", None)
+            kwargs["name"] = route.name
 
             # http request instantiated when headers received
             kwargs["begin_time"] = self.request._start_time
             kwargs["finish_time"] = time.time()
             kwargs["elapse_time"] = kwargs["finish_time"] - kwargs["begin_time"]
 
-            context = {
-                # "method": self.request.method,
-                "uri": self.request.uri,
-                "version": self.request.version,
-                "headers": dict(self.request.headers),
-                # TODO: maybe decode the body according to Content-Type
-                "body": base64.b64encode(self.request.body).decode(),
-
-                "remote_ip": self.request.remote_ip,
-                "protocol": self.request.protocol,
-
-                "host": self.request.host,
-                "path": self.request.path,
-                "arguments": self.request.arguments,
-                "cookies": self.request.cookies,
-
-                "full_url": self.request.full_url(),
-            }
-            if path_args is not None:
-                context.update(path_args)
-
-            def json_convert(obj):
-                if isinstance(obj, bytes):
-                    return obj.decode("utf-8")
-            kwargs["context"] = json.dumps(context, default=json_convert)
-            # Store measurement into backend
-            profiler_executor = getattr(self.application,
-                                        "profiler_executor_", None)
-            profiler_backend = getattr(self.application, "profiler_backend_")
-            if profiler_backend.is_nonblock():
-                profiler_backend.insert(**kwargs)
+            timer = getattr(self, "profiler_phases_", None)
+            if timer is None:
+                record_measurement(self, route, kwargs)
             else:
-                profiler_executor.submit(profiler_backend.insert, **kwargs)
+                # NOTE: on_finish is called inside finish(), record once
+                # phases running around it are done
+                def record():
+                    kwargs["metrics"] = timer.as_metrics()
+                    record_measurement(self, route, kwargs)
+                timer.defer(record)
+
+        def record_measurement(self, route, kwargs):
+            trace = getattr(self, "profiler_trace_", None)
+            if trace is not None and trace.metrics:
+                kwargs["metrics"] = dict(kwargs.get("metrics") or {},
+                                         **trace.rounded_metrics())
+
+            # statistics count all requests regardless of sampling
+            profiler_metrics = getattr(self.application, "profiler_metrics_")
+            if profiler_metrics is not None:
+                profiler_metrics.observe(route.name, self.request.method,
+                                         self.get_status(),
+                                         kwargs["elapse_time"])
+            profiler_stats = getattr(self.application, "profiler_stats_")
+            if profiler_stats is not None:
+                profiler_stats.add(route.name, self.request.method,
+                                   kwargs["begin_time"], kwargs["elapse_time"],
+                                   kwargs.get("metrics"),
+                                   is_error(self.get_status()))
+
+            # decide before doing any expensive work
+            profiler_sampler = getattr(self.application, "profiler_sampler_")
+            if not profiler_sampler.should_record(route,
+                                                  kwargs["elapse_time"],
+                                                  self.get_status()):
+                return
+
+            kwargs["method"] = self.request.method
+            kwargs["status"] = self.get_status()
+            path_args = getattr(self.request, "profiler_path_args_", None)
+
+            # NOTE: only take references here, context is rendered later
+            profiler_capture = getattr(self.application, "profiler_capture_")
+            kwargs["context"] = profiler_capture.snapshot(
+                self.request, path_args,
+                trace.extensions if trace is not None else None)
+            # Store measurement into backend
+            profiler_writer = getattr(self.application, "profiler_writer_")
+            profiler_writer.put(kwargs)
+
+            # NOTE: the writer renders the context of kwargs in place,
+            # spans get a record of their own
+            profiler_exporter = getattr(self.application,
+                                        "profiler_span_exporter_")
+            if profiler_exporter is not None:
+                profiler_exporter.put(dict(
+                    name=route.name,
+                    method=self.request.method,
+                    begin_time=kwargs["begin_time"],
+                    finish_time=kwargs["finish_time"],
+                    status=self.get_status(),
+                    path=self.request.path,
+                    host=self.request.host,
+                    traceparent=self.request.headers.get("traceparent"),
+                    metrics=kwargs.get("metrics"),
+                    http_calls=trace.extensions.get("http_calls")
+                    if trace is not None else None,
+                ))
 
         handler_class.on_finish = functools.partialmethod(on_finish)
 
+    def patch_execute(self, handler_class):
+        """ Patch `_execute` of a handler class to run request hooks, see
+            `add_request_hook`
+        :param handler_class: subclass of tornado.web.RequestHandler
+        """
+        method = handler_class._execute
+        if not self._request_hooks or \
+                getattr(method, "profiler_hooked_", False):
+            # NOTE: inherited from a patched handler class
+            return
+        begins = [begin for begin, _ in self._request_hooks]
+        ends = [end for _, end in reversed(self._request_hooks)
+                if end is not None]
+
+        # NOTE: tornado runs each _execute in its own task, which has its
+        # own copy of context
+        @functools.wraps(method)
+        async def _execute(self, *args, **kwargs):
+            for begin in begins:
+                begin(self)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                for end in ends:
+                    end(self)
+
+        _execute.profiler_hooked_ = True
+        handler_class._execute = _execute
+
     def register_handlers(self, app):
         """ Register profiler related handlers
         """
@@ -200,7 +652,13 @@ class Profiler(object):
             # APIs
             (r"/api/measurements/?", MeasurementHandler),
             (r"/api/measurements/groups/?", MeasGroupHandler),
+            (r"/api/measurements/export/?", ExportHandler),
             (r"/api/measurements/([^/]*)", MeasurementHandler),
+            (r"/api/timeseries/?", TimeseriesHandler),
+            (r"/api/blocking/?", BlockingHandler),
+            (r"/api/blocking/([^/]*)", BlockingHandler),
+            (r"/api/flamegraph/?", FlameGraphHandler),
+            (r"/metrics", MetricsHandler),
         ]
 
         static_handlers = [
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" In-process request metrics in the Prometheus text exposition format.
+    Histograms are updated by the request hook and rendered from memory,
+    the backend is never queried.
+"""
+import bisect
+
+
+# upper bounds(seconds) of latency buckets, "+Inf" is implicit
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# help texts of writer counters, see `BatchWriter.stats`
+WRITER_HELP = {
+    "queued": "Measurements queued by the writer.",
+    "written": "Measurements stored by the writer.",
+    "failed": "Measurements the writer failed to store.",
+    "flushes": "Batches flushed by the writer.",
+    "blocked": "Requests blocked on the full queue of the writer.",
+    "dropped": "Measurements dropped by the full queue of the writer.",
+    "dropped_oldest": "Oldest measurements dropped by the full queue of the "
+                      "writer.",
+    "dropped_newest": "Newest measurements dropped by the full queue of the "
+                      "writer.",
+    "pending": "Measurements waiting to be stored.",
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace("\"", "\\\"")
+
+
+def _format_float(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Histogram(object):
+    """Latency histogram of a label set"""
+
+    __slots__ = ("labels", "counts", "count", "total")
+
+    def __init__(self, labels, size):
+        # rendered label pairs, computed once
+        self.labels = labels
+        # non-cumulative counts of each bucket, the last one is "+Inf"
+        self.counts = [0] * size
+        self.count = 0
+        self.total = 0.0
+
+
+class PrometheusMetrics(object):
+    """ Latency histograms and request counters by route, method and status
+    """
+
+    def __init__(self, namespace="tornado_profiler", buckets=DEFAULT_BUCKETS):
+        """
+        :param namespace: prefix of metric names
+        :param buckets: sorted upper bounds(seconds) of latency buckets
+        """
+        self._namespace = namespace
+        self._buckets = tuple(sorted(float(bound) for bound in buckets))
+        self._bucket_labels = [_format_float(bound)
+                               for bound in self._buckets] + ["+Inf"]
+        # (route name, method, status) -> _Histogram
+        self._histograms = dict()
+
+    def observe(self, name, method, status, elapse_time):
+        """ Count a request, it should be called on the IOLoop
+
+        :param name: route name
+        :param method: HTTP method
+        :param status: response status code
+        :param elapse_time: seconds the request took
+        """
+        key = (name, method, status)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            labels = 'route="%s",method="%s",status="%s"' % (
+                _escape(name), _escape(method), status)
+            histogram = self._histograms[key] = _Histogram(
+                labels, len(self._buckets) + 1)
+        histogram.counts[bisect.bisect_left(self._buckets, elapse_time)] += 1
+        histogram.count += 1
+        histogram.total += elapse_time
+
+    def render(self, writer_stats=None):
+        """ Render metrics in the text exposition format
+
+        :param writer_stats: a dict of counters of the measurement writer
+        :return: a str
+        """
+        namespace = self._namespace
+        histograms = sorted(self._histograms.items(),
+                            key=lambda item: item[0])
+        lines = []
+
+        name = namespace + "_request_duration_seconds"
+        lines.append("# HELP %s Latency of requests by route, method and "
+                     "status." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for _, histogram in histograms:
+            labels = histogram.labels
+            cumulative = 0
+            for bound, count in zip(self._bucket_labels, histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d'
+                             % (name, labels, bound, cumulative))
+            lines.append("%s_sum{%s} %s"
+                         % (name, labels, repr(histogram.total)))
+            lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+
+        name = namespace + "_requests_total"
+        lines.append("# HELP %s Requests by route, method and status." % name)
+        lines.append("# TYPE %s counter" % name)
+        for _, histogram in histograms:
+            lines.append("%s{%s} %d" % (name, histogram.labels,
+                                        histogram.count))
+
+        if writer_stats:
+            for key, value in sorted(writer_stats.items()):
+                if key == "pending":
+                    name, _type = namespace + "_writer_pending", "gauge"
+                else:
+                    name = "%s_writer_%s_total" % (namespace, key)
+                    _type = "counter"
+                lines.append("# HELP %s %s" % (
+                    name, WRITER_HELP.get(key, "Writer counter.")))
+                lines.append("# TYPE %s %s" % (name, _type))
+                lines.append("%s %d" % (name, value))
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import zlib
+
+import tornado.web
+import tornado.routing
+
+
+class Route(object):
+    """ Identity of a profiled rule, computed once when app is patched
+    """
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, route_id, name):
+        self.id = route_id
+        self.name = name
+
+    def __repr__(self):
+        return "<Route {id}, {name}>".format(id=self.id, name=self.name)
+
+
+class RouteRegistry(object):
+    """ Map route names to stable integer ids
+    """
+
+    def __init__(self):
+        self._routes = dict()
+        self._names = dict()
+
+    def register(self, name):
+        """ Get or create the route of a name. Its id is derived from the
+            name, so it stays the same across restarts and processes.
+
+        :param name: route name
+        :return: a `Route` instance
+        """
+        route = self._names.get(name)
+        if route is not None:
+            return route
+
+        route_id = zlib.crc32(name.encode("utf-8")) & 0x7fffffff
+        while route_id in self._routes:
+            # crc32 collision, probe next id
+            route_id = (route_id + 1) & 0x7fffffff
+        route = self._routes[route_id] = self._names[name] = \
+            Route(route_id, name)
+        return route
+
+    def get(self, route_id):
+        """Get a route by id, None if not found"""
+        return self._routes.get(route_id)
+
+    def get_by_name(self, name):
+        """Get a route by name, None if not found"""
+        return self._names.get(name)
+
+    def __iter__(self):
+        return iter(list(self._routes.values()))
+
+    def __len__(self):
+        return len(self._routes)
+
+
+def _strip_pattern(pattern):
+    # remove final $ or not?
+    if pattern.endswith("$"):
+        pattern = pattern[:-1]
+    return pattern
+
+
+def _tag_matcher(matcher, route):
+    """Wrap a matcher instance to tag requests it matches with route"""
+    match = matcher.match
+
+    def tagged_match(request):
+        ret = match(request)
+        if ret is not None:
+            request.profiler_route_ = route
+            if ret:
+                request.profiler_path_args_ = ret
+        return ret
+
+    matcher.match = tagged_match
+    matcher.profiler_route_ = route
+
+
+def tag_router(router, registry, host=""):
+    """ Compute route identities of all handler rules in a router, then tag
+        their matchers. Only matchers of handler rules are tagged, so only
+        the winning rule tags a request.
+
+    :param router: a `tornado.routing.RuleRouter` instance
+    :param registry: a `RouteRegistry` instance
+    :param host: host pattern of the enclosing `HostMatches` rule
+    """
+    for rule in router.rules:
+        matcher = rule.matcher
+        if isinstance(rule.target, tornado.routing.Router):
+            nested_host = host
+            if isinstance(matcher, tornado.routing.HostMatches):
+                pattern = _strip_pattern(matcher.host_pattern.pattern)
+                if pattern != ".*":
+                    nested_host = pattern
+            tag_router(rule.target, registry, nested_host)
+            continue
+
+        if getattr(matcher, "profiler_route_", None) is not None:
+            # already tagged
+            continue
+        if not (isinstance(matcher, tornado.routing.PathMatches) and
+                isinstance(rule.target, type) and
+                issubclass(rule.target, tornado.web.RequestHandler)):
+            continue
+
+        name = getattr(rule, "name", None)
+        if not name:
+            name = host + _strip_pattern(matcher.regex.pattern)
+        _tag_matcher(matcher, registry.register(name))
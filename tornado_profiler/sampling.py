@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import random
+
+
+class Sampler(object):
+    """ Decide which requests should be recorded.
+
+        Head sampling keeps a fraction of requests per route, tail sampling
+        always keeps slow requests and requests which end with an error.
+    """
+
+    def __init__(self, rate=1.0, rules=None, slow_threshold=None,
+                 error_status=500):
+        """
+        :param rate: default fraction of requests to record, in [0, 1]
+        :param rules: per-route rates, a dict or a list of pairs mapping a
+                      regex (searched in the route name) to a rate. The
+                      first matched rule wins.
+        :param slow_threshold: always record requests slower than this
+                               number of seconds, None to disable
+        :param error_status: always record requests whose status code is
+                             greater than or equal to it, None to disable
+        """
+        self._rate = self._check_rate(rate)
+        if isinstance(rules, dict):
+            rules = list(rules.items())
+        self._rules = [(re.compile(pattern), self._check_rate(rule_rate))
+                       for pattern, rule_rate in (rules or [])]
+        self._slow_threshold = slow_threshold
+        self._error_status = error_status
+        # route id -> rate, rules are only evaluated once per route
+        self._rates = dict()
+
+    @staticmethod
+    def _check_rate(rate):
+        rate = float(rate)
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("Sample rate %r not in [0, 1]" % rate)
+        return rate
+
+    def get_rate(self, route):
+        """ Get the head sampling rate of a route
+
+        :param route: a `tornado_profiler.routing.Route` instance
+        :return: a float in [0, 1]
+        """
+        try:
+            return self._rates[route.id]
+        except KeyError:
+            rate = self._rate
+            for regex, rule_rate in self._rules:
+                if regex.search(route.name):
+                    rate = rule_rate
+                    break
+            self._rates[route.id] = rate
+            return rate
+
+    def sample_head(self, route):
+        """Whether a request of the route is kept by head sampling"""
+        rate = self.get_rate(route)
+        if rate >= 1.0:
+            return True
+        elif rate <= 0.0:
+            return False
+        return random.random() < rate
+
+    def keep_tail(self, elapse_time, status):
+        """Whether a request must be kept despite of head sampling"""
+        if (self._slow_threshold is not None and
+                elapse_time >= self._slow_threshold):
+            return True
+        if self._error_status is not None and status >= self._error_status:
+            return True
+        return False
+
+    def should_record(self, route, elapse_time, status):
+        """ Decide whether a finished request should be recorded
+
+        :param route: a `tornado_profiler.routing.Route` instance
+        :param elapse_time: seconds the request took
+        :param status: response status code
+        :return: bool
+        """
+        return (self.keep_tail(elapse_time, status) or
+                self.sample_head(route))
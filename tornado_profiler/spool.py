@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Multi-process support: each worker process spools batches of
+    measurements into files of a shared directory, and a single aggregator
+    elected among the workers merges them into the backend.
+"""
+import os
+import time
+import json
+import errno
+import logging
+import itertools
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """ A directory of batch files. A batch is written into a temporary
+        file then renamed, so readers never see a partial batch.
+    """
+
+    SUFFIX = ".batch"
+    TEMP_SUFFIX = ".tmp"
+    BAD_SUFFIX = ".bad"
+    LOCK_NAME = "aggregator.lock"
+    INIT_LOCK_NAME = "initialize.lock"
+
+    def __init__(self, directory):
+        """
+        :param directory: the spool directory shared by all processes
+        """
+        if fcntl is None:
+            raise RuntimeError("Spooling requires fcntl, which is not "
+                               "available on this platform")
+        self._directory = os.path.abspath(directory)
+        self._pid = None
+        self._seq = itertools.count()
+        self._lock_file = None
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def write(self, records):
+        """ Write a batch of JSON-serializable records into a batch file
+
+        :param records: a list of dicts
+        """
+        if not records:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        if self._pid != os.getpid():
+            # NOTE: the sequence restarts in forked children
+            self._pid = os.getpid()
+            self._seq = itertools.count()
+        # NOTE: names sort by creation time, then process and sequence
+        filename = "%019d-%d-%d" % (time.time() * 1e9, self._pid,
+                                    next(self._seq))
+        path = os.path.join(self._directory, filename)
+        with open(path + self.TEMP_SUFFIX, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")))
+                f.write("\n")
+        os.rename(path + self.TEMP_SUFFIX, path + self.SUFFIX)
+
+    def batch_files(self):
+        """Get paths of complete batch files, oldest first"""
+        try:
+            filenames = os.listdir(self._directory)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+        return [os.path.join(self._directory, filename)
+                for filename in sorted(filenames)
+                if filename.endswith(self.SUFFIX)]
+
+    def read(self, path):
+        """ Read records of a batch file
+
+        :return: a list of dicts, None if the file is corrupted and has
+                 been set aside
+        """
+        try:
+            with open(path, "rt", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except ValueError:
+            LOG.exception("Corrupted spool file %s", path)
+            self.quarantine(path)
+            return None
+
+    def quarantine(self, path):
+        """ Set a batch file aside, it's kept with the `BAD_SUFFIX` suffix
+            for inspection but never read again.
+        """
+        os.rename(path, path[:-len(self.SUFFIX)] + self.BAD_SUFFIX)
+
+    def remove(self, path):
+        """Remove a batch file, if it still exists"""
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """ Block until no other process is in this context, e.g. to
+            initialize a shared backend one process after another.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        with open(os.path.join(self._directory, self.INIT_LOCK_NAME),
+                  "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def try_lock(self):
+        """ Try to become the aggregator. The lock is held until `unlock`
+            is called or the process exits.
+
+        :return: True if the lock is held by this process
+        """
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self._directory, exist_ok=True)
+        lock_file = open(os.path.join(self._directory, self.LOCK_NAME), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._lock_file = lock_file
+        return True
+
+    def unlock(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class SpoolAggregator(object):
+    """ Background thread of every worker process, which competes for the
+        aggregator lock of a spool. The winner merges spooled batches into
+        the backend and runs the periodic task, others just wait and take
+        over if the winner exits.
+    """
+
+    def __init__(self, spool, flush, batch_size=1000, interval=1.0,
+                 periodic=None, periodic_interval=60, max_attempts=5,
+                 max_files=10000, name="tornado-profiler-aggregator"):
+        """
+        :param spool: a `Spool` instance
+        :param flush: a callable accepting a list of records, e.g.
+                      `Backend.insert_many`
+        :param batch_size: max number of records merged into one flush
+        :param interval: seconds between two scans of the spool
+        :param periodic: a callable called every `periodic_interval` seconds
+                         by the aggregator, e.g. `Backend.purge`
+        :param periodic_interval: seconds between two `periodic` calls
+        :param max_attempts: a batch file failing to be flushed this many
+                             times, while other files are flushed, is
+                             quarantined
+        :param max_files: max number of batch files in the spool, the
+                          oldest ones are dropped beyond it, e.g. while the
+                          backend is down, None for no limit
+        :param name: name of the background thread
+        """
+        self._spool = spool
+        self._flush = flush
+        self._batch_size = batch_size
+        self._interval = interval
+        self._periodic = periodic
+        self._periodic_interval = periodic_interval
+        self._max_attempts = max_attempts
+        self._max_files = max_files
+        self._name = name
+        # path of batch file -> number of failed flushes
+        self._failures = dict()
+
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the background aggregator thread"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the background thread. The aggregator merges what is left
+            in the spool and releases its lock.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def drain(self):
+        """ Merge all complete batch files into the backend, a file is
+            removed once its records are flushed.
+
+        :return: number of records flushed
+        """
+        paths = self._spool.batch_files()
+        if self._max_files is not None and len(paths) > self._max_files:
+            dropped = paths[:len(paths) - self._max_files]
+            paths = paths[len(dropped):]
+            LOG.warning("Spool %s holds %d batch files, dropping the %d "
+                        "oldest ones", self._spool.directory,
+                        len(dropped) + len(paths), len(dropped))
+            for path in dropped:
+                self._spool.remove(path)
+                self._failures.pop(path, None)
+
+        flushed = 0
+        batches, count = [], 0
+        for path in paths:
+            batch = self._spool.read(path)
+            if batch is None:
+                continue
+            batches.append((path, batch))
+            count += len(batch)
+            if count >= self._batch_size:
+                flushed += self._merge(batches)
+                batches, count = [], 0
+        if batches:
+            flushed += self._merge(batches)
+        return flushed
+
+    def _merge(self, batches):
+        """ Flush (path, records) of batch files together, files are
+            removed once flushed, and kept to be retried if flushing fails.
+            A failure only counts against a file when other files of the
+            same round are flushed, so an unavailable backend doesn't get
+            good files quarantined.
+        """
+        try:
+            self._flush([record for _, records in batches
+                         for record in records])
+        except Exception:
+            if len(batches) == 1:
+                raise
+            # NOTE: retry files one by one, so a file which can't be
+            # flushed doesn't hold others back
+            flushed, failed = 0, []
+            for batch in batches:
+                try:
+                    flushed += self._merge([batch])
+                except Exception as e:
+                    failed.append((batch[0], e))
+            if len(failed) == len(batches):
+                # NOTE: nothing flushed, the backend is likely down
+                raise failed[-1][1]
+            for path, e in failed:
+                LOG.warning("Failed to flush spool file %s: %r", path, e)
+                self._failed(path)
+            return flushed
+        for path, _ in batches:
+            self._spool.remove(path)
+            self._failures.pop(path, None)
+        return sum(len(records) for _, records in batches)
+
+    def _failed(self, path):
+        attempts = self._failures.get(path, 0) + 1
+        if attempts < self._max_attempts:
+            self._failures[path] = attempts
+            return
+        LOG.error("Failed to flush spool file %s %d times, quarantined",
+                  path, attempts)
+        self._failures.pop(path, None)
+        self._spool.quarantine(path)
+
+    def _run(self):
+        next_periodic = time.monotonic() + self._periodic_interval
+        while True:
+            stopping = self._stopping.wait(self._interval)
+            try:
+                if self._spool.try_lock():
+                    self.drain()
+                    if self._periodic is not None and \
+                            time.monotonic() >= next_periodic:
+                        self._periodic()
+                        next_periodic = \
+                            time.monotonic() + self._periodic_interval
+            except Exception:
+                LOG.exception("Failed to aggregate spool %s",
+                              self._spool.directory)
+            if stopping:
+                break
+        self._spool.unlock()
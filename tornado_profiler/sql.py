@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" SQL instrumentation: statements executed by SQLAlchemy engines of the
+    application while a request is running are timed into the trace of the
+    request, see `tornado_profiler.trace`.
+
+    Metrics of a request:
+
+    * sql.count: number of statements executed
+    * sql.time: sum of statement durations
+
+    The slowest statements are kept as "sql_statements" of the measurement
+    context, each a dict of statement (normalized, literals replaced with
+    "?"), begin_time and time, slowest first.
+"""
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from tornado_profiler.trace import current_trace
+
+
+# key of pending statements of a connection in its info dict
+_INFO_KEY = "profiler_statements_"
+# max length of a normalized statement
+MAX_STATEMENT_LENGTH = 1000
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    """ Normalize a SQL statement, so that statements differing only by
+        literals look alike, e.g. "SELECT * FROM t WHERE id IN (1, 2)"
+        gives "SELECT * FROM t WHERE id IN (?)"
+    """
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _IN_LIST.sub("(?)", statement)
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        statement = statement[:MAX_STATEMENT_LENGTH] + "..."
+    return statement
+
+
+class SQLInstrument(object):
+    """ Listen to cursor execution events of SQLAlchemy engines """
+
+    def __init__(self, max_statements=5, exclude=None):
+        """
+        :param max_statements: number of slowest statements kept in the
+                               context of a request
+        :param exclude: engines never instrumented, e.g. the ones of the
+                        profiler's backend
+        """
+        self._max_statements = max_statements
+        self._excluded = set()
+        for engine in exclude or ():
+            self.exclude(engine)
+
+    @staticmethod
+    def _sync_engine(engine):
+        # NOTE: events of an AsyncEngine are emitted by its sync engine
+        return getattr(engine, "sync_engine", engine)
+
+    def exclude(self, engine):
+        self._excluded.add(id(self._sync_engine(engine)))
+
+    def instrument(self, engines=None):
+        """ Listen to engines, it does nothing for engines already listened
+
+        :param engines: a list of `Engine` or `AsyncEngine` instances, None
+                        means all engines
+        """
+        targets = [Engine] if engines is None else \
+            [self._sync_engine(engine) for engine in engines]
+        for target in targets:
+            if event.contains(target, "before_cursor_execute",
+                              self._before_execute):
+                continue
+            event.listen(target, "before_cursor_execute",
+                         self._before_execute)
+            event.listen(target, "after_cursor_execute",
+                         self._after_execute)
+            event.listen(target, "handle_error", self._handle_error)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        trace = current_trace()
+        if trace is None or id(conn.engine) in self._excluded:
+            return
+        conn.info.setdefault(_INFO_KEY, []).append(
+            (trace, time.time(), time.perf_counter()))
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        self._record(conn, statement)
+
+    def _handle_error(self, exception_context):
+        conn = exception_context.connection
+        statement = exception_context.statement
+        if conn is not None and statement is not None:
+            self._record(conn, statement)
+
+    def _record(self, conn, statement):
+        pending = conn.info.get(_INFO_KEY)
+        if not pending:
+            return
+        trace, begin_time, start = pending.pop()
+        duration = time.perf_counter() - start
+        trace.add_metric("sql.count", 1)
+        trace.add_metric("sql.time", duration)
+        duration = round(duration, 6)
+        # NOTE: normalize only statements slow enough to be kept
+        trace.keep_largest("sql_statements", "time", duration, lambda: dict(
+            statement=normalize_statement(statement),
+            begin_time=round(begin_time, 6),
+            time=duration,
+        ), self._max_statements)
@@ -39,24 +39,57 @@ $(function() {
         ],
         "iDisplayLength": 10,
         "aoColumns": [
-            {"sTitle": "method", "mData": "method", "sWidth": "10%", "bSearchable": true, "bSortable": false, "mRender": function (data, type, row ){
+            {"sTitle": "method", "mData": "method", "sWidth": "8%", "bSearchable": true, "bSortable": false, "mRender": function (data, type, row ){
                 return  data;
             }},
-            {"sTitle": "name", "mData": "name", "sWidth": "30%", "bSearchable": true, "bSortable": false, "mRender": function (data, type, row ){
+            {"sTitle": "name", "mData": "name", "sWidth": "18%", "bSearchable": true, "bSortable": false, "mRender": function (data, type, row ){
+                return data;
+            }},
+            {"sTitle": "count", "mData": "count", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ){
                 return data;
             }},
-            {"sTitle": "count", "mData": "count", "sWidth": "15%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ){
+            {"sTitle": "avg_elapsed/s", "mData": "avg", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ){
                 return data;
             }},
-            {"sTitle": "avg_elapsed/s", "mData": "avg", "sWidth": "15%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ){
+            {"sTitle": "max_elapsed/s", "mData": "max", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
                 return data;
             }},
-            {"sTitle": "max_elapsed/s", "mData": "max", "sWidth": "15%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
+            {"sTitle": "min_elapsed/s", "mData": "min", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
                 return data;
             }},
-            {"sTitle": "min_elapsed/s", "mData": "min", "sWidth": "15%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
+            {"sTitle": "p90_elapsed/s", "mData": "p90", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
                 return data;
             }},
+            {"sTitle": "p99_elapsed/s", "mData": "p99", "sWidth": "8%", "bSearchable": false, "bSortable": true, "mRender": function (data, type, row ) {
+                return data;
+            }},
+            {"sTitle": "avg_phases/ms", "mData": "metrics", "sWidth": "18%", "bSearchable": false, "bSortable": false, "mRender": function (data, type, row ) {
+                var phases = [];
+                $.each(data || {}, function (key, value) {
+                    if (key.indexOf("phase.") === 0) {
+                        phases.push([key.substring(6), value]);
+                    }
+                });
+                phases.sort(function (a, b) { return b[1] - a[1]; });
+                return $.map(phases, function (phase) {
+                    return phase[0] + " " + (phase[1] * 1000).toFixed(2);
+                }).join(", ");
+            }},
+            {"sTitle": "avg_downstream/ms", "mData": "metrics", "sWidth": "8%", "bSearchable": false, "bSortable": false, "mRender": function (data, type, row ) {
+                var parts = [], local = row.avg * 1000;
+                $.each([["http", "http.wait"], ["sql", "sql.time"]], function (i, metric) {
+                    if (data && data[metric[1]] !== undefined) {
+                        var value = data[metric[1]] * 1000;
+                        parts.push(metric[0] + " " + value.toFixed(2));
+                        local -= value;
+                    }
+                });
+                if (!parts.length) {
+                    return "";
+                }
+                parts.push("local " + local.toFixed(2));
+                return parts.join(", ");
+            }},
         ],
         "aaSorting": [[2, 'desc']],
     });
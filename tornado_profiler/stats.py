@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import math
+import time
+import collections
+
+
+PERCENTILES = (
+    ("p50", 0.5),
+    ("p90", 0.9),
+    ("p99", 0.99),
+    ("p999", 0.999),
+)
+
+GROUP_SORT_KEYS = ("name", "method", "count", "errors", "min", "max",
+                   "avg") + tuple(key for key, _ in PERCENTILES)
+
+# responses with a status code no less than it are counted as errors
+ERROR_STATUS = 500
+
+# bucket widths(seconds) a time series is cut into, from fine to coarse
+TIMESERIES_WIDTHS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800,
+                     3600, 7200, 10800, 21600, 43200, 86400, 172800, 604800)
+# max number of buckets of a time series by default
+MAX_TIMESERIES_POINTS = 300
+# upper bound of the max number of buckets a query may ask for
+TIMESERIES_POINTS_LIMIT = 1000
+
+
+def is_error(status):
+    """Whether a response status code is counted as an error"""
+    return status is not None and status >= ERROR_STATUS
+
+
+class LatencySketch(object):
+    """ A mergeable quantile sketch in DDSketch style: values are counted in
+        logarithmic buckets, so quantiles have a bounded relative error.
+    """
+
+    __slots__ = ("bins", "zero_count")
+
+    # relative accuracy of quantiles
+    ALPHA = 0.01
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    LOG_GAMMA = math.log(GAMMA)
+    # values no greater than it(seconds) are counted as zero
+    MIN_VALUE = 1e-6
+
+    def __init__(self, bins=None, zero_count=0):
+        self.bins = bins if bins is not None else dict()
+        self.zero_count = zero_count
+
+    @classmethod
+    def key(cls, value):
+        """Get bucket index of a value"""
+        if value <= cls.MIN_VALUE:
+            return None
+        return int(math.ceil(math.log(value) / cls.LOG_GAMMA))
+
+    @classmethod
+    def value(cls, key):
+        """Get representative value of a bucket index"""
+        if key is None:
+            return 0.0
+        return 2 * cls.GAMMA ** key / (cls.GAMMA + 1)
+
+    def add(self, value, count=1):
+        key = self.key(value)
+        if key is None:
+            self.zero_count += count
+        else:
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def remove(self, value, count=1):
+        key = self.key(value)
+        if key is None:
+            self.zero_count -= count
+            return
+        remaining = self.bins.get(key, 0) - count
+        if remaining > 0:
+            self.bins[key] = remaining
+        else:
+            self.bins.pop(key, None)
+
+    def merge(self, other):
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def dumps(self):
+        """Serialize into a compact JSON string"""
+        return json.dumps(dict(z=self.zero_count, b=self.bins),
+                          separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, data):
+        """Deserialize from a string returned by `dumps`"""
+        data = json.loads(data)
+        return cls(bins=dict((int(k), v) for k, v in data["b"].items()),
+                   zero_count=data["z"])
+
+    def quantile(self, q):
+        """ Get approximate q-quantile
+
+        :param q: a float in [0, 1]
+        :return: None if sketch is empty
+        """
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(max(self.bins))
+
+
+class LatencyStats(object):
+    """ Mergeable latency statistics: count, error count, sum, min, max and
+        a sketch, plus sums of per-measurement metrics such as phase
+        timings.
+    """
+
+    __slots__ = ("count", "errors", "total", "min", "max", "sketch",
+                 "metrics")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = LatencySketch()
+        self.metrics = dict()
+
+    def add(self, value, metrics=None, error=False):
+        """
+        :param value: a latency
+        :param metrics: a dict mapping metric name to number, or None
+        :param error: whether the response was an error, see `is_error`
+        """
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.sketch.add(value)
+        if metrics:
+            self._add_metrics(metrics)
+
+    def _add_metrics(self, metrics, sign=1):
+        sums = self.metrics
+        for key, value in metrics.items():
+            sums[key] = sums.get(key, 0) + sign * value
+
+    def remove(self, value, metrics=None, error=False):
+        """ Remove a value added before
+
+        :return: True if the value was min or max, which can't be restored
+                 from the sketch and must be recomputed by the caller
+        """
+        self.count -= 1
+        if error:
+            self.errors -= 1
+        self.total -= value
+        self.sketch.remove(value)
+        if metrics:
+            self._add_metrics(metrics, -1)
+        if not self.count:
+            self.errors = 0
+            self.total = 0.0
+            self.min = self.max = None
+            self.metrics = dict()
+            return False
+        return value == self.min or value == self.max
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.sketch.merge(other.sketch)
+        if other.metrics:
+            self._add_metrics(other.metrics)
+
+    def percentile(self, q):
+        value = self.sketch.quantile(q)
+        if value is None:
+            return None
+        # a bucket's representative value may exceed the real range
+        return min(max(value, self.min), self.max)
+
+    def as_dict(self):
+        """ Get a dict of count, errors, min, max, avg, percentiles and
+            average of each metric per measurement. Metrics of sampled
+            measurements only, "<prefix>.<field>" with a "<prefix>.samples"
+            count, are averaged per sampled measurement instead.
+        """
+        data = dict(
+            count=self.count,
+            errors=self.errors,
+            min=round(self.min or 0.0, 6),
+            max=round(self.max or 0.0, 6),
+            avg=round(self.total / self.count, 6) if self.count else 0.0,
+        )
+        for key, q in PERCENTILES:
+            data[key] = round(self.percentile(q) or 0.0, 6)
+        data["metrics"] = self._average_metrics() if self.count else {}
+        return data
+
+    def _average_metrics(self):
+        metrics = dict()
+        for key, value in self.metrics.items():
+            prefix, _, field = key.partition(".")
+            if field == "samples":
+                metrics[key] = value
+                continue
+            samples = self.metrics.get(prefix + ".samples") or self.count
+            metrics[key] = round(value / samples, 6)
+        return metrics
+
+    @classmethod
+    def from_values(cls, count, total, min_value, max_value, sketch,
+                    metrics=None, errors=0):
+        """Build statistics from stored fields"""
+        stats = cls()
+        stats.count = count
+        stats.errors = errors or 0
+        stats.total = total
+        stats.min = min_value
+        stats.max = max_value
+        stats.sketch = sketch
+        stats.metrics = dict(metrics or {})
+        return stats
+
+
+def query_groups(groups, **kwargs):
+    """ Search, sort and paginate grouped statistics the way
+        `Backend.group` does.
+
+    :param groups: a dict mapping (name, method) to `LatencyStats`
+    :param kwargs: search, name, method, sort, offset, limit, return_total
+    :return: a list of group dicts, or (total, list) if return_total
+    """
+    search = kwargs.get("search")
+    name = kwargs.get("name")
+    method = kwargs.get("method")
+    if search is not None:
+        search = search.lower()
+
+    data = []
+    for (group_name, group_method), stats in groups.items():
+        if not stats.count:
+            continue
+        if search is not None:
+            if (search not in group_name.lower() and
+                    search not in group_method.lower()):
+                continue
+        else:
+            if method is not None and group_method != method:
+                continue
+            if name is not None and group_name != name:
+                continue
+        group = stats.as_dict()
+        group["name"] = group_name
+        group["method"] = group_method
+        data.append(group)
+
+    sort = kwargs.get("sort", "count,desc").split(",")
+    if sort[0] not in GROUP_SORT_KEYS:
+        raise ValueError("Unknown sort attribute %r" % sort[0])
+    reverse = False
+    if len(sort) >= 2:
+        order = sort[1].lower()
+        if order not in ["asc", "desc"]:
+            raise ValueError("Unknown sort order %r" % sort[1])
+        reverse = order == "desc"
+    data.sort(key=lambda group: group[sort[0]], reverse=reverse)
+
+    total = len(data)
+    offset = kwargs.get("offset")
+    if offset is not None:
+        data = data[offset:]
+    limit = kwargs.get("limit")
+    if limit is not None:
+        data = data[:limit]
+
+    if kwargs.get("return_total", False):
+        return total, data
+    return data
+
+
+def timeseries_range(begin_time, finish_time, width=None,
+                     max_points=MAX_TIMESERIES_POINTS):
+    """ Choose the bucket width of a time series, the requested width or
+        the finest wider one in `TIMESERIES_WIDTHS` which cuts the range
+        into no more than max_points buckets
+
+    :param width: requested bucket width(seconds), or None
+    :return: (begin_time, finish_time, width), the range is widened to
+             whole buckets aligned on the width
+    """
+    if finish_time <= begin_time:
+        raise ValueError("Empty time range")
+    if width is not None and width <= 0:
+        raise ValueError("Bucket width must be positive")
+    if max_points < 2 or max_points > TIMESERIES_POINTS_LIMIT:
+        raise ValueError("Max points must be between 2 and %d"
+                         % TIMESERIES_POINTS_LIMIT)
+
+    widths = [value for value in TIMESERIES_WIDTHS
+              if width is None or value > width]
+    if width is not None:
+        widths.insert(0, width)
+    # NOTE: wider than all widths, one extra bucket for the alignment
+    widths.append(int(math.ceil((finish_time - begin_time) /
+                                (max_points - 1))))
+    for width in widths:
+        begin = begin_time - begin_time % width
+        finish = finish_time - finish_time % width
+        if finish < finish_time:
+            finish += width
+        if (finish - begin) / width <= max_points:
+            return begin, finish, width
+
+
+class Timeseries(object):
+    """ Latency statistics of a time range cut into buckets of a width """
+
+    def __init__(self, begin_time, finish_time, width):
+        """
+        :param begin_time: begin time of the first bucket
+        :param finish_time: finish time of the last bucket
+        :param width: seconds each bucket covers
+        """
+        self.begin_time = begin_time
+        self.finish_time = finish_time
+        self.width = width
+        self._size = int(round((finish_time - begin_time) / width))
+        # bucket index -> LatencyStats
+        self._buckets = dict()
+
+    @classmethod
+    def create(cls, begin_time=None, finish_time=None, width=None,
+               max_points=None, **kwargs):
+        """ Create a time series from query arguments, see
+            `timeseries_range`, of the last hour by default
+
+        :param kwargs: other query arguments, ignored
+        """
+        if finish_time is None:
+            finish_time = time.time()
+        if begin_time is None:
+            begin_time = finish_time - 3600
+        return cls(*timeseries_range(begin_time, finish_time, width,
+                                     max_points or MAX_TIMESERIES_POINTS))
+
+    def _stats(self, begin_time):
+        index = int((begin_time - self.begin_time) // self.width)
+        if index < 0 or index >= self._size:
+            return None
+        stats = self._buckets.get(index)
+        if stats is None:
+            stats = self._buckets[index] = LatencyStats()
+        return stats
+
+    def add(self, begin_time, elapse_time, status=None):
+        """Add a measurement to the bucket its begin_time falls in"""
+        stats = self._stats(begin_time)
+        if stats is not None:
+            stats.add(elapse_time, error=is_error(status))
+
+    def merge(self, begin_time, stats):
+        """ Merge statistics of a time bucket no wider than the width,
+            e.g. a rollup, into the bucket its begin_time falls in
+        """
+        bucket = self._stats(begin_time)
+        if bucket is not None:
+            bucket.merge(stats)
+
+    def as_dict(self):
+        """ Get a dict of begin_time, finish_time, width and points, one per
+            bucket including empty ones, each a dict of time, rate(count
+            per second) and the fields of `LatencyStats.as_dict` but
+            metrics
+        """
+        points = []
+        empty = None
+        for index in range(self._size):
+            stats = self._buckets.get(index)
+            if stats is None:
+                stats = empty = empty or LatencyStats()
+            point = stats.as_dict()
+            del point["metrics"]
+            point["time"] = self.begin_time + index * self.width
+            point["rate"] = round(stats.count / self.width, 6)
+            points.append(point)
+        return dict(begin_time=self.begin_time, finish_time=self.finish_time,
+                    width=self.width, points=points)
+
+
+class StatsAggregator(object):
+    """ In-memory streaming aggregation of latencies, keyed by
+        (name, method) per time bucket. It must be used on the IOLoop.
+    """
+
+    def __init__(self, window=3600, bucket_width=60):
+        """
+        :param window: seconds of statistics to retain
+        :param bucket_width: seconds each time bucket covers
+        """
+        self._bucket_width = bucket_width
+        self._max_buckets = max(1, int(math.ceil(window / bucket_width)))
+        # bucket start time -> {(name, method): LatencyStats}
+        self._buckets = collections.OrderedDict()
+
+    def add(self, name, method, begin_time, elapse_time, metrics=None,
+            error=False):
+        """Add a latency to the bucket its begin_time falls in"""
+        bucket = begin_time - begin_time % self._bucket_width
+        groups = self._buckets.get(bucket)
+        if groups is None:
+            groups = self._buckets[bucket] = dict()
+            if len(self._buckets) > 1 and \
+                    bucket < next(reversed(self._buckets)):
+                # keep buckets sorted in case of clock going backwards
+                self._buckets = collections.OrderedDict(
+                    sorted(self._buckets.items()))
+            while len(self._buckets) > self._max_buckets:
+                self._buckets.popitem(last=False)
+
+        key = (name, method)
+        stats = groups.get(key)
+        if stats is None:
+            stats = groups[key] = LatencyStats()
+        stats.add(elapse_time, metrics, error)
+
+    def merged(self, begin_time=None, finish_time=None):
+        """ Merge buckets overlapping with a time range
+
+        :return: a dict mapping (name, method) to `LatencyStats`
+        """
+        merged = dict()
+        for bucket, groups in self._buckets.items():
+            if begin_time is not None and \
+                    bucket + self._bucket_width <= begin_time:
+                continue
+            if finish_time is not None and bucket > finish_time:
+                continue
+            for key, stats in groups.items():
+                total = merged.get(key)
+                if total is None:
+                    total = merged[key] = LatencyStats()
+                total.merge(stats)
+        return merged
+
+    @property
+    def earliest_time(self):
+        """Begin time of the oldest retained bucket, None if empty"""
+        if not self._buckets:
+            return None
+        return next(iter(self._buckets))
+
+    def group(self, **kwargs):
+        """Same as `Backend.group`, plus percentiles in each group"""
+        groups = self.merged(kwargs.get("begin_time"),
+                             kwargs.get("finish_time"))
+        return query_groups(groups, **kwargs)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Request traces: datas collected by instrumentations of the code a
+    request calls, e.g. its outbound HTTP calls. The trace of the running
+    request is held by a context variable, so it's reachable from the
+    request's task and tasks it spawns.
+"""
+import time
+import contextvars
+
+from tornado.ioloop import IOLoop
+
+
+_CURRENT_TRACE = contextvars.ContextVar("tornado_profiler_trace",
+                                        default=None)
+
+
+def current_trace():
+    """ Get the trace of the request running in the current context
+
+    :return: a `RequestTrace` or None
+    """
+    return _CURRENT_TRACE.get()
+
+
+def run_in_executor(executor, func, *args):
+    """ Same as `IOLoop.run_in_executor`, but the function runs in a copy
+        of the current context, so what it does is attributed to the trace
+        of the running request, e.g. SQL statements.
+
+    :param executor: a `concurrent.futures.Executor`, None for the default
+    :return: a future of the result
+    """
+    context = contextvars.copy_context()
+    return IOLoop.current().run_in_executor(executor, context.run, func,
+                                            *args)
+
+
+class RequestTrace(object):
+    """ Datas of a request collected by instrumentations
+
+        * metrics: numbers stored as measurement metrics and averaged per
+          route by group APIs, e.g. "http.time"
+        * extensions: JSON-serializable values merged into the measurement
+          context, e.g. "http_calls"
+    """
+
+    __slots__ = ("metrics", "extensions", "_waits")
+
+    def __init__(self):
+        self.metrics = dict()
+        self.extensions = dict()
+        # kind -> [number of waits in flight, start of the wall time]
+        self._waits = dict()
+
+    def add_metric(self, key, value):
+        self.metrics[key] = self.metrics.get(key, 0) + value
+
+    def append(self, key, item, max_items):
+        """ Append an item to a list extension, at most `max_items` items
+            are kept, the others are counted in "<key>_dropped"
+        """
+        items = self.extensions.setdefault(key, [])
+        if len(items) < max_items:
+            items.append(item)
+        else:
+            dropped = key + "_dropped"
+            self.extensions[dropped] = self.extensions.get(dropped, 0) + 1
+
+    def keep_largest(self, key, field, value, make_item, max_items):
+        """ Keep the `max_items` items of a list extension with the largest
+            `field`, largest first, e.g. the slowest statements
+
+        :param make_item: a callable making the item, only called if kept
+        """
+        items = self.extensions.setdefault(key, [])
+        if len(items) >= max_items:
+            if max_items <= 0 or items[-1][field] >= value:
+                return
+            items.pop()
+        index = len(items)
+        while index > 0 and items[index - 1][field] < value:
+            index -= 1
+        items.insert(index, make_item())
+
+    def begin_wait(self, kind):
+        """ Begin waiting for something, e.g. a downstream service. The
+            wall time at least one wait of a kind is in flight is added to
+            the "<kind>.wait" metric, so concurrent waits count once.
+        """
+        wait = self._waits.get(kind)
+        if wait is None:
+            wait = self._waits[kind] = [0, 0.0]
+        if wait[0] == 0:
+            wait[1] = time.perf_counter()
+        wait[0] += 1
+
+    def end_wait(self, kind):
+        wait = self._waits[kind]
+        wait[0] -= 1
+        if wait[0] == 0:
+            self.add_metric(kind + ".wait", time.perf_counter() - wait[1])
+
+    def rounded_metrics(self):
+        return dict((key, round(value, 6))
+                    for key, value in self.metrics.items())
+
+
+def begin_trace(handler):
+    """ Start the trace of a request, available as `handler.profiler_trace_`
+        too, a request hook called in the task of the request, which has
+        its own copy of context.
+
+    :param handler: a tornado.web.RequestHandler instance
+    """
+    trace = handler.profiler_trace_ = RequestTrace()
+    _CURRENT_TRACE.set(trace)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+
+
+class HandlerTracker(object):
+    """ Track request handlers running on the IOLoop by their asyncio
+        task, so that code sampling the IOLoop, from another thread or a
+        signal handler, knows which request was running.
+    """
+
+    def __init__(self):
+        # running asyncio task of request handlers -> handler
+        self._tasks = dict()
+
+    def begin(self, handler):
+        """ Track a request, a request hook called in the task tornado runs
+            the request in
+
+        :param handler: a tornado.web.RequestHandler instance
+        """
+        self._tasks[asyncio.current_task()] = handler
+
+    def end(self, handler):
+        self._tasks.pop(asyncio.current_task(), None)
+
+    def current(self, loop):
+        """ Get the request handler running on an asyncio loop
+
+        :param loop: an asyncio event loop
+        :return: a handler instance or None
+        """
+        task = asyncio.current_task(loop)
+        if task is None:
+            return None
+        return self._tasks.get(task)
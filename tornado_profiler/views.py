@@ -1,21 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import io
+import csv
 import json
+import logging
 
 from tornado import gen
 import tornado.web
+from tornado.iostream import StreamClosedError
 
 from tornado_profiler.utils import str2bool
+from tornado_profiler.stats import TIMESERIES_POINTS_LIMIT
+
+
+LOG = logging.getLogger(__name__)
+
+
+def total_type(str_val):
+    """ Convert return_total argument: a boolean-like string or
+        "approximate"
+    """
+    if str_val.lower() == "approximate":
+        return "approximate"
+    return str2bool(str_val)
 
 
 class BaseHandler(tornado.web.RequestHandler):
 
     def initialize(self, template_path=None, static_path=None,
                    static_url_prefix=None):
-        self._executor = getattr(self.application,
-                                    "profiler_executor_", None)  # noqa
         self._backend = getattr(self.application,
-                                        "profiler_backend_")  # noqa
+                                "profiler_async_backend_")  # noqa
         self._template_path = template_path
         self._static_path = static_path
         self._static_url_prefix = static_url_prefix
@@ -85,11 +100,7 @@ class MeasurementHandler(APIHandler):
     def get_measurement_by_id(self, _id):
         """ Get a measurement by id
         """
-        if self._backend.is_nonblock():
-            measurement = self._backend.filter(id=_id)
-        else:
-            measurement = yield \
-                self._executor.submit(self._backend.filter, id=_id)
+        measurement = yield self._backend.filter(id=_id)
 
         response = dict(measurement=measurement)
         raise gen.Return(response)
@@ -145,16 +156,13 @@ class MeasurementHandler(APIHandler):
             sort=','.join([sort_col, sort_dir]),
             offset=start,
             limit=length,
-            return_total=True,
+            # NOTE: exact count of a huge table is too slow
+            return_total="approximate",
         )
         if search_kwargs:
             kwargs.update(search_kwargs)
         try:
-            if self._backend.is_nonblock():
-                total, measurements = self._backend.filter(**kwargs)
-            else:
-                total, measurements = yield \
-                    self._executor.submit(self._backend.filter, **kwargs)
+            total, measurements = yield self._backend.filter(**kwargs)
         except Exception as ex:
             self.set_status(500)
             raise gen.Return(
@@ -178,6 +186,8 @@ class MeasurementHandler(APIHandler):
             ("sort", str),
             ("offset", int),
             ("limit", int),
+            ("after", str),
+            ("return_total", total_type),
             ("with_context", str2bool),
         ]
         try:
@@ -192,18 +202,28 @@ class MeasurementHandler(APIHandler):
             raise gen.Return(
                 self.make_error_response(400, "Param %r error" % arg_name))
 
+        kwargs["with_cursor"] = True
         try:
-            if self._backend.is_nonblock():
-                measurements = self._backend.filter(**kwargs)
-            else:
-                measurements = yield \
-                    self._executor.submit(self._backend.filter, **kwargs)
+            result = yield self._backend.filter(**kwargs)
+        except ValueError:
+            self.set_status(400)
+            raise gen.Return(self.make_error_response(400, "Param error"))
         except Exception as ex:
             self.set_status(500)
             raise gen.Return(
                 self.make_error_response(500, "Profiler internal error", 1))
         else:
-            response = dict(measurements=measurements)
+            if kwargs.get("return_total"):
+                total, measurements = result
+                response = dict(total=total, measurements=measurements)
+            else:
+                measurements = result
+                response = dict(measurements=measurements)
+            # cursor used as `after` argument to get next page
+            limit = kwargs.get("limit")
+            if measurements and limit is not None and \
+                    len(measurements) == limit:
+                response["next"] = measurements[-1]["cursor"]
             raise gen.Return(response)
 
     @gen.coroutine
@@ -221,10 +241,107 @@ class MeasurementHandler(APIHandler):
         self.write(response)
 
 
+class ExportHandler(APIHandler):
+    """ Stream all measurements matching filter arguments, oldest first,
+        as NDJSON or CSV. Chunks are written and flushed one at a time, so
+        memory stays flat whatever the number of measurements.
+    """
+
+    CSV_FIELDS = ("id", "name", "method", "begin_time", "finish_time",
+                  "elapse_time", "status")
+    CONTENT_TYPES = {
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv; charset=UTF-8",
+    }
+
+    @staticmethod
+    def render_ndjson(measurements):
+        return "".join(json.dumps(measurement, separators=(",", ":")) + "\n"
+                       for measurement in measurements)
+
+    @classmethod
+    def render_csv(cls, measurements):
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        for measurement in measurements:
+            # NOTE: measurements of custom backends may have no status
+            row = [measurement.get(field) for field in cls.CSV_FIELDS]
+            if "context" in measurement:
+                # NOTE: nested fields are JSON encoded in their own column
+                row.append(json.dumps(measurement.get("metrics") or {}))
+                row.append(json.dumps(measurement["context"]))
+            writer.writerow(row)
+        return output.getvalue()
+
+    async def get(self):
+        query_args = [
+            ("begin_time", float),
+            ("finish_time", float),
+            ("method", str),
+            ("name", str),
+            ("with_context", str2bool),
+            ("chunk_size", int),
+        ]
+        try:
+            kwargs = dict()
+            for arg_name, arg_type in query_args:
+                value = self.get_argument(arg_name, None)
+                if value is not None:
+                    kwargs[arg_name] = arg_type(value)
+            _format = self.get_argument("format", "ndjson")
+            if _format not in self.CONTENT_TYPES:
+                raise ValueError(_format)
+            if kwargs.get("chunk_size", 1) <= 0:
+                raise ValueError(kwargs["chunk_size"])
+        except ValueError:
+            self.set_status(400)
+            self.write(self.make_error_response(400, "Param error"))
+            return
+
+        self.set_header("Content-Type", self.CONTENT_TYPES[_format])
+        self.set_header("Content-Disposition",
+                        "attachment; filename=measurements.%s" % _format)
+        if _format == "csv":
+            render = self.render_csv
+            fields = list(self.CSV_FIELDS)
+            if kwargs.get("with_context"):
+                fields.extend(["metrics", "context"])
+            self.write(",".join(fields) + "\n")
+        else:
+            render = self.render_ndjson
+
+        chunks = self._backend.iter_chunks(render=render, **kwargs)
+        try:
+            async for chunk in chunks:
+                self.write(chunk)
+                # NOTE: wait for the chunk to be sent before the next one
+                await self.flush()
+        except StreamClosedError:
+            return
+        except Exception:
+            # NOTE: headers are gone, the client sees a truncated body
+            LOG.exception("Failed to export measurements")
+            self.request.connection.close()
+            return
+        finally:
+            await chunks.aclose()
+
+
 class MeasGroupHandler(APIHandler):
     """ Measurements can be grouped by their names.
     """
 
+    @gen.coroutine
+    def group(self, **kwargs):
+        """ Group measurements, from streaming statistics if enabled
+        """
+        stats = getattr(self.application, "profiler_stats_", None)
+        if stats is not None:
+            result = stats.group(**kwargs)
+        else:
+            result = yield self._backend.group(**kwargs)
+        raise gen.Return(result)
+
     @gen.coroutine
     def get_datatable(self):
         """Datatable ajax source"""
@@ -233,6 +350,8 @@ class MeasGroupHandler(APIHandler):
             3: "avg",
             4: "max",
             5: "min",
+            6: "p90",
+            7: "p99",
         }
         try:
             echo = self.get_argument("sEcho", "1")
@@ -254,11 +373,7 @@ class MeasGroupHandler(APIHandler):
             return_total=True,
         )
         try:
-            if self._backend.is_nonblock():
-                total, measgroups = self._backend.group(**kwargs)
-            else:
-                total, measgroups = yield \
-                    self._executor.submit(self._backend.group, **kwargs)
+            total, measgroups = yield self.group(**kwargs)
         except Exception as ex:
             self.set_status(500)
             raise gen.Return(
@@ -294,11 +409,7 @@ class MeasGroupHandler(APIHandler):
                 self.make_error_response(400, "Param %r error" % arg_name))
 
         try:
-            if self._backend.is_nonblock():
-                measgroups = self._backend.group(**kwargs)
-            else:
-                measgroups = yield \
-                    self._executor.submit(self._backend.group, **kwargs)
+            measgroups = yield self.group(**kwargs)
         except Exception:
             self.set_status(500)
             raise gen.Return(
@@ -318,6 +429,177 @@ class MeasGroupHandler(APIHandler):
         self.write(response)
 
 
+class TimeseriesHandler(APIHandler):
+    """ Count, error count and latency percentiles of measurements over
+        time, for charts
+    """
+
+    @gen.coroutine
+    def get(self):
+        query_args = [
+            ("begin_time", float),
+            ("finish_time", float),
+            ("method", str),
+            ("name", str),
+            ("width", int),
+            ("max_points", int),
+        ]
+        try:
+            kwargs = dict()
+            for arg_name, arg_type in query_args:
+                value = self.get_argument(arg_name, None)
+                if value is not None:
+                    value = arg_type(value)
+                    kwargs[arg_name] = value
+        except ValueError:
+            self.set_status(400)
+            self.write(
+                self.make_error_response(400, "Param %r error" % arg_name))
+            return
+        # NOTE: reject before querying, the buckets are allocated upfront
+        if not 2 <= kwargs.get("max_points", 2) <= TIMESERIES_POINTS_LIMIT:
+            self.set_status(400)
+            self.write(self.make_error_response(
+                400, "Param 'max_points' must be between 2 and %d"
+                % TIMESERIES_POINTS_LIMIT))
+            return
+
+        try:
+            timeseries = yield self._backend.timeseries(**kwargs)
+        except ValueError as ex:
+            self.set_status(400)
+            self.write(self.make_error_response(400, str(ex)))
+        except Exception:
+            self.set_status(500)
+            self.write(
+                self.make_error_response(500, "Profiler internal error", 1))
+        else:
+            self.write(dict(timeseries=timeseries))
+
+
+class BlockingHandler(APIHandler):
+    """ Events of callbacks blocking the IOLoop, attributed to the request
+        which was running.
+    """
+
+    @gen.coroutine
+    def get_event_by_id(self, _id):
+        try:
+            _id = int(_id)
+        except ValueError:
+            self.set_status(400)
+            raise gen.Return(self.make_error_response(400, "Param error"))
+
+        event = yield self._backend.filter_blocking(id=_id)
+        raise gen.Return(dict(blocking_event=event))
+
+    @gen.coroutine
+    def get_events(self):
+        query_args = [
+            ("begin_time", float),
+            ("finish_time", float),
+            ("min_duration", float),
+            ("method", str),
+            ("name", str),
+            ("offset", int),
+            ("limit", int),
+            ("with_stack", str2bool),
+        ]
+        try:
+            kwargs = dict()
+            for arg_name, arg_type in query_args:
+                value = self.get_argument(arg_name, None)
+                if value is not None:
+                    value = arg_type(value)
+                    kwargs[arg_name] = value
+        except ValueError:
+            self.set_status(400)
+            raise gen.Return(
+                self.make_error_response(400, "Param %r error" % arg_name))
+
+        kwargs["return_total"] = True
+        try:
+            total, events = yield self._backend.filter_blocking(**kwargs)
+        except Exception:
+            self.set_status(500)
+            raise gen.Return(
+                self.make_error_response(500, "Profiler internal error", 1))
+        else:
+            raise gen.Return(dict(total=total, blocking_events=events))
+
+    @gen.coroutine
+    def get(self, *args):
+        if args and args[0]:
+            response = yield self.get_event_by_id(args[0])
+        else:
+            response = yield self.get_events()
+
+        self.write(response)
+
+
+class FlameGraphHandler(APIHandler):
+    """ Flame graph data of the CPU sampler: samples per route, or
+        collapsed stacks of a route.
+    """
+
+    def get(self):
+        sampler = getattr(self.application, "profiler_cpu_sampler_", None)
+        if sampler is None:
+            self.set_status(404)
+            self.write(self.make_error_response(
+                404, "CPU sampling is disabled"))
+            return
+
+        name = self.get_argument("name", None)
+        method = self.get_argument("method", None)
+        _format = self.get_argument("format", "json")
+        if _format not in ("json", "collapsed"):
+            self.set_status(400)
+            self.write(self.make_error_response(400, "Param 'format' error"))
+            return
+
+        if name is None and _format == "json":
+            response = sampler.stats()
+            response["routes"] = sampler.routes()
+            self.write(response)
+            return
+
+        stacks = sampler.collapsed(name=name, method=method)
+        if _format == "collapsed":
+            # NOTE: the input format of flamegraph.pl and speedscope
+            self.set_header("Content-Type", "text/plain; charset=UTF-8")
+            self.write("".join("%s %d\n" % (stack, count)
+                               for stack, count in stacks.items()))
+            return
+
+        response = sampler.stats()
+        response.update(
+            name=name,
+            method=method,
+            stacks=sorted(
+                [dict(stack=stack, samples=count)
+                 for stack, count in stacks.items()],
+                key=lambda stack: stack["samples"], reverse=True),
+        )
+        self.write(response)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """ Request metrics in the Prometheus text exposition format, rendered
+        from memory without querying the backend
+    """
+
+    def get(self):
+        metrics = getattr(self.application, "profiler_metrics_", None)
+        if metrics is None:
+            raise tornado.web.HTTPError(404)
+        writer = getattr(self.application, "profiler_writer_", None)
+        writer_stats = writer.stats() if writer is not None else None
+        self.set_header("Content-Type",
+                        "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render(writer_stats))
+
+
 ##############################
 #      Page Handlers
 ##############################
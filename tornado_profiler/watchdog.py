@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" IOLoop blocking detection: a heartbeat scheduled on the IOLoop is
+    watched by a background thread. When the heartbeat is late for more
+    than a threshold, the thread samples the stack of the IOLoop thread and
+    attributes it to the request handler whose task was running.
+"""
+import sys
+import time
+import logging
+import threading
+import traceback
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BlockingWatchdog(object):
+    """ Detect callbacks blocking the IOLoop for more than `threshold`
+        seconds. Each blocking is reported once it ends, as an event dict:
+
+        * begin_time: when the IOLoop got blocked
+        * duration: seconds the IOLoop was blocked
+        * name, method, uri and handler: route name, HTTP method, uri and
+          handler class of the request which was running, None if the
+          IOLoop wasn't running a request handler
+        * stack: frames of the IOLoop thread sampled during the blocking,
+          outermost first, each a "<file>:<line> in <function>" string
+    """
+
+    def __init__(self, callback, tracker, threshold=0.1, max_depth=50,
+                 name="tornado-profiler-watchdog"):
+        """
+        :param callback: a callable accepting an event dict, called on the
+                         IOLoop once the blocking ends
+        :param tracker: a `HandlerTracker` tracking handlers to attribute
+                        blocking to
+        :param threshold: min seconds of blocking to report
+        :param max_depth: max number of innermost frames sampled
+        :param name: name of the background thread
+        """
+        self._callback = callback
+        self._tracker = tracker
+        self._threshold = threshold
+        self._interval = threshold / 2.0
+        self._max_depth = max_depth
+        self._name = name
+
+        self._io_loop = None
+        self._loop_thread_id = None
+        # monotonic time the next heartbeat is expected
+        self._expected = None
+        # (expected, sampled event fields) of the ongoing blocking
+        self._sample = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start watching the current IOLoop"""
+        from tornado.ioloop import IOLoop
+
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._io_loop = IOLoop.current()
+        self._io_loop.add_callback(self._beat)
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _beat(self):
+        """Heartbeat running on the IOLoop"""
+        now = time.monotonic()
+        if self._loop_thread_id is None:
+            self._loop_thread_id = threading.get_ident()
+        expected = self._expected
+        if expected is not None and now - expected >= self._threshold:
+            self._report(expected, now - expected)
+        if self._stopping.is_set():
+            return
+        self._expected = now + self._interval
+        self._io_loop.call_later(self._interval, self._beat)
+
+    def _report(self, expected, duration):
+        event = dict(
+            begin_time=round(time.time() - duration, 6),
+            duration=round(duration, 6),
+            name=None,
+            method=None,
+            uri=None,
+            handler=None,
+            stack=[],
+        )
+        sample, self._sample = self._sample, None
+        if sample is not None and sample[0] == expected:
+            event.update(sample[1])
+        try:
+            self._callback(event)
+        except Exception:
+            LOG.exception("Failed to report blocking event")
+
+    def _inspect(self, frame):
+        """Get event fields from a frame of the blocked IOLoop thread"""
+        summary = traceback.StackSummary.extract(
+            traceback.walk_stack(frame), limit=self._max_depth,
+            lookup_lines=False)
+        fields = dict(stack=["%s:%d in %s" % (entry.filename, entry.lineno,
+                                              entry.name)
+                             for entry in reversed(summary)])
+
+        handler = self._tracker.current(self._io_loop.asyncio_loop)
+        if handler is not None:
+            request = handler.request
+            route = getattr(request, "profiler_route_", None)
+            fields.update(
+                name=route.name if route is not None else None,
+                method=request.method,
+                uri=request.uri,
+                handler=type(handler).__qualname__,
+            )
+        return fields
+
+    def _run(self):
+        while not self._stopping.wait(self._interval):
+            expected = self._expected
+            if expected is None or \
+                    time.monotonic() - expected < self._threshold:
+                continue
+            if self._sample is not None and self._sample[0] == expected:
+                # NOTE: sample each blocking once
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                self._sample = (expected, self._inspect(frame))
+            except Exception:
+                LOG.exception("Failed to sample the IOLoop thread")
+            finally:
+                del frame
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import logging
+import threading
+import collections
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BatchWriter(object):
+    """ Write-behind pipeline: a bounded in-process queue drained by a
+        background thread, which flushes records in batches.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+    def __init__(self, flush, batch_size=100, flush_interval=1.0,
+                 max_queue_size=10000, overflow="drop_oldest",
+                 periodic=None, periodic_interval=60,
+                 name="tornado-profiler-writer"):
+        """
+        :param flush: a callable accepting a list of records, e.g.
+                      `Backend.insert_many`
+        :param batch_size: flush as soon as this many records are queued
+        :param flush_interval: flush at least every `flush_interval` seconds
+        :param max_queue_size: max number of records waiting to be flushed
+        :param overflow: what to do when the queue is full, one of "block",
+                         "drop_oldest" and "drop_newest". "block" blocks
+                         the thread calling `put`, i.e. the IOLoop when
+                         the profiler's request hook feeds the writer
+        :param periodic: a callable called every `periodic_interval` seconds
+                         between flushes, e.g. `Backend.purge`
+        :param periodic_interval: seconds between two `periodic` calls
+        :param name: name of the background thread
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r" % overflow)
+        if batch_size <= 0 or max_queue_size <= 0:
+            raise ValueError("batch_size and max_queue_size must be positive")
+
+        self._flush = flush
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._overflow = overflow
+        self._periodic = periodic
+        self._periodic_interval = periodic_interval
+        self._name = name
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._thread = None
+        self._stopping = False
+
+        self._counters = collections.Counter()
+
+    def start(self):
+        """Start the background writer thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self._name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread after flushing queued records"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def put(self, record):
+        """Queue a record for writing.
+
+        :param record: a record which will be passed to `flush` in a batch
+        :return: False if the record was dropped, otherwise True
+        """
+        with self._lock:
+            if len(self._queue) >= self._max_queue_size:
+                if self._overflow == "drop_newest":
+                    self._counters["dropped_newest"] += 1
+                    return False
+                elif self._overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self._counters["dropped_oldest"] += 1
+                else:
+                    self._counters["blocked"] += 1
+                    while (len(self._queue) >= self._max_queue_size and
+                           not self._stopping):
+                        self._not_full.wait()
+            self._queue.append(record)
+            self._counters["queued"] += 1
+            if len(self._queue) >= self._batch_size:
+                self._not_empty.notify()
+        return True
+
+    def stats(self):
+        """ Get writer's counters
+        :return: a dict of counters
+        """
+        with self._lock:
+            stats = dict(
+                queued=0,
+                written=0,
+                failed=0,
+                flushes=0,
+                blocked=0,
+                dropped_oldest=0,
+                dropped_newest=0,
+            )
+            stats.update(self._counters)
+            stats["pending"] = len(self._queue)
+        stats["dropped"] = stats["dropped_oldest"] + stats["dropped_newest"]
+        return stats
+
+    def _take_batch(self):
+        """Wait until a batch is due, then pop it out of the queue"""
+        deadline = time.monotonic() + self._flush_interval
+        with self._lock:
+            while (len(self._queue) < self._batch_size and
+                   not self._stopping):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+
+            size = min(len(self._queue), self._batch_size)
+            batch = [self._queue.popleft() for _ in range(size)]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def _write(self, batch):
+        try:
+            self._flush(batch)
+        except Exception:
+            LOG.exception("Failed to write %d records", len(batch))
+            with self._lock:
+                self._counters["failed"] += len(batch)
+        else:
+            with self._lock:
+                self._counters["written"] += len(batch)
+                self._counters["flushes"] += 1
+
+    def _call_periodic(self):
+        try:
+            self._periodic()
+        except Exception:
+            LOG.exception("Failed to call periodic task %r", self._periodic)
+
+    def _run(self):
+        next_periodic = time.monotonic() + self._periodic_interval
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            if self._periodic is not None and \
+                    time.monotonic() >= next_periodic:
+                self._call_periodic()
+                next_periodic = time.monotonic() + self._periodic_interval
+            with self._lock:
+                if self._stopping and not self._queue:
+                    break
+
+
+class LoopWriter(object):
+    """ Write-behind pipeline running on the IOLoop, for backends which
+        don't block: records are queued and flushed in batches by
+        coroutines, no thread is involved. It must be used on the IOLoop.
+    """
+
+    def __init__(self, flush, batch_size=100, flush_interval=1.0,
+                 max_queue_size=10000, overflow="drop_oldest",
+                 periodic=None, periodic_interval=60):
+        """
+        :param flush: a coroutine function accepting a list of records
+        :param periodic: a coroutine function called every
+                         `periodic_interval` seconds, e.g. `Backend.purge`
+
+        Other arguments are the same as `BatchWriter`'s. Since the IOLoop
+        can't be blocked while waiting for itself, "block" overflow policy
+        flushes the queue right away and drops the newest record.
+        """
+        if overflow not in BatchWriter.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r" % overflow)
+        if batch_size <= 0 or max_queue_size <= 0:
+            raise ValueError("batch_size and max_queue_size must be positive")
+
+        self._flush = flush
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._overflow = overflow
+        self._periodic = periodic
+        self._periodic_interval = periodic_interval
+
+        self._queue = collections.deque()
+        self._flushing = False
+        self._callbacks = []
+        self._counters = collections.Counter()
+
+    def start(self):
+        """Start flushing periodically on the current IOLoop"""
+        from tornado.ioloop import PeriodicCallback
+
+        if self._callbacks:
+            return
+        self._callbacks.append(PeriodicCallback(
+            self._schedule_flush, self._flush_interval * 1000))
+        if self._periodic is not None:
+            self._callbacks.append(PeriodicCallback(
+                self._spawn_periodic, self._periodic_interval * 1000))
+        for callback in self._callbacks:
+            callback.start()
+
+    def stop(self, timeout=None):
+        """ Stop flushing periodically and flush queued records. Once the
+            IOLoop is stopped, e.g. by exit handlers, they are flushed on an
+            event loop of their own, for at most `timeout` seconds.
+        """
+        from tornado.ioloop import IOLoop
+
+        for callback in self._callbacks:
+            callback.stop()
+        self._callbacks = []
+        if not self._queue:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(
+                    asyncio.wait_for(self._drain(), timeout))
+            except asyncio.TimeoutError:
+                LOG.warning("Timed out flushing records, %d are dropped",
+                            len(self._queue))
+            finally:
+                loop.close()
+        else:
+            IOLoop.current().spawn_callback(self._drain)
+
+    def put(self, record):
+        """Same as `BatchWriter.put`, but never blocks"""
+        if len(self._queue) >= self._max_queue_size:
+            if self._overflow == "drop_oldest":
+                self._queue.popleft()
+                self._counters["dropped_oldest"] += 1
+            else:
+                if self._overflow == "block":
+                    self._counters["blocked"] += 1
+                    self._schedule_flush()
+                self._counters["dropped_newest"] += 1
+                return False
+        self._queue.append(record)
+        self._counters["queued"] += 1
+        if len(self._queue) >= self._batch_size:
+            self._schedule_flush()
+        return True
+
+    def stats(self):
+        """Same as `BatchWriter.stats`"""
+        stats = dict(
+            queued=0,
+            written=0,
+            failed=0,
+            flushes=0,
+            blocked=0,
+            dropped_oldest=0,
+            dropped_newest=0,
+        )
+        stats.update(self._counters)
+        stats["pending"] = len(self._queue)
+        stats["dropped"] = stats["dropped_oldest"] + stats["dropped_newest"]
+        return stats
+
+    def _schedule_flush(self):
+        from tornado.ioloop import IOLoop
+
+        if not self._flushing and self._queue:
+            self._flushing = True
+            IOLoop.current().add_callback(self._run)
+
+    async def _write_batch(self):
+        size = min(len(self._queue), self._batch_size)
+        batch = [self._queue.popleft() for _ in range(size)]
+        try:
+            await self._flush(batch)
+        except Exception:
+            LOG.exception("Failed to write %d records", len(batch))
+            self._counters["failed"] += len(batch)
+        else:
+            self._counters["written"] += len(batch)
+            self._counters["flushes"] += 1
+
+    async def _run(self):
+        try:
+            while self._queue:
+                await self._write_batch()
+                if len(self._queue) < self._batch_size:
+                    break
+        finally:
+            self._flushing = False
+
+    async def _drain(self):
+        """Flush all queued records"""
+        while self._queue:
+            await self._write_batch()
+
+    def _spawn_periodic(self):
+        from tornado.ioloop import IOLoop
+
+        IOLoop.current().spawn_callback(self._call_periodic)
+
+    async def _call_periodic(self):
+        try:
+            await self._periodic()
+        except Exception:
+            LOG.exception("Failed to call periodic task %r", self._periodic)